@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Admission Control
+Paces LLM calls to the provider's requests-per-minute and tokens-per-minute
+limits with two token buckets, so a burst of students queues briefly here
+instead of turning into a storm of 429s from the API.
+
+Calls that can't start at once wait in a bounded queue. The queue is fair
+across sessions: waiting sessions take turns, one call each, so one student
+firing off many requests can't starve the rest. A call is rejected straight
+away, with a Retry-After estimate, when the queue is full or its expected
+wait exceeds ADMISSION_MAX_WAIT.
+
+A call's token cost is its estimated prompt tokens plus max_tokens, the same
+way the provider counts a request against its TPM limit.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from context_packer import estimate_tokens
+
+# Provider limits for the primary model; 0 disables that bucket
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "3500"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "200000"))
+# Bucket capacity in seconds of allowance: how much of a burst goes out at once
+ADMISSION_BURST_SECONDS = float(os.getenv("ADMISSION_BURST_SECONDS", "5"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+# Longest a call may wait for admission before it is rejected
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "20"))
+
+# How often async waiters re-check the queue (they can't wait on the condition)
+_ASYNC_POLL_SECONDS = 0.05
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call can't be admitted; retry_after is in whole seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second up to a burst capacity."""
+
+    def __init__(self, per_minute, burst_seconds=ADMISSION_BURST_SECONDS):
+        self.enabled = per_minute > 0
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (amounts above capacity count as a full bucket)."""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        if self.enabled:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def seconds_for(self, amount):
+        """Steady-state time the bucket needs to supply amount."""
+        return min(amount, self.capacity) / self.rate if self.enabled else 0.0
+
+
+def call_cost(messages, max_tokens):
+    """Estimated tokens a chat call counts against the TPM limit."""
+    return sum(estimate_tokens(message.get('content', '')) for message in messages) + max_tokens
+
+
+class AdmissionController:
+    """RPM + TPM token buckets in front of LLM calls, with a fair bounded wait queue."""
+
+    def __init__(self, rpm=LLM_RPM_LIMIT, tpm=LLM_TPM_LIMIT, max_queue=ADMISSION_MAX_QUEUE,
+                 max_wait=ADMISSION_MAX_WAIT, burst_seconds=ADMISSION_BURST_SECONDS):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._sessions = OrderedDict()  # session -> deque of waiters, in turn order
+        self._waiting = 0
+        self._counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0, 'wait_seconds': 0.0}
+
+    @property
+    def enabled(self):
+        return self.requests.enabled or self.tokens.enabled
+
+    def _wait_time(self, cost, now):
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(cost, now))
+
+    def _take(self, cost, now, waited):
+        self.requests.take(1, now)
+        self.tokens.take(cost, now)
+        self._counters['admitted'] += 1
+        self._counters['wait_seconds'] += waited
+
+    def _expected_delay(self, cost, now):
+        """Rough wait for a new call: everyone queued ahead at steady-state pace, then this one."""
+        per_call = max(self.requests.seconds_for(1), self.tokens.seconds_for(cost))
+        return self._wait_time(cost, now) + self._waiting * per_call
+
+    def _reject(self, reason, delay):
+        self._counters['rejected'] += 1
+        return AdmissionRejected(reason, max(1, math.ceil(delay)))
+
+    def _head(self):
+        for waiters in self._sessions.values():
+            return waiters[0]
+        return None
+
+    def _remove(self, waiter):
+        waiters = self._sessions.get(waiter['session'])
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self._waiting -= 1
+        if not waiters:
+            del self._sessions[waiter['session']]
+        else:
+            # The session's turn is used; its next call goes to the back of the round
+            self._sessions.move_to_end(waiter['session'])
+        self._cond.notify_all()
+
+    def _enter(self, session, cost):
+        """Admit at once (None) or queue and return a waiter; raises AdmissionRejected."""
+        now = time.monotonic()
+        if not self._waiting and self._wait_time(cost, now) == 0:
+            self._take(cost, now, 0.0)
+            return None
+        delay = self._expected_delay(cost, now)
+        if self._waiting >= self.max_queue:
+            raise self._reject("Too many requests are waiting", delay)
+        if delay > self.max_wait:
+            raise self._reject("Request rate limit reached", delay)
+        waiter = {'session': session, 'cost': cost, 'queued': now, 'deadline': now + self.max_wait}
+        self._sessions.setdefault(session, deque()).append(waiter)
+        self._waiting += 1
+        self._counters['queued'] += 1
+        return waiter
+
+    def _poll(self, waiter):
+        """Admit the waiter (returns 0) if it is its turn and the buckets allow; else seconds to wait before re-checking."""
+        now = time.monotonic()
+        if self._head() is waiter:
+            delay = self._wait_time(waiter['cost'], now)
+            if delay == 0:
+                self._take(waiter['cost'], now, now - waiter['queued'])
+                self._remove(waiter)
+                return 0.0
+        else:
+            delay = None
+        remaining = waiter['deadline'] - now
+        if remaining <= 0:
+            self._counters['timed_out'] += 1
+            raise self._reject("Timed out waiting for the request rate limit", self._expected_delay(waiter['cost'], now))
+        return min(delay, remaining) if delay is not None else remaining
+
+    def admit(self, session, cost):
+        """Block until the call may start; returns seconds waited or raises AdmissionRejected."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            waiter = self._enter(session, cost)
+            if waiter is None:
+                return 0.0
+            try:
+                while True:
+                    delay = self._poll(waiter)
+                    if delay == 0:
+                        return time.monotonic() - waiter['queued']
+                    self._cond.wait(delay)
+            except BaseException:
+                self._remove(waiter)
+                raise
+
+    async def admit_async(self, session, cost):
+        """admit() for the event loop: waits with asyncio.sleep instead of blocking a thread."""
+        if not self.enabled:
+            return 0.0
+        with self._cond:
+            waiter = self._enter(session, cost)
+        if waiter is None:
+            return 0.0
+        try:
+            while True:
+                with self._cond:
+                    delay = self._poll(waiter)
+                if delay == 0:
+                    return time.monotonic() - waiter['queued']
+                await asyncio.sleep(min(delay, _ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                self._remove(waiter)
+            raise
+
+    def stats(self):
+        with self._cond:
+            counters = dict(self._counters)
+            counters.update({
+                'waiting': self._waiting,
+                'waiting_sessions': len(self._sessions),
+                'rpm_limit': self.requests.rate * 60 if self.requests.enabled else None,
+                'tpm_limit': self.tokens.rate * 60 if self.tokens.enabled else None,
+                'max_queue': self.max_queue,
+                'max_wait_seconds': self.max_wait
+            })
+        admitted = counters['admitted']
+        counters['average_wait_seconds'] = round(counters.pop('wait_seconds') / admitted, 3) if admitted else 0.0
+        return counters
@@ -4,20 +4,39 @@ CPA Study Agent - Tax Court Exam Prep Buddy
 Deployed on Hugging Face Spaces
 """
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context
 import os
-import random
 from dotenv import load_dotenv
-from openai import OpenAI
-import pdfplumber
-import chromadb
-import re
 import threading
 import time
+import json
+import gzip
+import zlib
+import base64
+import hashlib
+import importlib.util
+import sys
+import uuid
 
 # Load environment variables (works for both .env files and Hugging Face Spaces secrets)
 load_dotenv()
 
+from question_bank import get_question_bank, summarize_question
+from chroma_pool import get_registry
+from retrieval_cache import RetrievalCache
+from embeddings import get_embedder
+from question_context import QuestionContextStore, precompute_question_contexts
+from vector_index import VectorIndexHandle
+from bm25_index import BM25Handle, reciprocal_rank_fusion
+from topics import TOPICS, classify_text, normalize_topic
+from context_packer import ChunkVectors, format_context, pack_context, packing_stats
+from llm_backends import get_llm
+from admission import AdmissionController, AdmissionRejected, call_cost
+from prompts import build_ask_question_messages, build_check_answer_messages, build_grading_messages
+from response_cache import RESPONSE_CACHE_GRADING_THRESHOLD, ResponseCache, make_scope
+from reference_answers import ReferenceAnswerStore, question_hash
+from ingest_jobs import IngestJobRunner
+
 # Import Hugging Face Spaces configuration
 try:
     from huggingface_spaces_config import setup_huggingface_environment, get_environment_info
@@ -39,248 +58,582 @@ questions_folder = os.path.join(project_root, "data", "questions")
 textbooks_folder = os.path.join(project_root, "data", "textbooks")  # Updated to match actual folder structure
 chroma_db_path = os.path.join(project_root, "db", "chroma_db_test")
 
-def setup_openai_client():
-    """Set up OpenAI client using environment variables."""
-    # Try multiple ways to get the API key for Hugging Face Spaces compatibility
-    api_key = os.getenv("OPENAI_API_KEY")
-    
-    # Debug information
-    print(f"Debug: API key found: {'Yes' if api_key else 'No'}")
-    if api_key:
-        print(f"Debug: API key starts with: {api_key[:10]}...")
-        print(f"Debug: API key length: {len(api_key)}")
-    
-    # More flexible validation for Hugging Face Spaces
-    if not api_key:
-        print("❌ Error: OPENAI_API_KEY environment variable not found")
-        print("💡 For Hugging Face Spaces: Make sure to add OPENAI_API_KEY to your repository secrets")
-        print("💡 Go to Settings > Secrets and variables > Actions > New repository secret")
-        print("💡 Name: OPENAI_API_KEY, Value: your_actual_api_key")
-        return None
-    
-    if api_key == "your_openai_api_key_here" or api_key.strip() == "":
-        print("❌ Error: OPENAI_API_KEY is set to placeholder value")
-        return None
-    
-    # Check if it looks like a valid OpenAI API key (including project keys)
-    if not (api_key.startswith("sk-") or api_key.startswith("sk-proj-")):
-        print("❌ Error: OPENAI_API_KEY doesn't appear to be a valid OpenAI API key")
-        print("💡 Valid keys start with 'sk-' or 'sk-proj-'")
-        return None
-    
-    try:
-        client = OpenAI(api_key=api_key)
-        print("✅ OpenAI client created successfully")
-        return client
-    except Exception as e:
-        print(f"❌ Error creating OpenAI client: {e}")
-        return None
+# 'chroma' queries the HNSW index; 'numpy' uses the exact memory-mapped matrix
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma").lower()
+# Fuse BM25 keyword results with the vector results
+LEXICAL_FUSION = os.getenv("LEXICAL_FUSION", "").lower() in ("1", "true", "yes")
+chroma_registry = get_registry(chroma_db_path)
+retrieval_cache = RetrievalCache()
+query_embedder = get_embedder()
+# Stored vectors of retrieved chunks, for context packing
+chunk_vectors = ChunkVectors()
+question_contexts = QuestionContextStore()
+vector_index = VectorIndexHandle(chroma_registry)
+keyword_index = BM25Handle(chroma_registry)
+response_cache = ResponseCache(embedder=query_embedder)
+reference_answers = ReferenceAnswerStore()
+llm = get_llm()
+# Paces completion calls to the provider's RPM/TPM limits
+llm_admission = AdmissionController()
+
+# Bump when build_check_answer_messages / build_ask_question_messages change,
+# so cached responses to the old prompts are no longer served
+PROMPT_VERSION = 1
+# Responses are cached under the primary backend's model; overflow answers are not cached
+CHAT_MODEL = llm.model
+# Grading against a stored reference answer needs far fewer output tokens
+GRADING_MAX_TOKENS = int(os.getenv("GRADING_MAX_TOKENS", "350"))
+
+# /api/questions paging and compression settings
+QUESTIONS_PAGE_SIZE = 50
+QUESTIONS_MAX_PAGE_SIZE = 200
+COMPRESSION_MIN_BYTES = 1024
+
+# Chunks retrieved per prompt before packing them into CONTEXT_TOKEN_BUDGET
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "5"))
+
+# /api/retrieve-batch limits
+MAX_BATCH_QUERIES = 100
+MAX_BATCH_TOP_K = 20
 
 def setup_embedding_model():
-    """Set up embedding model using ChromaDB's default."""
-    try:
-        # Use ChromaDB's default embedding function
-        return None  # ChromaDB will use its default
-    except Exception as e:
-        print(f"Error setting up embedding model: {e}")
-        return None
+    """Return the shared embedder (the same one ingestion uses)."""
+    return query_embedder
 
 def setup_chroma_client():
-    """Set up ChromaDB client."""
+    """Return the process-wide ChromaDB client."""
     try:
-        client = chromadb.PersistentClient(path=chroma_db_path)
-        return client
+        return chroma_registry.client()
     except Exception as e:
         print(f"Error setting up ChromaDB: {e}")
         return None
 
-def retrieve_relevant_chunks(query, n_results=3):
-    """Retrieve relevant chunks from ChromaDB."""
-    client = setup_chroma_client()
+def vector_search_many(queries, n_results=3, topic=None):
+    """Nearest chunks by embedding for each query, from the NumPy index or ChromaDB.
     
-    if not client:
+    All queries are embedded in one batch and sent as one multi-query request.
+    With a topic, only chunks tagged with that topic are searched.
+    """
+    if not queries:
         return []
+    # Embed with the same model Chroma uses for query_texts, memoized per text
+    query_embeddings = query_embedder.encode(list(queries))
     
-    try:
-        # Get the collection (create if it doesn't exist)
-        collection = client.get_or_create_collection("textbook_chunks")
-        
-        # Search for relevant chunks using text query (ChromaDB will handle embeddings)
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
-        
-        # Format results
+    index = vector_index.get() if RETRIEVAL_BACKEND == 'numpy' else None
+    if index is not None:
+        return index.query(query_embeddings, n_results, topic, chunk_vectors)
+    
+    results = chroma_registry.run(lambda collection: collection.query(
+        query_embeddings=query_embeddings.tolist(),
+        n_results=n_results,
+        where={'topic': topic} if topic else None,
+        include=['documents', 'metadatas', 'embeddings']
+    ))
+    
+    # Format results, keeping the stored vectors for context packing
+    all_chunks = []
+    documents = results['documents'] or []
+    metadatas = results['metadatas'] or []
+    embeddings = results.get('embeddings')
+    if embeddings is None:
+        embeddings = []
+    for i in range(len(queries)):
         chunks = []
-        if results['documents'] and results['documents'][0]:
-            for i, doc in enumerate(results['documents'][0]):
-                metadata = results['metadatas'][0][i] if results['metadatas'] and results['metadatas'][0] else {}
-                chunks.append((doc, metadata))
-        
-        return chunks
+        docs = documents[i] if i < len(documents) and documents[i] else []
+        metas = metadatas[i] if i < len(metadatas) and metadatas[i] else []
+        for j, doc in enumerate(docs):
+            chunks.append((doc, metas[j] if j < len(metas) else {}))
+        if i < len(embeddings) and embeddings[i] is not None:
+            chunk_vectors.put(docs, embeddings[i])
+        all_chunks.append(chunks)
+    return all_chunks
+
+def vector_search(query, n_results=3, topic=None):
+    """Nearest chunks by embedding for a single query."""
+    return vector_search_many([query], n_results, topic)[0]
+
+def keyword_search(query, n_results=3, topic=None):
+    """Best BM25 matches; needs no embedding model."""
+    try:
+        index = keyword_index.get()
+        return index.query(query, n_results, topic) if index is not None else []
     except Exception as e:
-        print(f"Error retrieving chunks: {e}")
+        print(f"Error in keyword search: {e}")
         return []
 
+def retrieve_many(queries, top_k=3, topic=None):
+    """Retrieve relevant chunks for several queries at once.
+    
+    Cached queries are answered from memory; the rest share one batched
+    embedder call and one multi-query vector search. With LEXICAL_FUSION on,
+    vector and BM25 results are merged by reciprocal rank. Queries the vector
+    search finds nothing for fall back to BM25 results. With a topic, only
+    that topic's chunks are searched; queries that find nothing there (e.g.
+    in a collection ingested before chunks were tagged) search everything.
+    """
+    version = chroma_registry.version("textbook_chunks")
+    results = [None] * len(queries)
+    pending = {}  # normalized cache key -> positions of queries still to retrieve
+    for i, query in enumerate(queries):
+        cache_key = RetrievalCache.make_key(query, top_k, version, topic)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            chunks, vectors = cached
+            chunk_vectors.put([document for document, _ in chunks], vectors)
+            results[i] = list(chunks)
+        else:
+            pending.setdefault(cache_key, []).append(i)
+    if not pending:
+        return results
+    
+    keys = list(pending)
+    texts = [queries[pending[key][0]] for key in keys]
+    failed = False
+    try:
+        vector_top_k = top_k * 2 if LEXICAL_FUSION else top_k
+        vector_results = vector_search_many(texts, vector_top_k, topic)
+    except Exception as e:
+        print(f"Error retrieving chunks: {e}")
+        vector_results = [[] for _ in texts]
+        failed = True
+    
+    fused = []
+    for text, chunks in zip(texts, vector_results):
+        if LEXICAL_FUSION and not failed:
+            chunks = reciprocal_rank_fusion([chunks, keyword_search(text, top_k * 2, topic)], top_k=top_k)
+        if not chunks:
+            chunks = keyword_search(text, top_k, topic)
+        fused.append(chunks)
+    if topic:
+        unmatched = [j for j, chunks in enumerate(fused) if not chunks]
+        if unmatched:
+            for j, chunks in zip(unmatched, retrieve_many([texts[j] for j in unmatched], top_k)):
+                fused[j] = chunks
+    
+    for key, chunks in zip(keys, fused):
+        if not failed:
+            retrieval_cache.put(key, (tuple(chunks), tuple(chunk_vectors.get(document) for document, _ in chunks)))
+        for i in pending[key]:
+            results[i] = list(chunks)
+    return results
+
+def retrieve_relevant_chunks(query, n_results=3, topic=None):
+    """Retrieve relevant chunks from ChromaDB, served from the cache when possible."""
+    return retrieve_many([query], n_results, topic)[0]
+
+def get_context_chunks(question_text, n_results=CONTEXT_CANDIDATES):
+    """Stored context for bank questions, live retrieval for anything else.
+    
+    Live retrieval is limited to the question's topic: the bank's tag for
+    bank questions, a keyword guess for free text.
+    """
+    bank = get_question_bank(questions_folder)
+    question = bank.find_by_text(question_text)
+    topic = question.get('topic') if question is not None else classify_text(question_text)
+    if question is not None:
+        try:
+            chunks = question_contexts.chunks_for(question['id'], bank, chroma_registry, n_results, chunk_vectors)
+            if chunks is not None:
+                return chunks
+        except Exception as e:
+            print(f"Error reading stored question context: {e}")
+    return retrieve_relevant_chunks(question_text, n_results, topic)
+
+def pack_context_chunks(query, chunks):
+    """Drop near-duplicate chunks and fit the rest into the context token budget.
+    
+    Chunks are compared by their stored vectors; only the query is embedded
+    (and that is usually a cache hit from retrieval).
+    """
+    query_vector = None
+    if query:
+        try:
+            query_vector = query_embedder.encode(query)
+        except Exception as e:
+            print(f"Error embedding query for context packing: {e}")
+    packed, report = pack_context(chunks, query_vector, chunk_vectors)
+    if report['tokens_saved']:
+        print(f"Context packing: {report['chunks_in']} -> {report['chunks_out']} chunks, "
+              f"{report['tokens_saved']} of {report['tokens_in']} tokens saved")
+    return packed, report
+
+def precompute_contexts():
+    """Refresh the stored context of every bank question after ingestion."""
+    try:
+        bank = get_question_bank(questions_folder)
+        precompute_question_contexts(bank, chroma_registry, query_embedder, question_contexts)
+    except Exception as e:
+        print(f"Error precomputing question contexts: {e}")
+
 def load_questions_from_folder(folder_path):
-    """Load practice questions from PDF files."""
-    questions = []
-    
-    # First try to load from PDF files
-    if os.path.exists(folder_path):
-        for filename in os.listdir(folder_path):
-            if filename.lower().endswith('.pdf'):
-                pdf_path = os.path.join(folder_path, filename)
+    """Load practice questions from the cached question bank snapshot."""
+    return list(get_question_bank(folder_path).questions)
+
+def load_pdf_ingest():
+    """Import app/ingestion/pdf_ingest.py by path.
+    
+    This module is itself named app, so `from app.ingestion import ...`
+    cannot find the app/ directory.
+    """
+    module = sys.modules.get("pdf_ingest")
+    if module is None:
+        path = os.path.join(project_root, "app", "ingestion", "pdf_ingest.py")
+        spec = importlib.util.spec_from_file_location("pdf_ingest", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["pdf_ingest"] = module
+    return module
+
+def ingest_documents_to_chromadb(job=None):
+    """Ingest textbook documents into ChromaDB using the improved ingestion script.
+    
+    job is the ingest_jobs.IngestJob to report progress into, if any.
+    """
+    try:
+        pdf_ingest = load_pdf_ingest()
+        # Add to the collection this app reads from
+        success = pdf_ingest.ingest_pdfs_to_chromadb(collection=chroma_registry.collection(), progress=job)
+        # New chunks invalidate every cached retrieval result
+        chroma_registry.bump_version("textbook_chunks")
+        retrieval_cache.clear()
+        chunk_vectors.clear()
+        if success:
+            if job is not None:
+                job.set_phase("indexing")
+            if RETRIEVAL_BACKEND == 'numpy':
                 try:
-                    with pdfplumber.open(pdf_path) as pdf:
-                        full_text = ""
-                        for page in pdf.pages:
-                            page_text = page.extract_text()
-                            if page_text:
-                                full_text += "\n" + page_text
-                        
-                        # Use regex to extract questions
-                        pattern = r'(Question [A-Z]-\d+ \([^)]+\)[\s\S]*?)(?=Question [A-Z]-\d+ \(|\Z)'
-                        matches = re.findall(pattern, full_text, re.IGNORECASE)
-                        for q in matches:
-                            # Remove everything after 'SUGGESTED ANSWER:' if present
-                            marker = 'SUGGESTED ANSWER:'
-                            idx = q.upper().find(marker)
-                            if idx != -1:
-                                q = q[:idx].strip()
-                            if len(q.strip()) > 20:
-                                questions.append({'text': q.strip(), 'source': filename})
+                    vector_index.rebuild()
                 except Exception as e:
-                    print(f"Error processing {filename}: {e}")
-    
-    # If no questions found from PDFs, load sample questions
-    if not questions:
-        sample_questions_path = os.path.join(project_root, "sample_questions.txt")
-        if os.path.exists(sample_questions_path):
+                    print(f"Error exporting vector index: {e}")
             try:
-                with open(sample_questions_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # Split by double newlines to get individual questions
-                    question_blocks = content.split('\n\n')
-                    for block in question_blocks:
-                        if block.strip() and 'Question' in block:
-                            questions.append({'text': block.strip(), 'source': 'Sample Questions'})
+                keyword_index.rebuild()
             except Exception as e:
-                print(f"Error loading sample questions: {e}")
-    
-    # If still no questions, provide a default set
-    if not questions:
-        default_questions = [
-            "What is the primary purpose of the Tax Court in the United States?",
-            "What are the filing requirements for a petition to the Tax Court?",
-            "Who bears the burden of proof in Tax Court proceedings?",
-            "What are the Small Case Procedures in Tax Court?",
-            "How does the appeals process work for Tax Court decisions?"
-        ]
-        for q in default_questions:
-            questions.append({'text': q, 'source': 'Default Questions'})
-    
-    return questions
-
-def ingest_documents_to_chromadb():
-    """Ingest textbook documents into ChromaDB using the improved ingestion script."""
-    try:
-        # Import the improved ingestion function
-        from app.ingestion.pdf_ingest import ingest_pdfs_to_chromadb
-        return ingest_pdfs_to_chromadb()
+                print(f"Error building BM25 index: {e}")
+            if job is not None:
+                job.set_phase("precomputing")
+            precompute_contexts()
+        return success
     except Exception as e:
         print(f"Error importing or running ingestion script: {e}")
         return False
 
+ingest_jobs = IngestJobRunner(ingest_documents_to_chromadb)
+
 def get_simple_context(query):
     """Get simple context based on keywords instead of embeddings."""
-    # This is a simplified version that doesn't require sentence-transformers
-    # In a real deployment, you'd want to add back the embedding functionality
+    # BM25 over the ingested chunks; doesn't require sentence-transformers
+    keyword_chunks = keyword_search(query)
+    if keyword_chunks:
+        return format_context(keyword_chunks)
     return "Sample textbook context for Tax Court exam preparation."
 
-def check_answer_with_openai(question_text, user_answer, context_chunks=None, model='gpt-3.5-turbo'):
-    """Check student answer using OpenAI."""
-    client = setup_openai_client()
-    if client is None:
-        # Get more detailed error information
-        api_key = os.getenv("OPENAI_API_KEY")
-        debug_info = f"Debug: API key found: {'Yes' if api_key else 'No'}"
-        if api_key:
-            debug_info += f", starts with: {api_key[:10]}..."
-        return f"Error: OpenAI API key not configured. Please check your environment variables. {debug_info}"
+def reference_answer_for(question_text):
+    """The offline-generated reference answer for a bank question, or None."""
+    question = get_question_bank(questions_folder).find_by_text(question_text)
+    if question is None:
+        return None
+    return reference_answers.get(question)
+
+def grading_request(question_text, user_answer, context_chunks):
+    """Return (messages, max_tokens, cache kind) for grading an answer.
     
-    # Try to get relevant chunks from ChromaDB
-    context_chunks = retrieve_relevant_chunks(question_text)
+    Bank questions with a stored reference answer get the short comparison
+    prompt; anything else is solved and graded from the textbook context.
+    """
+    reference_answer = reference_answer_for(question_text)
+    if reference_answer is not None:
+        messages = build_grading_messages(
+            question_text, user_answer, reference_answer, context_sources_for(context_chunks)
+        )
+        return messages, GRADING_MAX_TOKENS, f"grade-reference:{question_hash(reference_answer)}"
+    context = format_context(context_chunks) if context_chunks else get_simple_context(question_text)
+    return build_check_answer_messages(question_text, user_answer, context), 1000, 'grade'
+
+def check_answer_with_llm(question_text, user_answer, context_chunks=None, backend=None):
+    """Check student answer using the LLM backend (llm.pick() unless one is given)."""
+    if not llm.available():
+        api_key_found = 'Yes' if os.getenv("OPENAI_API_KEY") else 'No'
+        return f"Error: {llm.problem()}. Please check your environment variables. (API key found: {api_key_found})"
+    backend = backend or llm.pick()
+    
+    # Use the question's stored context, or retrieve relevant chunks from ChromaDB
+    if context_chunks is None:
+        context_chunks, _ = pack_context_chunks(question_text, get_context_chunks(question_text))
+    
+    messages, max_tokens, _ = grading_request(question_text, user_answer, context_chunks)
+    
+    try:
+        return backend.complete(messages, max_tokens=max_tokens)
+    except Exception as e:
+        return f"Error calling {backend.label} API: {str(e)}"
+
+def prepare_check_answer(question_text, user_answer, bypass_cache=False):
+    """Blocking part of grading: context, prompt and response-cache lookup.
+    
+    Shared by the Flask route and the async server (asgi_app.py).
+    """
+    context_chunks, context_report = pack_context_chunks(question_text, get_context_chunks(question_text))
+    # Feedback is only shared between identical answers (see RESPONSE_CACHE_GRADING_THRESHOLD)
+    messages, max_tokens, cache_kind = grading_request(question_text, user_answer, context_chunks)
+    cache_scope = make_scope(cache_kind, CHAT_MODEL, PROMPT_VERSION, context_chunks, question_text)
+    return {
+        'context_chunks': context_chunks,
+        'context_sources': context_sources_for(context_chunks),
+        'context_report': context_report,
+        'messages': messages,
+        'max_tokens': max_tokens,
+        'cache_scope': cache_scope,
+        'cache_semantic': RESPONSE_CACHE_GRADING_THRESHOLD > 0,
+        'cached': response_cache.lookup(cache_scope, user_answer, bypass=bypass_cache,
+                                        threshold=RESPONSE_CACHE_GRADING_THRESHOLD),
+        'reference_answer_used': cache_kind != 'grade'
+    }
+
+def prepare_ask_question(question, bypass_cache=False):
+    """Blocking part of answering a custom question: context, prompt and cache lookup."""
+    # Try to get relevant chunks from ChromaDB, within the question's topic if it is clear
+    context_chunks, context_report = pack_context_chunks(
+        question, retrieve_relevant_chunks(question, CONTEXT_CANDIDATES, classify_text(question))
+    )
     
     if context_chunks:
-        context = "\n\n".join([
-            f"From {meta.get('filename', 'Unknown')} (page {meta.get('page', 'Unknown')}):\n{chunk}"
-            for chunk, meta in context_chunks
-        ])
+        context = format_context(context_chunks)
     else:
-        context = get_simple_context(question_text)
+        context = get_simple_context(question)
     
-    system_prompt = """You are Miles's enthusiastic and encouraging Tax Court Exam Prep Buddy! Your role is to:
-
-1. Help Miles prepare for the Tax Court exam with enthusiasm and positivity
-2. Evaluate his answers to practice questions with constructive, encouraging feedback
-3. Cite relevant textbook sources when possible
-4. Use warm, motivating language that builds confidence
-5. If an answer is incorrect, provide the correct answer with clear explanation while maintaining encouragement
-6. Remember that Miles is studying for the Tax Court exam specifically, so focus on tax law, court procedures, and relevant legal concepts
-7. Be supportive and remind Miles that learning is a process - every question is an opportunity to improve
-8. Use phrases like "Great effort!", "You're on the right track!", "Excellent thinking!", and "Keep up the great work!"
-
-Remember: You're not just a tutor, you're Miles's study buddy and cheerleader!"""
-
-    user_prompt = f"""Practice Question: {question_text}
-
-Student's Answer: {user_answer}
-
-Textbook Excerpts:
-{context}
+    # Paraphrases that retrieve the same context share a cached answer
+    cache_scope = make_scope('ask', CHAT_MODEL, PROMPT_VERSION, context_chunks)
+    return {
+        'context_chunks': context_chunks,
+        'context_sources': context_sources_for(context_chunks),
+        'context_report': context_report,
+        'messages': build_ask_question_messages(question, context),
+        'max_tokens': 1000,
+        'cache_scope': cache_scope,
+        'cache_semantic': True,
+        'cached': response_cache.lookup(cache_scope, question, bypass=bypass_cache)
+    }
+
+def context_sources_for(context_chunks):
+    """Citation strings for the chunks that went into a prompt."""
+    if not context_chunks:
+        return ['Sample Textbook']
+    return [f"{meta.get('filename', 'Unknown')} (page {meta.get('page', 'Unknown')})"
+            for _, meta in context_chunks]
+
+def wants_stream():
+    """True if the client asked for server-sent events."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    """Stream an iterable of SSE strings without buffering."""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def session_key():
+    """Fair-queuing key for admission control: one per browser session."""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def pick_admitted_backend(messages, max_tokens):
+    """Pick the backend for a call, waiting for admission if it is the primary.
+
+    The admission buckets model the primary's rate limits, so calls routed to
+    the overflow backend are not charged against them. Raises AdmissionRejected.
+    """
+    backend = llm.pick()
+    if backend is llm.primary:
+        llm_admission.admit(session_key(), call_cost(messages, max_tokens))
+    return backend
+
+def too_busy_response(rejected):
+    """429 with Retry-After for a call the admission controller turned away."""
+    response = jsonify({
+        'error': f'{rejected.reason}, please try again in {rejected.retry_after} seconds',
+        'retry_after': rejected.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
+
+def cache_bypass_requested(data, cache_arg, cache_control):
+    """True if ?cache=0, {"cache": false} or Cache-Control: no-cache asked to skip the cache."""
+    if (cache_arg or '').lower() in ('0', 'false', 'no'):
+        return True
+    if data.get('cache') is False:
+        return True
+    return 'no-cache' in (cache_control or '').lower()
+
+def cache_bypassed(data):
+    """True if the request asked to skip the response cache."""
+    return cache_bypass_requested(data, request.args.get('cache'), request.headers.get('Cache-Control'))
+
+def sources_event(context_sources, context_report):
+    return sse_event('sources', {'context_sources': context_sources, 'context_tokens': context_report})
+
+def done_event(started, retrieval_ms, first_token_ms, pieces):
+    return sse_event('done', {
+        'retrieval_ms': round(retrieval_ms, 1),
+        'first_token_ms': round(first_token_ms, 1) if first_token_ms is not None else None,
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        'chunks': pieces,
+        'cached': None
+    })
 
-Please provide feedback on the student's answer. Include:
-- Whether the answer is correct
-- What was good about their answer (if anything)
-- What needs improvement
-- The correct answer with explanation
-- Citations to relevant textbook sources"""
+def stream_cached(response, match, context_sources, context_report, started):
+    """Yield the SSE events for a response served from the response cache."""
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    yield sources_event(context_sources, context_report)
+    yield sse_event('token', {'text': response})
+    yield sse_event('done', {
+        'retrieval_ms': elapsed_ms,
+        'first_token_ms': elapsed_ms,
+        'total_ms': elapsed_ms,
+        'chunks': 1,
+        'cached': match
+    })
 
+def stream_completion(messages, context_sources, context_report, started,
+                      temperature=0.3, max_tokens=1000, cache_scope=None, cache_text=None, cache_semantic=True,
+                      backend=None):
+    """Yield SSE events: sources first, then model tokens as they arrive, then timings.
+    
+    The call goes to backend (llm.pick() unless one is given). With a
+    cache_scope, the complete response is stored in the response cache (if
+    the primary backend produced it).
+    """
+    retrieval_ms = (time.perf_counter() - started) * 1000
+    yield sources_event(context_sources, context_report)
+    first_token_ms = None
+    pieces = 0
+    parts = []
+    failed = False
+    backend = backend or llm.pick()
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content.strip()
+        for text in backend.stream(messages, max_tokens=max_tokens, temperature=temperature):
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            pieces += 1
+            parts.append(text)
+            yield sse_event('token', {'text': text})
     except Exception as e:
-        return f"Error calling OpenAI API: {str(e)}"
+        failed = True
+        yield sse_event('error', {'error': f'Error calling {backend.label} API: {str(e)}'})
+    if cache_scope is not None and not failed and backend is llm.primary:
+        response_cache.store(cache_scope, cache_text, "".join(parts).strip(), cache_semantic)
+    yield done_event(started, retrieval_ms, first_token_ms, pieces)
 
 @app.route('/')
 def index():
     """Main page with practice interface."""
     return render_template('index.html')
 
+def encode_cursor(version, offset):
+    """Encode an opaque pagination cursor tied to a question bank version."""
+    return base64.urlsafe_b64encode(f"{version}:{offset}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, version):
+    """Return the offset stored in a cursor, or None if it is invalid or stale."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_version, offset = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        offset = int(offset)
+    except Exception:
+        return None
+    if cursor_version != version or offset < 0:
+        return None
+    return offset
+
+def negotiate_encoding():
+    """Pick gzip or deflate from Accept-Encoding, or None for identity."""
+    gzip_q = request.accept_encodings.quality('gzip')
+    deflate_q = request.accept_encodings.quality('deflate')
+    if gzip_q <= 0 and deflate_q <= 0:
+        return None
+    return 'gzip' if gzip_q >= deflate_q else 'deflate'
+
+def conditional_json_response(etag, build_payload):
+    """Build a JSON response with a strong ETag, 304 handling and compression.
+
+    build_payload is only called when the client's copy is stale. Compressed
+    representations get their own ETag suffix, and any of them revalidates.
+    """
+    encoding = negotiate_encoding()
+    variants = (etag, f"{etag}-gzip", f"{etag}-deflate")
+    if any(request.if_none_match.contains(tag) for tag in variants):
+        response = app.response_class(status=304)
+    else:
+        body = json.dumps(build_payload(), separators=(',', ':')).encode('utf-8')
+        if encoding and len(body) < COMPRESSION_MIN_BYTES:
+            encoding = None
+        if encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        elif encoding == 'deflate':
+            body = zlib.compress(body, 6)
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/api/questions')
 def get_questions():
-    """Get available practice questions."""
-    questions = load_questions_from_folder(questions_folder)
-    return jsonify({
-        'questions': questions,
-        'count': len(questions)
-    })
+    """Get available practice questions, one page at a time.
+
+    Query parameters:
+    - cursor: opaque cursor from a previous page's next_cursor
+    - limit: page size (default 50, max 200)
+    - fields: 'full' (default) for complete records, 'summary' for ids and titles
+    """
+    bank = get_question_bank(questions_folder)
+    
+    fields = request.args.get('fields', 'full')
+    if fields not in ('full', 'summary'):
+        return jsonify({'error': "fields must be 'full' or 'summary'"}), 400
+    
+    limit = request.args.get('limit', QUESTIONS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, QUESTIONS_MAX_PAGE_SIZE))
+    
+    cursor = request.args.get('cursor')
+    offset = 0
+    if cursor:
+        offset = decode_cursor(cursor, bank.version)
+        if offset is None:
+            return jsonify({'error': 'Invalid or expired cursor, restart from the first page'}), 400
+    
+    page_key = f"{bank.version}:{fields}:{offset}:{limit}"
+    etag = hashlib.sha256(page_key.encode()).hexdigest()[:32]
+    
+    def build_payload():
+        page = bank.questions[offset:offset + limit]
+        if fields == 'summary':
+            page = [summarize_question(q) for q in page]
+        next_offset = offset + limit
+        return {
+            'questions': list(page),
+            'count': len(bank),
+            'version': bank.version,
+            'next_cursor': encode_cursor(bank.version, next_offset) if next_offset < len(bank) else None
+        }
+    
+    return conditional_json_response(etag, build_payload)
 
 @app.route('/api/random-question')
 def get_random_question():
-    """Get a random practice question."""
-    questions = load_questions_from_folder(questions_folder)
-    if not questions:
+    """Get a random practice question, optionally filtered by year, section, points and topic."""
+    bank = get_question_bank(questions_folder)
+    if not bank.questions:
         # Return a sample question if no PDFs are found
         sample_question = {
             'text': "What is the primary purpose of the Tax Court in the United States?",
@@ -288,12 +641,24 @@ def get_random_question():
         }
         return jsonify(sample_question)
     
-    question = random.choice(questions)
+    year = request.args.get('year', type=int)
+    section = request.args.get('section')
+    min_points = request.args.get('min_points', type=int)
+    topic = request.args.get('topic')
+    
+    question = bank.random_question(year=year, section=section, min_points=min_points, topic=topic)
+    if question is None:
+        return jsonify({'error': 'No questions match the requested filters'}), 404
     return jsonify(question)
 
 @app.route('/api/check-answer', methods=['POST'])
 def check_answer():
-    """Check a student's answer."""
+    """Check a student's answer.
+    
+    With ?stream=1 (or Accept: text/event-stream) the feedback is streamed as
+    server-sent events.
+    """
+    started = time.perf_counter()
     data = request.get_json()
     question_text = data.get('question')
     user_answer = data.get('answer')
@@ -301,40 +666,105 @@ def check_answer():
     if not question_text or not user_answer:
         return jsonify({'error': 'Question and answer are required'}), 400
     
-    # Get feedback from OpenAI
-    feedback = check_answer_with_openai(question_text, user_answer)
+    prepared = prepare_check_answer(question_text, user_answer, cache_bypassed(data))
+    context_sources = prepared['context_sources']
+    context_report = prepared['context_report']
+    cached = prepared['cached']
     
-    # Get context sources from chunks
-    context_sources = []
-    context_chunks = retrieve_relevant_chunks(question_text)
-    if context_chunks:
-        context_sources = [f"{meta.get('filename', 'Unknown')} (page {meta.get('page', 'Unknown')})" 
-                          for _, meta in context_chunks]
+    if wants_stream():
+        if cached is not None:
+            return sse_response(stream_cached(cached[0], cached[1], context_sources, context_report, started))
+        if not llm.available():
+            return sse_response(iter([
+                sources_event(context_sources, context_report),
+                sse_event('error', {'error': llm.problem()})
+            ]))
+        try:
+            backend = pick_admitted_backend(prepared['messages'], prepared['max_tokens'])
+        except AdmissionRejected as e:
+            return too_busy_response(e)
+        return sse_response(stream_completion(
+            prepared['messages'], context_sources, context_report, started,
+            max_tokens=prepared['max_tokens'], cache_scope=prepared['cache_scope'], cache_text=user_answer,
+            cache_semantic=prepared['cache_semantic'], backend=backend
+        ))
+    
+    if cached is not None:
+        feedback = cached[0]
+    elif not llm.available():
+        # No call can be made, so nothing is charged against the rate limits
+        feedback = check_answer_with_llm(question_text, user_answer, prepared['context_chunks'])
     else:
-        context_sources = ['Sample Textbook']
+        # Get feedback from the LLM, once the rate limits allow
+        try:
+            backend = pick_admitted_backend(prepared['messages'], prepared['max_tokens'])
+        except AdmissionRejected as e:
+            return too_busy_response(e)
+        feedback = check_answer_with_llm(question_text, user_answer, prepared['context_chunks'], backend)
+        if not feedback.startswith('Error') and backend is llm.primary:
+            response_cache.store(prepared['cache_scope'], user_answer, feedback, prepared['cache_semantic'])
     
     return jsonify({
         'feedback': feedback,
-        'context_sources': context_sources
+        'context_sources': context_sources,
+        'context_tokens': context_report,
+        'cached': cached[1] if cached is not None else None,
+        'reference_answer_used': prepared['reference_answer_used']
+    })
+
+@app.route('/api/retrieve-batch', methods=['POST'])
+def retrieve_batch():
+    """Retrieve textbook context for many queries in one request."""
+    data = request.get_json(silent=True) or {}
+    queries = data.get('queries')
+    top_k = data.get('top_k', 3)
+    topic = data.get('topic')
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per request'}), 400
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_BATCH_TOP_K:
+        return jsonify({'error': f'top_k must be an integer between 1 and {MAX_BATCH_TOP_K}'}), 400
+    if topic is not None and normalize_topic(topic) is None:
+        return jsonify({'error': f"topic must be one of: {', '.join(TOPICS)}"}), 400
+    
+    results = retrieve_many(queries, top_k, normalize_topic(topic))
+    return jsonify({
+        'results': [
+            {
+                'query': query,
+                'chunks': [
+                    {
+                        'text': chunk,
+                        'filename': meta.get('filename', 'Unknown'),
+                        'page': meta.get('page', 'Unknown'),
+                        'topic': meta.get('topic')
+                    }
+                    for chunk, meta in chunks
+                ]
+            }
+            for query, chunks in zip(queries, results)
+        ]
     })
 
 @app.route('/api/clear-database', methods=['POST'])
 def clear_database():
     """Clear the ChromaDB collection and restart fresh."""
+    if ingest_jobs.running() is not None:
+        return jsonify({'error': 'Cannot clear the database while an ingestion job is running'}), 409
     try:
         client = setup_chroma_client()
         if not client:
             return jsonify({'error': 'ChromaDB not available'}), 500
         
-        # Delete the existing collection
-        try:
-            client.delete_collection("textbook_chunks")
-            print("Deleted existing collection")
-        except:
-            print("No existing collection to delete")
-        
-        # Create a fresh collection
-        collection = client.create_collection("textbook_chunks")
+        # Delete the existing collection and create a fresh one
+        chroma_registry.recreate_collection("textbook_chunks")
+        retrieval_cache.clear()
+        chunk_vectors.clear()
+        question_contexts.clear()
+        vector_index.clear()
+        keyword_index.clear()
         print("Created fresh collection")
         
         return jsonify({'message': 'Database cleared successfully. You can now re-ingest documents.'})
@@ -401,16 +831,41 @@ def ingest_documents():
                     'sample_available': True
                 })
         
-        success = ingest_documents_to_chromadb()
-        if success:
-            return jsonify({'message': f'Successfully processed {len(pdf_files)} PDF files into ChromaDB'})
-        else:
-            return jsonify({'error': 'Failed to ingest documents - check server logs'}), 500
+        # Ingest in the background; progress is at /api/ingest-jobs/<job_id>
+        job = ingest_jobs.submit()
+        if job is None:
+            running = ingest_jobs.running()
+            return jsonify({
+                'error': 'An ingestion job is already running',
+                'job': running.snapshot() if running else None
+            }), 409
+        return jsonify({
+            'message': f'Started ingesting {len(pdf_files)} PDF files into ChromaDB',
+            'job_id': job.id,
+            'status_url': f'/api/ingest-jobs/{job.id}',
+            'job': job.snapshot()
+        }), 202
     except Exception as e:
         error_msg = f'Error ingesting documents: {str(e)}'
         print(error_msg)
         return jsonify({'error': error_msg}), 500
 
+@app.route('/api/ingest-jobs/<job_id>', methods=['GET'])
+def ingest_job_status(job_id):
+    """Progress and throughput of an ingestion job."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown ingestion job'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/api/ingest-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_ingest_job(job_id):
+    """Cancel a queued job, or stop a running one after its current batch."""
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown ingestion job'}), 404
+    return jsonify(job.snapshot())
+
 @app.route('/api/ingest-status', methods=['GET'])
 def ingest_status():
     """Check the status of document ingestion."""
@@ -419,8 +874,13 @@ def ingest_status():
         if not client:
             return jsonify({'error': 'ChromaDB not available'}), 500
         
-        collection = client.get_or_create_collection("textbook_chunks")
-        chunk_count = collection.count()
+        # While a job runs, its live counters; the collection count is only read when idle
+        job = ingest_jobs.latest()
+        job_status = job.snapshot() if job is not None else None
+        if job_status is not None and job_status['state'] == 'running':
+            chunk_count = None
+        else:
+            chunk_count = chroma_registry.run(lambda collection: collection.count())
         
         # Get list of PDF files from multiple locations
         files_info = {}
@@ -444,10 +904,18 @@ def ingest_status():
         return jsonify({
             'chunks_ingested': chunk_count,
             'total_pdf_files': total_pdf_files,
-            'has_data': chunk_count > 0,
+            'has_data': chunk_count > 0 if chunk_count is not None else job_status['chunks_added'] > 0,
+            'ingest_job': job_status,
             'files_info': files_info,
             'textbooks_folder_path': textbooks_folder,
-            'root_directory_path': project_root
+            'root_directory_path': project_root,
+            'retrieval_cache': retrieval_cache.stats(),
+            'embedding_cache': query_embedder.stats(),
+            'context_packing': packing_stats(),
+            'response_cache': response_cache.stats(),
+            'reference_answers': reference_answers.count(),
+            'llm_backends': llm.stats(),
+            'admission': llm_admission.stats()
         })
         
     except Exception as e:
@@ -455,76 +923,62 @@ def ingest_status():
 
 @app.route('/api/ask-question', methods=['POST'])
 def ask_question():
-    """Ask a custom question and get an answer."""
+    """Ask a custom question and get an answer.
+    
+    With ?stream=1 (or Accept: text/event-stream) the answer is streamed as
+    server-sent events.
+    """
+    started = time.perf_counter()
     data = request.get_json()
     question = data.get('question')
     
     if not question:
         return jsonify({'error': 'Question is required'}), 400
     
-    # Get answer from OpenAI
-    client = setup_openai_client()
-    if client is None:
-        return jsonify({'error': 'OpenAI API key not configured'}), 500
+    prepared = prepare_ask_question(question, cache_bypassed(data))
+    messages = prepared['messages']
+    context_sources = prepared['context_sources']
+    context_report = prepared['context_report']
+    cache_scope = prepared['cache_scope']
+    cached = prepared['cached']
+    if cached is not None:
+        if wants_stream():
+            return sse_response(stream_cached(cached[0], cached[1], context_sources, context_report, started))
+        return jsonify({
+            'answer': cached[0],
+            'context_sources': context_sources,
+            'context_tokens': context_report,
+            'cached': cached[1]
+        })
     
-    # Try to get relevant chunks from ChromaDB
-    context_chunks = retrieve_relevant_chunks(question)
+    # Get answer from the LLM
+    if not llm.available():
+        return jsonify({'error': llm.problem()}), 500
     
-    if context_chunks:
-        context = "\n\n".join([
-            f"From {meta.get('filename', 'Unknown')} (page {meta.get('page', 'Unknown')}):\n{chunk}"
-            for chunk, meta in context_chunks
-        ])
-    else:
-        context = get_simple_context(question)
+    try:
+        backend = pick_admitted_backend(messages, prepared['max_tokens'])
+    except AdmissionRejected as e:
+        return too_busy_response(e)
     
-    system_prompt = """You are Miles's enthusiastic and encouraging Tax Court Exam Prep Buddy! Use the provided textbook excerpts to answer questions accurately and comprehensively.
-
-Your role is to:
-1. Help Miles understand Tax Court exam concepts with enthusiasm and clarity
-2. Use warm, encouraging language that builds his confidence
-3. Focus on tax law, court procedures, and relevant legal concepts for the Tax Court exam
-4. If the context doesn't contain enough information, say so clearly but encouragingly
-5. Always cite the source (filename and page) when possible
-6. Use phrases like "Great question!", "Here's what you need to know for the Tax Court exam...", and "This is important for your exam prep!"
-
-Remember: You're Miles's study buddy and cheerleader - be enthusiastic and supportive!"""
+    if wants_stream():
+        return sse_response(stream_completion(
+            messages, context_sources, context_report, started,
+            cache_scope=cache_scope, cache_text=question, backend=backend
+        ))
     
-    user_prompt = f"""Use the following textbook excerpts to answer the question.
-
-Context:
-{context}
-
-Question: {question}
-
-Please provide a clear, accurate answer based on the context provided."""
-
     try:
-        response = client.chat.completions.create(
-            model='gpt-3.5-turbo',
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1000
-        )
-        answer = response.choices[0].message.content.strip()
-        
-        # Get context sources from chunks
-        context_sources = []
-        if context_chunks:
-            context_sources = [f"{meta.get('filename', 'Unknown')} (page {meta.get('page', 'Unknown')})" 
-                              for _, meta in context_chunks]
-        else:
-            context_sources = ['Sample Textbook']
+        answer = backend.complete(messages, max_tokens=prepared['max_tokens'])
+        if backend is llm.primary:
+            response_cache.store(cache_scope, question, answer)
         
         return jsonify({
             'answer': answer,
-            'context_sources': context_sources
+            'context_sources': context_sources,
+            'context_tokens': context_report,
+            'cached': None
         })
     except Exception as e:
-        return jsonify({'error': f'Error calling OpenAI API: {str(e)}'}), 500
+        return jsonify({'error': f'Error calling {backend.label} API: {str(e)}'}), 500
 
 # Hugging Face Spaces specific configuration
 app.config['PREFERRED_URL_SCHEME'] = 'https'
@@ -1,11 +1,9 @@
-import pdfplumber
 import re
 import os
+import sys
 import chromadb
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 import gc
-import time
 import logging
 
 # Set up logging
@@ -17,12 +15,21 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..
 persist_dir = os.path.join(project_root, "app", "db", "chroma_db_test")
 os.makedirs(persist_dir, exist_ok=True)
 folder_path = os.path.join(project_root, "data", "textbooks")
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from embeddings import get_embedder
+from pdf_extraction import extract_page_texts, extract_pdfs
+from topics import topic_for_chunk
 
 # Also check the root textbooks folder (for Hugging Face Spaces)
 textbooks_root = os.path.join(project_root, "textbooks")
 if os.path.exists(textbooks_root):
     folder_path = textbooks_root
 
+# Chunks embedded per model call and per collection.add
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
 print("ChromaDB absolute path:", persist_dir)
 print("Textbooks folder absolute path:", folder_path)
 
@@ -38,9 +45,8 @@ def setup_chroma_client():
 def setup_embedding_model():
     """Set up embedding model with error handling"""
     try:
-        # Use a smaller model for Hugging Face Spaces
-        embedder = SentenceTransformer('all-MiniLM-L6-v2')
-        return embedder
+        # Same backend as the query side (EMBEDDING_BACKEND)
+        return get_embedder()
     except Exception as e:
         print(f"Error setting up embedding model: {e}")
         return None
@@ -48,81 +54,92 @@ def setup_embedding_model():
 def get_embedding(text, embedder):
     """Get embedding with error handling"""
     try:
-        return embedder.encode(text).tolist()
+        return embedder.encode(text, use_cache=False).tolist()
     except Exception as e:
         print(f"Error getting embedding: {e}")
         return None
 
-def extract_chunks_from_pdf(pdf_path, max_chunk_size=500):
-    """Extract chunks from PDF with memory optimization"""
+def get_embeddings(texts, embedder):
+    """Embed a batch of texts in one call, falling back to one at a time on error"""
+    try:
+        return embedder.encode(texts, use_cache=False).tolist()
+    except Exception as e:
+        print(f"Error getting batch embeddings, retrying one by one: {e}")
+        return [get_embedding(text, embedder) for text in texts]
+
+def extract_chunks_from_pdf(pdf_path, max_chunk_size=500, page_texts=None):
+    """Extract chunks from PDF with memory optimization
+
+    page_texts can be passed in when the pages were already extracted.
+    """
     chunks = []
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages, start=1):
-                try:
-                    text = page.extract_text()
-                    if not text or len(text.strip()) < 50:
+        if page_texts is None:
+            page_texts = extract_page_texts(pdf_path)
+        for page_num, text in enumerate(page_texts, start=1):
+            try:
+                if not text or len(text.strip()) < 50:
+                    continue
+                
+                # Split into smaller chunks to reduce memory usage
+                paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
+                
+                for para in paragraphs:
+                    if len(para) < 30:  # Skip very short paragraphs
                         continue
-                    
-                    # Split into smaller chunks to reduce memory usage
-                    paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-                    
-                    for para in paragraphs:
-                        if len(para) < 30:  # Skip very short paragraphs
-                            continue
-                            
-                        # Further split long paragraphs
-                        if len(para) > max_chunk_size:
-                            # Split by sentences
-                            sentences = re.split(r'[.!?]+', para)
-                            current_chunk = ""
-                            
-                            for sentence in sentences:
-                                if len(current_chunk) + len(sentence) < max_chunk_size:
-                                    current_chunk += sentence + ". "
-                                else:
-                                    if current_chunk.strip():
-                                        chunks.append({
-                                            "chunk_text": current_chunk.strip(),
-                                            "page": page_num,
-                                            "section": None
-                                        })
-                                    current_chunk = sentence + ". "
-                            
-                            # Add remaining chunk
-                            if current_chunk.strip():
-                                chunks.append({
-                                    "chunk_text": current_chunk.strip(),
-                                    "page": page_num,
-                                    "section": None
-                                })
-                        else:
-                            section_match = re.match(r'^[A-Z][A-Z\s\-:]+$', para)
-                            section = para if section_match else None
+                        
+                    # Further split long paragraphs
+                    if len(para) > max_chunk_size:
+                        # Split by sentences
+                        sentences = re.split(r'[.!?]+', para)
+                        current_chunk = ""
+                        
+                        for sentence in sentences:
+                            if len(current_chunk) + len(sentence) < max_chunk_size:
+                                current_chunk += sentence + ". "
+                            else:
+                                if current_chunk.strip():
+                                    chunks.append({
+                                        "chunk_text": current_chunk.strip(),
+                                        "page": page_num,
+                                        "section": None
+                                    })
+                                current_chunk = sentence + ". "
+                        
+                        # Add remaining chunk
+                        if current_chunk.strip():
                             chunks.append({
-                                "chunk_text": para,
+                                "chunk_text": current_chunk.strip(),
                                 "page": page_num,
-                                "section": section
+                                "section": None
                             })
-                            
-                except Exception as e:
-                    print(f"Error processing page {page_num} in {pdf_path}: {e}")
-                    continue
-                    
+                    else:
+                        section_match = re.match(r'^[A-Z][A-Z\s\-:]+$', para)
+                        section = para if section_match else None
+                        chunks.append({
+                            "chunk_text": para,
+                            "page": page_num,
+                            "section": section
+                        })
+                        
+            except Exception as e:
+                print(f"Error processing page {page_num} in {pdf_path}: {e}")
+                continue
+                
     except Exception as e:
         print(f"Error opening PDF {pdf_path}: {e}")
         return []
     
     return chunks
 
-def ingest_pdfs_to_chromadb():
-    """Main function to ingest PDFs with improved error handling and memory management"""
-    
-    # Setup ChromaDB
-    chroma_client = setup_chroma_client()
-    if not chroma_client:
-        print("Failed to setup ChromaDB client")
-        return False
+def ingest_pdfs_to_chromadb(collection=None, progress=None):
+    """Main function to ingest PDFs with improved error handling and memory management
+
+    collection: add to this collection instead of opening persist_dir
+    (the web app passes its own). progress: optional job object (see
+    ingest_jobs.IngestJob) that receives per-file and per-chunk counters and
+    can request cancellation, which stops ingestion between batches.
+    """
     
     # Setup embedding model
     embedder = setup_embedding_model()
@@ -131,12 +148,17 @@ def ingest_pdfs_to_chromadb():
         return False
     
     # Get or create collection
-    try:
-        collection = chroma_client.get_or_create_collection("textbook_chunks")
-        print("Using ChromaDB directory:", persist_dir)
-    except Exception as e:
-        print(f"Error creating/getting collection: {e}")
-        return False
+    if collection is None:
+        chroma_client = setup_chroma_client()
+        if not chroma_client:
+            print("Failed to setup ChromaDB client")
+            return False
+        try:
+            collection = chroma_client.get_or_create_collection("textbook_chunks")
+            print("Using ChromaDB directory:", persist_dir)
+        except Exception as e:
+            print(f"Error creating/getting collection: {e}")
+            return False
     
     # Check if folder exists
     if not os.path.exists(folder_path):
@@ -156,27 +178,58 @@ def ingest_pdfs_to_chromadb():
         print("No PDF files found")
         return False
     
+    if progress is not None:
+        progress.files_found(pdf_files)
+        progress.set_phase("extracting")
+    
+    # Extract every PDF's pages up front, spread across the process pool
+    print(f"Extracting text from {len(pdf_files)} PDF files...")
+    page_texts_by_path = extract_pdfs([os.path.join(folder_path, f) for f in pdf_files])
+    
+    # Chunk every file before embedding so the total is known for progress reporting.
+    # All files' chunks are held at once; this replaces the page texts (freed
+    # below), which the parallel extraction already held for every file.
+    chunks_by_file = {}
+    for filename in pdf_files:
+        pdf_path = os.path.join(folder_path, filename)
+        page_texts = page_texts_by_path.get(pdf_path)
+        if page_texts is None:
+            print(f"Could not extract text from {filename}, skipping...")
+            continue
+        chunks_by_file[filename] = extract_chunks_from_pdf(pdf_path, page_texts=page_texts)
+    del page_texts_by_path
+    if progress is not None:
+        progress.chunks_found(sum(len(chunks) for chunks in chunks_by_file.values()))
+        progress.set_phase("embedding")
+    
     total_chunks_processed = 0
     total_chunks_added = 0
     
-    # Process files one by one to manage memory
+    # Embed and add files one by one, releasing each file's chunks once it is stored
     for filename in pdf_files:
-        pdf_path = os.path.join(folder_path, filename)
         print(f"\nProcessing: {filename}")
         print("-" * 40)
         
         try:
-            # Extract chunks
-            chunks = extract_chunks_from_pdf(pdf_path)
+            chunks = chunks_by_file.pop(filename, None)
+            if chunks is None:
+                continue
             print(f"Extracted {len(chunks)} chunks from {filename}")
+            if progress is not None:
+                progress.file_started(filename, len(chunks))
             
             if not chunks:
                 print(f"No chunks extracted from {filename}, skipping...")
+                if progress is not None:
+                    progress.file_done(filename)
                 continue
             
-            # Process chunks in smaller batches
-            batch_size = 5  # Smaller batch size for Hugging Face Spaces
+            # Process chunks in batches, embedding each batch in one call
+            batch_size = EMBED_BATCH_SIZE
             for i in range(0, len(chunks), batch_size):
+                if progress is not None and progress.cancelled():
+                    print(f"Ingestion cancelled after {total_chunks_added} chunks")
+                    return False
                 batch = chunks[i:i + batch_size]
                 
                 batch_ids = []
@@ -184,11 +237,11 @@ def ingest_pdfs_to_chromadb():
                 batch_metadatas = []
                 batch_documents = []
                 
+                embeddings = get_embeddings([chunk["chunk_text"] for chunk in batch], embedder)
                 for j, chunk in enumerate(batch):
                     chunk_id = f"{filename}_p{chunk['page']}_c{i+j}"
                     
-                    # Get embedding
-                    embedding = get_embedding(chunk["chunk_text"], embedder)
+                    embedding = embeddings[j]
                     if embedding is None:
                         print(f"Skipping chunk {chunk_id} due to embedding error")
                         continue
@@ -198,11 +251,13 @@ def ingest_pdfs_to_chromadb():
                     batch_metadatas.append({
                         "filename": filename,
                         "page": chunk["page"],
-                        "section": chunk["section"] if chunk["section"] is not None else ""
+                        "section": chunk["section"] if chunk["section"] is not None else "",
+                        "topic": topic_for_chunk(filename, chunk["chunk_text"])
                     })
                     batch_documents.append(chunk["chunk_text"])
                 
                 # Add batch to ChromaDB
+                added = 0
                 if batch_ids:
                     try:
                         collection.add(
@@ -211,19 +266,20 @@ def ingest_pdfs_to_chromadb():
                             metadatas=batch_metadatas,
                             documents=batch_documents
                         )
-                        total_chunks_added += len(batch_ids)
+                        added = len(batch_ids)
+                        total_chunks_added += added
                         print(f"Added batch of {len(batch_ids)} chunks from {filename}")
                     except Exception as e:
                         print(f"Error adding batch to ChromaDB: {e}")
                 
                 total_chunks_processed += len(batch)
-                
-                # Force garbage collection to free memory
-                gc.collect()
-                
-                # Small delay to prevent overwhelming the system
-                time.sleep(0.1)
+                if progress is not None:
+                    progress.chunks_done(len(batch), added)
             
+            # Free the file's chunks and embeddings before the next file
+            gc.collect()
+            if progress is not None:
+                progress.file_done(filename)
             print(f"Completed {filename}: {len(chunks)} chunks processed, {total_chunks_added} added to database")
             
         except Exception as e:
@@ -239,6 +295,7 @@ def ingest_pdfs_to_chromadb():
     return True
 
 if __name__ == "__main__":
+    # Worker processes re-import this module, so keep the entry point guarded
     success = ingest_pdfs_to_chromadb()
     if success:
         print("PDF ingestion completed successfully!")
@@ -1,7 +1,6 @@
 import chromadb
 import os
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+import sys
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -9,6 +8,14 @@ load_dotenv()
 
 # Set up project-root-relative persist directory
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from embeddings import get_embedder
+from context_packer import format_context
+from llm_backends import get_llm
+from prompts import build_ask_question_messages
+
 persist_dir = os.path.join(project_root, "app", "db", "chroma_db_test")
 os.makedirs(persist_dir, exist_ok=True)
 print("ChromaDB absolute path:", persist_dir)
@@ -18,21 +25,7 @@ chroma_client = chromadb.PersistentClient(path=persist_dir)
 collection = chroma_client.get_or_create_collection("textbook_chunks")
 
 # Load the same embedding model
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Initialize OpenAI client
-def setup_openai_client():
-    """Set up OpenAI client using environment variables."""
-    api_key = os.getenv("OPENAI_API_KEY")
-    
-    if not api_key:
-        print("⚠️  Warning: OPENAI_API_KEY not found in .env file")
-        print("Please add your OpenAI API key to the .env file:")
-        print("OPENAI_API_KEY=your_actual_api_key_here")
-        return None
-    
-    print("✅ OpenAI API key loaded successfully")
-    return OpenAI(api_key=api_key)
+embedder = get_embedder()
 
 def retrieve_relevant_chunks(query, top_k=5):
     query_embedding = embedder.encode(query).tolist()
@@ -49,42 +42,18 @@ def retrieve_relevant_chunks(query, top_k=5):
     # Returns a list of (chunk_text, metadata) tuples
     return list(zip(results['documents'][0], results['metadatas'][0]))
 
-def answer_with_openai(question, retrieved_chunks, model='gpt-3.5-turbo'):
-    """Answer questions using OpenAI instead of Ollama."""
-    client = setup_openai_client()
-    if client is None:
-        return "Error: OpenAI API key not configured. Please check your .env file."
-    
-    # Build context from retrieved chunks
-    context = "\n\n".join([f"From {meta['filename']} (page {meta['page']}):\n{chunk}" for chunk, meta in retrieved_chunks])
+def answer_with_llm(question, retrieved_chunks):
+    """Answer questions through the configured LLM backend (LLM_BACKEND)."""
+    llm = get_llm()
+    if not llm.available():
+        return f"Error: {llm.problem()}. Please check your .env file."
     
-    # Create the prompt
-    system_prompt = """You are a helpful CPA study assistant. Use the provided textbook excerpts to answer questions accurately and comprehensively. 
-    If the context doesn't contain enough information to answer the question, say so clearly.
-    Always cite the source (filename and page) when possible."""
-    
-    user_prompt = f"""Use the following textbook excerpts to answer the question.
-
-Context:
-{context}
-
-Question: {question}
-
-Please provide a clear, accurate answer based on the context provided."""
-
+    messages = build_ask_question_messages(question, format_context(retrieved_chunks))
+    backend = llm.pick()
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,  # Lower temperature for more focused answers
-            max_tokens=1000
-        )
-        return response.choices[0].message.content.strip()
+        return backend.complete(messages, max_tokens=1000)
     except Exception as e:
-        return f"Error calling OpenAI API: {str(e)}"
+        return f"Error calling {backend.label} API: {str(e)}"
 
 # Example usage:
 question = "What is the primary purpose of an audit?"
@@ -105,7 +74,7 @@ if __name__ == "__main__":
             print(chunk)
             print("-" * 40)
         if top_chunks:
-            answer = answer_with_openai(question, top_chunks, model='gpt-3.5-turbo')
-            print("\nOpenAI Answer:\n", answer)
+            answer = answer_with_llm(question, top_chunks)
+            print("\nAnswer:\n", answer)
         else:
             print("\nNo relevant chunks found. Try a different question or check your ChromaDB data.")
\ No newline at end of file
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Async Server
+Serves the same routes as app.py over ASGI:
+
+    python asgi_app.py            (or: uvicorn asgi_app:app --port 7860)
+
+Grading and custom questions (/api/check-answer, /api/ask-question) await
+the async LLM backends (llm_backends), so a request waiting on the model holds no thread
+and hundreds of them can be in flight at once. Their blocking steps --
+retrieval, embedding, the response cache -- run in a bounded thread pool
+(ASYNC_WORKER_THREADS). Every other route is handled by the Flask app
+itself inside the same pool, and its response is streamed to the client
+as the Flask side produces it.
+"""
+
+import asyncio
+import functools
+import io
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qs
+
+import app as web
+from admission import AdmissionRejected, call_cost
+
+# Threads for blocking work (Chroma, embedder, SQLite, Flask-served routes)
+ASYNC_WORKER_THREADS = int(os.getenv("ASYNC_WORKER_THREADS", "8"))
+
+executor = ThreadPoolExecutor(max_workers=ASYNC_WORKER_THREADS, thread_name_prefix="asgi-blocking")
+
+# Cookie naming the browser session for admission control's fair queue.
+# The async routes never run through Flask, so they can't use its session.
+SESSION_COOKIE = "llm_sid"
+_sid_pattern = re.compile(r'[0-9a-f]{32}')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the bounded pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def join_header(name, previous, value):
+    """Fold a repeated request header into one value.
+
+    Most headers are comma-joined, but cookies must be joined with "; "
+    or the combined Cookie header won't parse.
+    """
+    if previous is None:
+        return value
+    separator = '; ' if name.lower() == 'cookie' else ','
+    return f"{previous}{separator}{value}"
+
+
+class AsyncRequest:
+    """The parts of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.args = {key: values[-1] for key, values in
+                     parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            self.headers[name] = join_header(name, self.headers.get(name), value.decode('latin-1'))
+        self.issued_sid = None  # set when this response must set the session cookie
+
+    def json(self):
+        """The parsed JSON body, or None if it is missing or malformed."""
+        try:
+            data = json.loads(self.body or b'null')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def wants_stream(self):
+        if self.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return True
+        accept = self.headers.get('accept', '').split(',')[0].split(';')[0].strip()
+        return accept == 'text/event-stream'
+
+    def cache_bypassed(self, data):
+        return web.cache_bypass_requested(data, self.args.get('cache'), self.headers.get('cache-control'))
+
+    def session_key(self):
+        """Fair-queuing key: the session cookie's id, issuing a new one if the browser has none.
+
+        Behind a proxy every student shares one client address, so the
+        address can't tell them apart.
+        """
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.get('cookie', ''))
+        except CookieError:
+            pass
+        if SESSION_COOKIE in cookie and _sid_pattern.fullmatch(cookie[SESSION_COOKIE].value):
+            return cookie[SESSION_COOKIE].value
+        if self.issued_sid is None:
+            self.issued_sid = uuid.uuid4().hex
+        return self.issued_sid
+
+    def cookie_headers(self):
+        """Set-Cookie header for a newly issued session id, if any."""
+        if self.issued_sid is None:
+            return []
+        return [(b'set-cookie', f'{SESSION_COOKIE}={self.issued_sid}; Path=/; HttpOnly; SameSite=Lax'.encode('latin-1'))]
+
+    async def pick_backend(self, prepared):
+        """Pick the backend for the call, waiting for admission if it is the primary.
+
+        Returns (backend, None), or (None, the AdmissionRejected to answer
+        with). Overflow calls are not charged, as app.pick_admitted_backend.
+        """
+        backend = web.llm.pick()
+        if backend is web.llm.primary:
+            try:
+                await web.llm_admission.admit_async(self.session_key(),
+                                                    call_cost(prepared['messages'], prepared['max_tokens']))
+            except AdmissionRejected as e:
+                return None, e
+        return backend, None
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return body
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_too_busy(send, rejected):
+    """429 with Retry-After, as app.too_busy_response."""
+    await send_json(send, {
+        'error': f'{rejected.reason}, please try again in {rejected.retry_after} seconds',
+        'retry_after': rejected.retry_after
+    }, 429, [(b'retry-after', str(rejected.retry_after).encode())])
+
+
+async def send_sse(send, events):
+    """Send an (async or plain) iterable of SSE strings, flushing each one."""
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]
+    })
+    if hasattr(events, '__aiter__'):
+        async for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    else:
+        for event in events:
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def stream_completion(prepared, started, cache_text, backend, temperature=0.3):
+    """Async version of app.stream_completion for a prepared request."""
+    retrieval_ms = (time.perf_counter() - started) * 1000
+    yield web.sources_event(prepared['context_sources'], prepared['context_report'])
+    first_token_ms = None
+    pieces = 0
+    parts = []
+    failed = False
+    try:
+        async for text in backend.astream(prepared['messages'], prepared['max_tokens'], temperature):
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+            pieces += 1
+            parts.append(text)
+            yield web.sse_event('token', {'text': text})
+    except Exception as e:
+        failed = True
+        yield web.sse_event('error', {'error': f'Error calling {backend.label} API: {str(e)}'})
+    if not failed and backend is web.llm.primary:
+        await run_blocking(web.response_cache.store, prepared['cache_scope'], cache_text, "".join(parts).strip(),
+                           prepared['cache_semantic'])
+    yield web.done_event(started, retrieval_ms, first_token_ms, pieces)
+
+
+async def check_answer(request, send):
+    """Async /api/check-answer: same request and response shapes as the Flask route."""
+    started = time.perf_counter()
+    data = request.json() or {}
+    question_text = data.get('question')
+    user_answer = data.get('answer')
+
+    if not question_text or not user_answer:
+        return await send_json(send, {'error': 'Question and answer are required'}, 400)
+
+    prepared = await run_blocking(web.prepare_check_answer, question_text, user_answer,
+                                  request.cache_bypassed(data))
+    cached = prepared['cached']
+
+    if request.wants_stream():
+        if cached is not None:
+            return await send_sse(send, web.stream_cached(
+                cached[0], cached[1], prepared['context_sources'], prepared['context_report'], started
+            ))
+        if not web.llm.available():
+            return await send_sse(send, [
+                web.sources_event(prepared['context_sources'], prepared['context_report']),
+                web.sse_event('error', {'error': web.llm.problem()})
+            ])
+        backend, rejected = await request.pick_backend(prepared)
+        if rejected is not None:
+            return await send_too_busy(send, rejected)
+        return await send_sse(send, stream_completion(prepared, started, user_answer, backend))
+
+    if cached is not None:
+        feedback = cached[0]
+    else:
+        if not web.llm.available():
+            api_key_found = 'Yes' if os.getenv("OPENAI_API_KEY") else 'No'
+            feedback = f"Error: {web.llm.problem()}. Please check your environment variables. (API key found: {api_key_found})"
+        else:
+            backend, rejected = await request.pick_backend(prepared)
+            if rejected is not None:
+                return await send_too_busy(send, rejected)
+            try:
+                feedback = await backend.acomplete(prepared['messages'], prepared['max_tokens'])
+                if backend is web.llm.primary:
+                    await run_blocking(web.response_cache.store, prepared['cache_scope'], user_answer, feedback,
+                                       prepared['cache_semantic'])
+            except Exception as e:
+                feedback = f"Error calling {backend.label} API: {str(e)}"
+
+    await send_json(send, {
+        'feedback': feedback,
+        'context_sources': prepared['context_sources'],
+        'context_tokens': prepared['context_report'],
+        'cached': cached[1] if cached is not None else None,
+        'reference_answer_used': prepared['reference_answer_used']
+    })
+
+
+async def ask_question(request, send):
+    """Async /api/ask-question: same request and response shapes as the Flask route."""
+    started = time.perf_counter()
+    data = request.json() or {}
+    question = data.get('question')
+
+    if not question:
+        return await send_json(send, {'error': 'Question is required'}, 400)
+
+    prepared = await run_blocking(web.prepare_ask_question, question, request.cache_bypassed(data))
+    cached = prepared['cached']
+    if cached is not None:
+        if request.wants_stream():
+            return await send_sse(send, web.stream_cached(
+                cached[0], cached[1], prepared['context_sources'], prepared['context_report'], started
+            ))
+        return await send_json(send, {
+            'answer': cached[0],
+            'context_sources': prepared['context_sources'],
+            'context_tokens': prepared['context_report'],
+            'cached': cached[1]
+        })
+
+    if not web.llm.available():
+        return await send_json(send, {'error': web.llm.problem()}, 500)
+
+    backend, rejected = await request.pick_backend(prepared)
+    if rejected is not None:
+        return await send_too_busy(send, rejected)
+
+    if request.wants_stream():
+        return await send_sse(send, stream_completion(prepared, started, question, backend))
+
+    try:
+        answer = await backend.acomplete(prepared['messages'], prepared['max_tokens'])
+    except Exception as e:
+        return await send_json(send, {'error': f'Error calling {backend.label} API: {str(e)}'}, 500)
+    if backend is web.llm.primary:
+        await run_blocking(web.response_cache.store, prepared['cache_scope'], question, answer)
+    await send_json(send, {
+        'answer': answer,
+        'context_sources': prepared['context_sources'],
+        'context_tokens': prepared['context_report'],
+        'cached': None
+    })
+
+
+ASYNC_ROUTES = {
+    ('POST', '/api/check-answer'): check_answer,
+    ('POST', '/api/ask-question'): ask_question,
+}
+
+
+def call_flask(scope, body, emit):
+    """Serve one request with the Flask app (WSGI), handing the response to
+    emit() as it is produced: first (status, headers), then each body chunk.
+
+    The WSGI iterator is consumed start to finish in the calling thread:
+    stream_with_context keeps Flask's request context in contextvars, which
+    don't follow a generator from one thread to another.
+    """
+    server = scope.get('server') or ('localhost', 7860)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f"HTTP_{name}"
+        environ[key] = join_header(name, environ.get(key), value)
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    result = web.app(environ, start_response)
+    started = False
+    try:
+        # Flask has started the response already; send the headers before
+        # the first chunk so an SSE client sees them straight away
+        if response:
+            emit((response['status'], response['headers']))
+            started = True
+        for chunk in result:
+            # WSGI lets an app delay start_response until its first chunk
+            if not started:
+                emit((response['status'], response['headers']))
+                started = True
+            if chunk:
+                emit(chunk)
+        if not started:
+            emit((response['status'], response['headers']))
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def serve_flask(scope, body, send):
+    """Send a Flask-served response chunk by chunk as the worker thread produces it.
+
+    SSE streams and large pages reach the client as they are generated
+    instead of after the whole body is buffered. Each response holds one
+    worker thread (ASYNC_WORKER_THREADS) until it finishes.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def emit(item):
+        loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+    def produce():
+        try:
+            call_flask(scope, body, emit)
+        finally:
+            emit(None)
+
+    done = loop.run_in_executor(executor, produce)
+    while True:
+        item = await chunks.get()
+        if item is None:
+            break
+        if isinstance(item, tuple):
+            await send({'type': 'http.response.start', 'status': item[0], 'headers': item[1]})
+        else:
+            await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+    await done  # re-raises anything the Flask side raised
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await serve_flask(scope, body, send)
+
+    request = AsyncRequest(scope, body)
+    response_started = False
+
+    async def tracked_send(message):
+        nonlocal response_started
+        if message['type'] == 'http.response.start':
+            response_started = True
+            message = dict(message, headers=list(message.get('headers', [])) + request.cookie_headers())
+        await send(message)
+
+    try:
+        await handler(request, tracked_send)
+    except Exception as e:
+        print(f"Error handling {scope['path']}: {e}")
+        if not response_started:
+            await send_json(send, {'error': f'Error handling request: {str(e)}'}, 500)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The async server needs uvicorn: pip install uvicorn")
+
+    # Hugging Face Spaces expects port 7860
+    port = int(os.environ.get('PORT', 7860))
+    uvicorn.run(app, host='0.0.0.0', port=port)
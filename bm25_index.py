@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+BM25 Keyword Index
+Lexical retrieval over the same chunks as the vector store, with no embedding
+model involved. Each term's posting list is stored as a flat slice of two
+arrays (chunk rows as uint32, precomputed BM25 weights as float32), so a
+query is just a few vectorized additions. Used as the fallback when vector
+retrieval returns nothing, and optionally fused with the vector results.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+default_index_dir = os.path.join(project_root, "db", "bm25_index")
+
+POSTINGS_FILE = "postings.npz"
+TABLE_FILE = "table.json"
+
+K1 = 1.5
+B = 0.75
+EXPORT_BATCH_SIZE = 1000
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9§]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have
+he her his how i if in into is it its may might must no not of on or our she
+should so such than that the their them then there these they this those to
+was we were what when where which while who whom why will with would you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with per-posting BM25 weights."""
+
+    def __init__(self, terms, offsets, doc_ids, weights, ids, documents, metadatas):
+        self.terms = terms          # term -> position in offsets
+        self.offsets = offsets      # postings of term t are [offsets[t], offsets[t + 1])
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.chunk_count = None     # collection.count() when the saved index was built
+        rows_by_topic = {}
+        for row, metadata in enumerate(metadatas):
+            rows_by_topic.setdefault(metadata.get('topic'), []).append(row)
+        self.topic_rows = {topic: np.asarray(rows, dtype=np.uint32) for topic, rows in rows_by_topic.items()}
+
+    @classmethod
+    def build(cls, ids, documents, metadatas, k1=K1, b=B):
+        """Index a list of chunks."""
+        doc_lengths = []
+        postings = defaultdict(list)  # term -> [(row, tf)]
+        for row, document in enumerate(documents):
+            counts = Counter(tokenize(document or ""))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append((row, tf))
+
+        n_docs = len(documents)
+        avg_length = (sum(doc_lengths) / n_docs) if n_docs else 0.0
+        terms = {}
+        offsets = [0]
+        doc_ids = []
+        weights = []
+        for term in sorted(postings):
+            entries = postings[term]
+            df = len(entries)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for row, tf in entries:
+                norm = k1 * (1 - b + b * doc_lengths[row] / avg_length) if avg_length else k1
+                doc_ids.append(row)
+                weights.append(idf * tf * (k1 + 1) / (tf + norm))
+            terms[term] = len(offsets) - 1
+            offsets.append(len(doc_ids))
+
+        return cls(
+            terms,
+            np.asarray(offsets, dtype=np.uint32),
+            np.asarray(doc_ids, dtype=np.uint32),
+            np.asarray(weights, dtype=np.float32),
+            list(ids), list(documents), [m or {} for m in metadatas]
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, top_k=3, topic=None):
+        """Return [(row, score)] for the best-matching chunks, best first.
+
+        With a topic, only chunks tagged with that topic are returned.
+        """
+        n = len(self.ids)
+        if n == 0:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            # A term appears once per chunk, so plain fancy-index addition is safe
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        matched = np.flatnonzero(scores)
+        if topic:
+            matched = np.intersect1d(matched, self.topic_rows.get(topic, ()), assume_unique=True)
+        if len(matched) == 0:
+            return []
+        k = min(top_k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def query(self, query, top_k=3, topic=None):
+        """Return [(document, metadata)] for the best-matching chunks."""
+        return [(self.documents[row], self.metadatas[row]) for row, _ in self.search(query, top_k, topic)]
+
+    def save(self, index_dir=default_index_dir, chunk_count=None):
+        os.makedirs(index_dir, exist_ok=True)
+        postings_tmp = os.path.join(index_dir, "postings.tmp.npz")
+        table_tmp = os.path.join(index_dir, TABLE_FILE + ".tmp")
+        np.savez(postings_tmp, offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights)
+        with open(table_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'terms': sorted(self.terms, key=self.terms.get),
+                'ids': self.ids,
+                'documents': self.documents,
+                'metadatas': self.metadatas,
+                'chunk_count': chunk_count
+            }, f)
+        os.replace(postings_tmp, os.path.join(index_dir, POSTINGS_FILE))
+        os.replace(table_tmp, os.path.join(index_dir, TABLE_FILE))
+
+    @classmethod
+    def load(cls, index_dir=default_index_dir):
+        with np.load(os.path.join(index_dir, POSTINGS_FILE)) as postings:
+            offsets = postings['offsets']
+            doc_ids = postings['doc_ids']
+            weights = postings['weights']
+        with open(os.path.join(index_dir, TABLE_FILE), 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        terms = {term: i for i, term in enumerate(table['terms'])}
+        index = cls(terms, offsets, doc_ids, weights,
+                    table['ids'], table['documents'], table['metadatas'])
+        index.chunk_count = table.get('chunk_count')
+        return index
+
+
+def build_from_collection(registry, index_dir=default_index_dir, name="textbook_chunks"):
+    """Build a BM25 index over every chunk in the collection; saved unless it is empty."""
+    count = registry.run(lambda collection: collection.count(), name)
+    ids, documents, metadatas = [], [], []
+    for offset in range(0, count, EXPORT_BATCH_SIZE):
+        batch = registry.run(lambda collection: collection.get(
+            limit=EXPORT_BATCH_SIZE,
+            offset=offset,
+            include=['documents', 'metadatas']
+        ), name)
+        ids.extend(batch['ids'])
+        documents.extend(batch['documents'])
+        metadatas.extend(batch['metadatas'])
+    index = BM25Index.build(ids, documents, metadatas)
+    if not ids:
+        # Nothing ingested yet; a saved empty index would outlive the ingest
+        return index
+    index.save(index_dir, count)
+    index.chunk_count = count
+    print(f"Built BM25 index over {len(ids)} chunks ({len(index.terms)} terms)")
+    return index
+
+
+def reciprocal_rank_fusion(result_lists, top_k=3, k=60):
+    """Merge ranked [(document, metadata)] lists by reciprocal rank.
+
+    Chunks are matched across lists by their document text.
+    """
+    scores = {}
+    chunks = {}
+    for results in result_lists:
+        for rank, (document, metadata) in enumerate(results):
+            scores[document] = scores.get(document, 0.0) + 1.0 / (k + rank + 1)
+            chunks.setdefault(document, (document, metadata))
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [chunks[document] for document in ranked[:top_k]]
+
+
+class BM25Handle:
+    """Lazily loads the saved index, building it from the collection if missing or stale.
+
+    The saved index is stale when the collection's chunk count differs from
+    the one it was built at (another process may have re-ingested).
+    """
+
+    _unset = object()
+
+    def __init__(self, registry, index_dir=default_index_dir):
+        self.registry = registry
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = self._unset
+
+    def get(self):
+        """Return the loaded index, or None if it could not be loaded or built."""
+        version = self.registry.version()
+        if self._version == version:
+            return self._index
+        with self._lock:
+            if self._version != version:
+                self._index = None
+                try:
+                    if os.path.exists(os.path.join(self.index_dir, TABLE_FILE)):
+                        self._index = BM25Index.load(self.index_dir)
+                        count = self.registry.run(lambda collection: collection.count())
+                        if self._index.chunk_count != count:
+                            print("Saved BM25 index is stale; rebuilding")
+                            self._index = None
+                    if self._index is None:
+                        self._index = build_from_collection(self.registry, self.index_dir)
+                except Exception as e:
+                    print(f"Error loading BM25 index: {e}")
+                self._version = version
+            return self._index
+
+    def rebuild(self):
+        """Rebuild the index from the collection and keep it loaded."""
+        index = build_from_collection(self.registry, self.index_dir)
+        with self._lock:
+            self._index = index
+            self._version = self.registry.version()
+        return index
+
+    def clear(self):
+        """Delete the saved index; the next get() builds it again."""
+        with self._lock:
+            self._index = None
+            self._version = self._unset
+            for filename in (POSTINGS_FILE, TABLE_FILE):
+                try:
+                    os.remove(os.path.join(self.index_dir, filename))
+                except FileNotFoundError:
+                    pass
+
+
+if __name__ == "__main__":
+    from chroma_pool import get_registry
+    build_from_collection(get_registry(os.path.join(project_root, "db", "chroma_db_test")))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+ChromaDB Client Pool
+One lazily created PersistentClient per database path for the whole process,
+plus a registry of opened collections, so request handlers reuse a warm
+SQLite connection and HNSW index instead of re-opening them every call.
+"""
+
+import os
+import threading
+
+import chromadb
+
+# Disable ChromaDB telemetry to avoid warnings
+os.environ["ANONYMIZED_TELEMETRY"] = "False"
+
+DEFAULT_COLLECTION = "textbook_chunks"
+
+
+class ChromaRegistry:
+    """Thread-safe holder for one PersistentClient and its collections."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._client = None
+        self._collections = {}
+        self._versions = {}  # collection name -> change counter
+
+    def version(self, name=DEFAULT_COLLECTION):
+        """Return a counter that moves whenever the collection's contents change."""
+        return self._versions.get(name, 0)
+
+    def bump_version(self, name=DEFAULT_COLLECTION):
+        """Record that the collection's contents changed (e.g. after ingestion)."""
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            return self._versions[name]
+
+    def client(self):
+        """Return the shared client, creating it on first use."""
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._client = chromadb.PersistentClient(path=self.path)
+            return self._client
+
+    def collection(self, name=DEFAULT_COLLECTION):
+        """Return the named collection, creating it if it does not exist."""
+        collection = self._collections.get(name)
+        if collection is not None:
+            return collection
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self.client().get_or_create_collection(name)
+                self._collections[name] = collection
+            return collection
+
+    def reset(self):
+        """Forget the client and collections so the next call reconnects."""
+        with self._lock:
+            self._client = None
+            self._collections.clear()
+
+    def run(self, operation, name=DEFAULT_COLLECTION):
+        """Call operation(collection), reconnecting and retrying once on failure."""
+        try:
+            return operation(self.collection(name))
+        except Exception as e:
+            print(f"ChromaDB operation failed, reconnecting: {e}")
+            self.reset()
+            return operation(self.collection(name))
+
+    def recreate_collection(self, name=DEFAULT_COLLECTION):
+        """Delete the named collection (if present) and create it empty."""
+        with self._lock:
+            client = self.client()
+            self._collections.pop(name, None)
+            try:
+                client.delete_collection(name)
+                print("Deleted existing collection")
+            except Exception:
+                print("No existing collection to delete")
+            collection = client.create_collection(name)
+            self._collections[name] = collection
+            self.bump_version(name)
+            return collection
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path):
+    """Return the process-wide registry for a ChromaDB directory."""
+    path = os.path.abspath(path)
+    registry = _registries.get(path)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(path, ChromaRegistry(path))
+    return registry
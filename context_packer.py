@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Context Packer
+Sits between retrieval and prompt building. Retrieved chunks are compared
+by the vectors stored for them at ingest time (retrieval records them in a
+ChunkVectors table, so no chunk text is embedded again), near-duplicates are
+dropped -- the slide decks repeat textbook passages almost word for word --
+the rest are ordered by similarity to the query, and excerpts are added
+until a token budget is full. Token counts come from a local approximation, so no
+tokenizer download or API call is involved.
+"""
+
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Approximate prompt tokens allowed for the textbook context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+# Chunks at least this similar (cosine) to a kept chunk are dropped
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.92"))
+# Stored chunk vectors kept for packing (about 1.5 KB each at 384 dimensions)
+CHUNK_VECTOR_CACHE_SIZE = int(os.getenv("CHUNK_VECTOR_CACHE_SIZE", "8192"))
+
+_piece_pattern = re.compile(r"\w+|[^\w\s]")
+_whitespace = re.compile(r'\s+')
+
+_totals_lock = threading.Lock()
+_totals = {'requests': 0, 'tokens_in': 0, 'tokens_out': 0, 'duplicates_dropped': 0}
+
+
+def estimate_tokens(text):
+    """Approximate BPE token count: one per punctuation mark, ~4 characters per word piece."""
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _piece_pattern.findall(text or ""))
+
+
+def format_chunk(chunk, metadata):
+    """The excerpt as it appears in the prompt."""
+    return f"From {metadata.get('filename', 'Unknown')} (page {metadata.get('page', 'Unknown')}):\n{chunk}"
+
+
+def format_context(chunks):
+    return "\n\n".join(format_chunk(chunk, metadata) for chunk, metadata in chunks)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text at a word boundary so it fits in about max_tokens."""
+    used = 0
+    for match in _piece_pattern.finditer(text):
+        used += max(1, math.ceil(len(match.group(0)) / 4))
+        if used > max_tokens:
+            return text[:match.start()].rstrip() + " ..."
+    return text
+
+
+class ChunkVectors:
+    """Bounded LRU of stored chunk embeddings, keyed by document text.
+
+    Chunks are matched by their text, as in reciprocal_rank_fusion.
+    """
+
+    def __init__(self, max_entries=CHUNK_VECTOR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, documents, vectors):
+        with self._lock:
+            for document, vector in zip(documents, vectors):
+                if document is None or vector is None:
+                    continue
+                self._vectors[document] = np.asarray(vector, dtype=np.float32)
+                self._vectors.move_to_end(document)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def get(self, document):
+        with self._lock:
+            vector = self._vectors.get(document)
+            if vector is not None:
+                self._vectors.move_to_end(document)
+            return vector
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+def pack_context(chunks, query_vector=None, chunk_vectors=None, token_budget=CONTEXT_TOKEN_BUDGET,
+                 duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Return (packed chunks, report) for a list of (document, metadata) chunks.
+
+    chunk_vectors (a ChunkVectors) supplies the stored vector of each chunk.
+    Only chunks with a stored vector take part in the near-duplicate check
+    and similarity ordering; if any chunk lacks one, the retrieval order is
+    kept. Without chunk_vectors only exact (whitespace/case-insensitive)
+    duplicates are dropped.
+    """
+    chunks = [(document, metadata or {}) for document, metadata in chunks if document]
+    tokens_in = sum(estimate_tokens(format_chunk(*chunk)) for chunk in chunks)
+
+    # Exact duplicates first; they need no embedding
+    unique = []
+    seen = set()
+    for chunk in chunks:
+        key = _whitespace.sub(' ', chunk[0]).strip().lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+
+    kept = unique
+    stored = [chunk_vectors.get(document) for document, _ in unique] if chunk_vectors is not None else []
+    known = [row for row, vector in enumerate(stored) if vector is not None]
+    if len(known) > 1:
+        try:
+            vectors = np.zeros((len(unique), len(stored[known[0]])), dtype=np.float32)
+            vectors[known] = np.stack([stored[row] for row in known])
+            vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+            order = range(len(unique))
+            if query_vector is not None and len(known) == len(unique):
+                order = np.argsort(-(vectors @ np.asarray(query_vector, dtype=np.float32)), kind='stable')
+            kept_rows = []
+            compared = []  # kept rows that have a stored vector
+            for row in order:
+                if stored[row] is not None:
+                    if compared and float(np.max(vectors[compared] @ vectors[row])) >= duplicate_threshold:
+                        continue
+                    compared.append(row)
+                kept_rows.append(row)
+            kept = [unique[row] for row in kept_rows]
+        except Exception as e:
+            print(f"Error comparing chunks, packing without near-duplicate check: {e}")
+
+    packed = []
+    used = 0
+    separator = estimate_tokens("\n\n")
+    for document, metadata in kept:
+        cost = estimate_tokens(format_chunk(document, metadata)) + (separator if packed else 0)
+        if used + cost <= token_budget:
+            packed.append((document, metadata))
+            used += cost
+        elif not packed:
+            # Always send something: cut the best chunk down to the budget
+            overhead = estimate_tokens(format_chunk(" ...", metadata))
+            document = truncate_to_tokens(document, max(token_budget - overhead, 0))
+            packed.append((document, metadata))
+            used = estimate_tokens(format_chunk(document, metadata))
+
+    report = {
+        'chunks_in': len(chunks),
+        'chunks_out': len(packed),
+        'duplicates_dropped': len(chunks) - len(kept),
+        'tokens_in': tokens_in,
+        'tokens_out': used,
+        'tokens_saved': tokens_in - used,
+        'token_budget': token_budget
+    }
+    with _totals_lock:
+        _totals['requests'] += 1
+        _totals['tokens_in'] += tokens_in
+        _totals['tokens_out'] += used
+        _totals['duplicates_dropped'] += report['duplicates_dropped']
+    return packed, report
+
+
+def packing_stats():
+    """Totals across every pack_context call in this process."""
+    with _totals_lock:
+        totals = dict(_totals)
+    totals['tokens_saved'] = totals['tokens_in'] - totals['tokens_out']
+    return totals
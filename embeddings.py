@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Embeddings
+The one embedding module used by both ingestion and retrieval, so chunks and
+queries always go through the same model.
+
+Backends are pluggable (EMBEDDING_BACKEND): 'onnx' runs all-MiniLM-L6-v2 on
+ONNX Runtime with optional int8 dynamic quantization and no torch import;
+'sentence-transformers' and 'chroma-default' are kept for comparison.
+
+Every backend is wrapped in CachedEmbedder. Query texts mostly come from the
+fixed question bank, so their vectors are kept in a bounded LRU as float32
+arrays keyed by a hash of the text, with an optional on-disk spill for
+entries pushed out of memory. Repeated texts skip the model entirely.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx").lower()
+# int8 dynamic quantization of the ONNX model weights
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "1").lower() in ("1", "true", "yes")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", str(min(4, os.cpu_count() or 1))))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Directory holding model.onnx and tokenizer.json; unset reuses Chroma's download
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR") or None
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+# Directory for vectors evicted from memory; unset disables the spill
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR") or None
+
+
+class CachedEmbedder:
+    """Embeds texts through encode_batch, memoizing every vector it returns.
+
+    encode_batch takes a list of texts and returns one vector per text.
+    model_name labels the vectors in cache keys; it may be a callable that
+    returns the label, resolved on first use. encode() mirrors
+    SentenceTransformer.encode (a str gives a 1-D array, a list gives a 2-D
+    array) and the instance can also be passed to Chroma as an embedding
+    function.
+    """
+
+    def __init__(self, encode_batch, model_name, max_entries=EMBEDDING_CACHE_SIZE,
+                 spill_dir=EMBEDDING_CACHE_DIR):
+        self._encode_batch = encode_batch
+        self._model_name = model_name
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self._vectors = OrderedDict()  # text hash -> float32 vector
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def model_name(self):
+        if callable(self._model_name):
+            self._model_name = self._model_name()
+        return self._model_name
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.npy")
+
+    def _remember(self, key, vector):
+        """Store a vector in the LRU; caller holds the lock."""
+        self._vectors[key] = vector
+        self._vectors.move_to_end(key)
+        while len(self._vectors) > self.max_entries:
+            old_key, old_vector = self._vectors.popitem(last=False)
+            if self.spill_dir:
+                try:
+                    np.save(self._spill_path(old_key), old_vector)
+                except OSError as e:
+                    print(f"Error spilling embedding to disk: {e}")
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        try:
+            vector = np.load(self._spill_path(key))
+        except (OSError, ValueError):
+            return None
+        vector.setflags(write=False)
+        return vector
+
+    def encode(self, texts, use_cache=True, **kwargs):
+        """Return float32 embeddings, running the model only for unseen texts.
+
+        use_cache=False goes straight to the model without touching the LRU,
+        for one-off texts such as chunks during ingestion. Extra keyword
+        arguments are accepted for SentenceTransformer compatibility and
+        ignored.
+        """
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not use_cache:
+            if not texts:
+                return np.empty((0, 0), dtype=np.float32)
+            encoded = np.asarray(self._encode_batch(texts), dtype=np.float32).reshape(len(texts), -1)
+            return encoded[0] if single else encoded
+        keys = [self._key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}  # key -> text, so duplicates in one call are encoded once
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._vectors.get(key)
+                if vector is not None:
+                    self._vectors.move_to_end(key)
+                    self.hits += 1
+                    vectors[i] = vector
+        for i, key in enumerate(keys):
+            if vectors[i] is not None:
+                continue
+            vector = self._load_spilled(key)
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                vectors[i] = vector
+            else:
+                missing.setdefault(key, texts[i])
+
+        if missing:
+            encoded = self._encode_batch(list(missing.values()))
+            encoded = np.asarray(encoded, dtype=np.float32).reshape(len(missing), -1)
+            with self._lock:
+                self.misses += len(missing)
+                for key, vector in zip(missing, encoded):
+                    vector = vector.copy()
+                    vector.setflags(write=False)
+                    self._remember(key, vector)
+                    missing[key] = vector
+            for i, key in enumerate(keys):
+                if vectors[i] is None:
+                    vectors[i] = missing[key]
+
+        if single:
+            return vectors[0]
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def __call__(self, input):
+        """Chroma embedding-function interface: list of texts -> list of lists."""
+        return self.encode(list(input)).tolist()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                # None until a lazily labelled model has been loaded
+                'model': None if callable(self._model_name) else self._model_name,
+                'entries': len(self._vectors),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'spill_dir': self.spill_dir
+            }
+
+
+def sentence_transformer_embedder(model_name=DEFAULT_MODEL, **kwargs):
+    """Memoized SentenceTransformer embedder; the model loads on first use."""
+    model = None
+    model_lock = threading.Lock()
+
+    def encode_batch(texts):
+        nonlocal model
+        if model is None:
+            with model_lock:
+                if model is None:
+                    from sentence_transformers import SentenceTransformer
+                    model = SentenceTransformer(model_name)
+        return model.encode(texts, convert_to_numpy=True)
+
+    return CachedEmbedder(encode_batch, f"sentence-transformers/{model_name}", **kwargs)
+
+
+def chroma_default_embedder(**kwargs):
+    """Memoized version of the embedding function Chroma uses for query_texts."""
+    embedding_function = None
+    model_lock = threading.Lock()
+
+    def encode_batch(texts):
+        nonlocal embedding_function
+        if embedding_function is None:
+            with model_lock:
+                if embedding_function is None:
+                    from chromadb.utils import embedding_functions
+                    embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        return embedding_function(texts)
+
+    return CachedEmbedder(encode_batch, f"chroma-default/{DEFAULT_MODEL}", **kwargs)
+
+
+class OnnxMiniLM:
+    """all-MiniLM-L6-v2 on ONNX Runtime: tokenize, run, mean-pool, normalize.
+
+    With quantize on, an int8 dynamically quantized copy of the model is made
+    once next to the original and used instead. Texts are sorted by length
+    before batching so each batch pads as little as possible.
+    """
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, quantize=EMBEDDING_QUANTIZE,
+                 threads=EMBEDDING_THREADS, batch_size=EMBEDDING_BATCH_SIZE, max_length=256):
+        self.model_dir = model_dir
+        self.quantize = quantize
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._session = None
+        self._tokenizer = None
+        self.quantized = None  # whether the int8 model loaded; known after _load
+        self._lock = threading.Lock()
+
+    def _model_files(self):
+        if self.model_dir is None:
+            # Reuse the copy Chroma downloads for its default embedding function
+            from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+            default = ONNXMiniLM_L6_V2()
+            default._download_model_if_not_exists()
+            self.model_dir = os.path.join(default.DOWNLOAD_PATH, default.EXTRACTED_FOLDER_NAME)
+        model_path = os.path.join(self.model_dir, "model.onnx")
+        if self.quantize:
+            quantized_path = os.path.join(self.model_dir, "model.int8.onnx")
+            if not os.path.exists(quantized_path):
+                try:
+                    # The quantization tooling needs the 'onnx' package
+                    from onnxruntime.quantization import QuantType, quantize_dynamic
+                    print(f"Quantizing {model_path} to int8...")
+                    quantize_dynamic(model_path, quantized_path + ".tmp", weight_type=QuantType.QInt8)
+                    os.replace(quantized_path + ".tmp", quantized_path)
+                except Exception as e:
+                    print(f"Could not quantize embedding model, using float32: {e}")
+                    return model_path, os.path.join(self.model_dir, "tokenizer.json")
+            model_path = quantized_path
+        return model_path, os.path.join(self.model_dir, "tokenizer.json")
+
+    def _load(self):
+        if self._session is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+
+            model_path, tokenizer_path = self._model_files()
+            tokenizer = Tokenizer.from_file(tokenizer_path)
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = onnxruntime.InferenceSession(
+                model_path, sess_options=options, providers=["CPUExecutionProvider"]
+            )
+            self._tokenizer = tokenizer
+            # Quantizing can fail and fall back to the float32 model
+            self.quantized = os.path.basename(model_path) == "model.int8.onnx"
+
+    def __call__(self, texts):
+        self._load()
+        output = np.empty((len(texts), 0), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            encoded = self._tokenizer.encode_batch([texts[i] for i in positions])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            hidden = self._session.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids)
+            })[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if output.shape[1] == 0:
+                output = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            output[positions] = pooled
+        return output
+
+
+def onnx_embedder(model_name=DEFAULT_MODEL, **kwargs):
+    """Memoized ONNX Runtime embedder; the session is created on first use.
+
+    The cache label names the model file that actually loaded, so a failed
+    quantization is labelled float32.
+    """
+    backend = OnnxMiniLM()
+
+    def label():
+        backend._load()
+        suffix = "-int8" if backend.quantized else ""
+        return f"onnx{suffix}/{model_name}"
+
+    return CachedEmbedder(backend, label, **kwargs)
+
+
+BACKENDS = {
+    'onnx': onnx_embedder,
+    'sentence-transformers': sentence_transformer_embedder,
+    'chroma-default': lambda model_name=DEFAULT_MODEL, **kwargs: chroma_default_embedder(**kwargs),
+}
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Return the process-wide embedder for the configured EMBEDDING_BACKEND."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                factory = BACKENDS.get(EMBEDDING_BACKEND)
+                if factory is None:
+                    print(f"Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}', using onnx")
+                    factory = onnx_embedder
+                _embedder = factory(DEFAULT_MODEL)
+    return _embedder
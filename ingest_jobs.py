@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Ingestion Jobs
+Runs textbook ingestion on a background thread, so POST /api/ingest-documents
+returns a job id straight away instead of holding the request for the whole
+ingest. A job records per-file and per-chunk progress and throughput while
+it runs, and can be cancelled; ingestion stops between embedding batches.
+
+Only one job runs at a time. While one is running, new submissions are
+queued up to INGEST_QUEUE_SIZE, and rejected beyond that (the default of 0
+rejects every concurrent run).
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# Jobs allowed to wait behind the running one
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "0"))
+# Finished jobs kept for status lookups
+INGEST_JOB_HISTORY = 20
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class IngestJob:
+    """Live state and counters for one ingestion run.
+
+    pdf_ingest.ingest_pdfs_to_chromadb reports into it through files_found,
+    chunks_found, file_started, chunks_done and file_done, and polls
+    cancelled() between batches.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.state = QUEUED
+        self.phase = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.files = []
+        self.files_done = 0
+        self.current_file = None
+        self.chunks_total = None
+        self.chunks_processed = 0
+        self.chunks_added = 0
+        self._embedding_started = None  # monotonic clock
+        self._embedding_ended = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_phase(self, phase):
+        with self._lock:
+            if self.phase == "embedding" and phase != "embedding":
+                self._embedding_ended = time.monotonic()
+            self.phase = phase
+            if phase == "embedding" and self._embedding_started is None:
+                self._embedding_started = time.monotonic()
+
+    def files_found(self, filenames):
+        with self._lock:
+            self.files = list(filenames)
+
+    def chunks_found(self, count):
+        with self._lock:
+            self.chunks_total = count
+
+    def file_started(self, filename, chunk_count):
+        with self._lock:
+            self.current_file = filename
+
+    def chunks_done(self, processed, added):
+        with self._lock:
+            self.chunks_processed += processed
+            self.chunks_added += added
+
+    def file_done(self, filename):
+        with self._lock:
+            self.files_done += 1
+            self.current_file = None
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def start(self):
+        with self._lock:
+            self.state = RUNNING
+            self.started = time.time()
+
+    def finish(self, state, error=None):
+        with self._lock:
+            if self._embedding_started is not None and self._embedding_ended is None:
+                self._embedding_ended = time.monotonic()
+            self.state = state
+            self.error = error
+            self.phase = None
+            self.current_file = None
+            self.finished = time.time()
+
+    def snapshot(self):
+        """JSON-ready copy of the job's state and counters."""
+        with self._lock:
+            end = self.finished or time.time()
+            elapsed = end - self.started if self.started else 0.0
+            # Throughput counts embedding time only, not PDF extraction or index rebuilds
+            chunks_per_second = 0.0
+            if self._embedding_started is not None:
+                embed_seconds = (self._embedding_ended or time.monotonic()) - self._embedding_started
+                if embed_seconds > 0:
+                    chunks_per_second = self.chunks_processed / embed_seconds
+            remaining = None
+            if self.chunks_total is not None and chunks_per_second and self.state == RUNNING:
+                remaining = (self.chunks_total - self.chunks_processed) / chunks_per_second
+            return {
+                'job_id': self.id,
+                'state': self.state,
+                'phase': self.phase,
+                'error': self.error,
+                'cancel_requested': self.cancelled(),
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'elapsed_seconds': round(elapsed, 2),
+                'files_total': len(self.files),
+                'files_done': self.files_done,
+                'current_file': self.current_file,
+                'chunks_total': self.chunks_total,
+                'chunks_processed': self.chunks_processed,
+                'chunks_added': self.chunks_added,
+                'chunks_per_second': round(chunks_per_second, 2),
+                'percent_done': round(100.0 * self.chunks_processed / self.chunks_total, 1) if self.chunks_total else None,
+                'eta_seconds': round(remaining, 1) if remaining is not None else None
+            }
+
+
+class IngestJobRunner:
+    """Runs submitted jobs one at a time on a background thread.
+
+    target(job) does the work and returns True on success; the runner
+    records the outcome, including cancellation.
+    """
+
+    def __init__(self, target, max_queued=INGEST_QUEUE_SIZE, history=INGEST_JOB_HISTORY):
+        self.target = target
+        self.max_queued = max_queued
+        self.history = history
+        self._jobs = OrderedDict()  # job id -> job, oldest first
+        self._queue = deque()
+        self._running = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self):
+        """Queue a new job; returns it, or None if the runner is busy and the queue is full."""
+        with self._lock:
+            busy = self._running is not None or self._queue
+            if busy and len(self._queue) >= self.max_queued:
+                return None
+            job = IngestJob(uuid.uuid4().hex[:12])
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._trim_history()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="ingest-jobs", daemon=True)
+                self._worker.start()
+            return job
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                job = self._running = self._queue.popleft()
+            if job.cancelled():
+                job.finish(CANCELLED)
+            else:
+                job.start()
+                try:
+                    success = self.target(job)
+                    if job.cancelled():
+                        job.finish(CANCELLED)
+                    else:
+                        job.finish(SUCCEEDED if success else FAILED,
+                                   None if success else "Ingestion failed - check server logs")
+                except Exception as e:
+                    print(f"Error in ingestion job {job.id}: {e}")
+                    job.finish(FAILED, str(e))
+            with self._lock:
+                self._running = None
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def running(self):
+        return self._running
+
+    def latest(self):
+        """The running job, else the most recently submitted one (or None)."""
+        with self._lock:
+            if self._running is not None:
+                return self._running
+            return next(reversed(self._jobs.values()), None)
+
+    def cancel(self, job_id):
+        """Request cancellation; a queued job is dropped, a running one stops at the next batch."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancel()
+            if job in self._queue:
+                self._queue.remove(job)
+                job.finish(CANCELLED)
+            return job
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+LLM Backends
+One interface for every chat completion the app makes, with an OpenAI
+implementation (the pooled clients from openai_pool) and an Ollama one for a
+local model server. Each backend admits at most max_concurrency calls at
+once; callers beyond that wait for a slot.
+
+The router sends calls to the primary backend (LLM_BACKEND, default openai).
+With LLM_OVERFLOW_BACKEND set (e.g. ollama), a call that would have to wait
+for a primary slot goes to the overflow backend instead if it has one free.
+
+    backend = get_llm()
+    text = backend.complete(messages, max_tokens=1000)
+    for piece in backend.stream(messages): ...
+    text = await backend.acomplete(messages)       # async server
+"""
+
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from openai_pool import OPENAI_MAX_CONNECTIONS, OPENAI_READ_TIMEOUT, get_async_openai_client, get_openai_client
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai").lower()
+LLM_OVERFLOW_BACKEND = os.getenv("LLM_OVERFLOW_BACKEND", "").lower() or None
+
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo")
+# In-flight OpenAI calls; more than the connection pool would only queue inside httpx
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", str(OPENAI_MAX_CONNECTIONS)))
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# A local model server runs few generations in parallel (OLLAMA_NUM_PARALLEL)
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+
+class LLMBackend:
+    """Chat completions through one provider, limited to max_concurrency calls at a time.
+
+    Subclasses implement _complete, _stream, _acomplete and _astream; the
+    public methods wrap them in a concurrency slot. Sync and async callers
+    are limited separately, since a process serves one or the other.
+    """
+
+    name = None
+    label = None
+
+    def __init__(self, model, max_concurrency):
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_slots = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._calls = 0
+        self._errors = 0
+
+    def problem(self):
+        """Why the backend can't be used right now, or None if it looks usable."""
+        return None
+
+    def available(self):
+        return self.problem() is None
+
+    def has_free_slot(self):
+        with self._lock:
+            return self._in_flight < self.max_concurrency
+
+    def _started(self):
+        with self._lock:
+            self._in_flight += 1
+            self._calls += 1
+
+    def _finished(self, failed):
+        with self._lock:
+            self._in_flight -= 1
+            if failed:
+                self._errors += 1
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the backend's concurrency slots (blocking until one is free)."""
+        with self._slots:
+            self._started()
+            failed = True
+            try:
+                yield
+                failed = False
+            except GeneratorExit:
+                # A stream closed early by its consumer is not an error
+                failed = False
+                raise
+            finally:
+                self._finished(failed)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._async_slots:
+            self._started()
+            failed = True
+            try:
+                yield
+                failed = False
+            except GeneratorExit:
+                # A stream closed early by its consumer is not an error
+                failed = False
+                raise
+            finally:
+                self._finished(failed)
+
+    def complete(self, messages, max_tokens=1000, temperature=0.3):
+        """Return the full response text."""
+        with self.slot():
+            return self._complete(messages, max_tokens, temperature)
+
+    def stream(self, messages, max_tokens=1000, temperature=0.3):
+        """Yield response text pieces as they arrive."""
+        with self.slot():
+            yield from self._stream(messages, max_tokens, temperature)
+
+    async def acomplete(self, messages, max_tokens=1000, temperature=0.3):
+        async with self.async_slot():
+            return await self._acomplete(messages, max_tokens, temperature)
+
+    async def astream(self, messages, max_tokens=1000, temperature=0.3):
+        async with self.async_slot():
+            async for piece in self._astream(messages, max_tokens, temperature):
+                yield piece
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'model': self.model,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self._in_flight,
+                'calls': self._calls,
+                'errors': self._errors
+            }
+
+
+class OpenAIBackend(LLMBackend):
+    """The hosted chat completions API."""
+
+    name = "openai"
+    label = "OpenAI"
+
+    def __init__(self, model=OPENAI_CHAT_MODEL, max_concurrency=OPENAI_MAX_CONCURRENCY):
+        super().__init__(model, max_concurrency)
+
+    def problem(self):
+        if get_openai_client() is None:
+            return "OpenAI API key not configured"
+        return None
+
+    def _client(self):
+        client = get_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI API key not configured")
+        return client
+
+    def _complete(self, messages, max_tokens, temperature):
+        response = self._client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content.strip()
+
+    def _stream(self, messages, max_tokens, temperature):
+        stream = self._client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _async_client(self):
+        client = get_async_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI API key not configured")
+        return client
+
+    async def _acomplete(self, messages, max_tokens, temperature):
+        response = await self._async_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content.strip()
+
+    async def _astream(self, messages, max_tokens, temperature):
+        stream = await self._async_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class OllamaBackend(LLMBackend):
+    """A local Ollama server (needs the ollama package)."""
+
+    name = "ollama"
+    label = "Ollama"
+
+    def __init__(self, model=OLLAMA_MODEL, max_concurrency=OLLAMA_MAX_CONCURRENCY, host=OLLAMA_HOST):
+        super().__init__(model, max_concurrency)
+        self.host = host
+        self._sync_client = None
+        self._async_client_instance = None
+
+    def _module(self):
+        try:
+            import ollama
+        except ImportError:
+            raise RuntimeError("The ollama package is not installed (pip install ollama)")
+        return ollama
+
+    def problem(self):
+        try:
+            self._module()
+        except RuntimeError as e:
+            return str(e)
+        return None
+
+    def _options(self, max_tokens, temperature):
+        return {'temperature': temperature, 'num_predict': max_tokens}
+
+    def _client(self):
+        if self._sync_client is None:
+            self._sync_client = self._module().Client(host=self.host, timeout=OPENAI_READ_TIMEOUT)
+        return self._sync_client
+
+    def _complete(self, messages, max_tokens, temperature):
+        response = self._client().chat(
+            model=self.model, messages=messages, options=self._options(max_tokens, temperature)
+        )
+        return response['message']['content'].strip()
+
+    def _stream(self, messages, max_tokens, temperature):
+        for chunk in self._client().chat(
+            model=self.model, messages=messages, options=self._options(max_tokens, temperature), stream=True
+        ):
+            if chunk['message']['content']:
+                yield chunk['message']['content']
+
+    def _async_client(self):
+        # Like the async OpenAI client, bound to the event loop that first uses it
+        if self._async_client_instance is None:
+            self._async_client_instance = self._module().AsyncClient(host=self.host, timeout=OPENAI_READ_TIMEOUT)
+        return self._async_client_instance
+
+    async def _acomplete(self, messages, max_tokens, temperature):
+        response = await self._async_client().chat(
+            model=self.model, messages=messages, options=self._options(max_tokens, temperature)
+        )
+        return response['message']['content'].strip()
+
+    async def _astream(self, messages, max_tokens, temperature):
+        stream = await self._async_client().chat(
+            model=self.model, messages=messages, options=self._options(max_tokens, temperature), stream=True
+        )
+        async for chunk in stream:
+            if chunk['message']['content']:
+                yield chunk['message']['content']
+
+
+BACKENDS = {
+    'openai': OpenAIBackend,
+    'ollama': OllamaBackend,
+}
+
+
+class LLMRouter:
+    """Primary backend plus an optional overflow backend for when it is saturated."""
+
+    def __init__(self, primary, overflow=None):
+        self.primary = primary
+        self.overflow = overflow
+        self._lock = threading.Lock()
+        self._overflowed = 0
+
+    @property
+    def model(self):
+        return self.primary.model
+
+    @property
+    def label(self):
+        return self.primary.label
+
+    def available(self):
+        return self.primary.available() or (self.overflow is not None and self.overflow.available())
+
+    def problem(self):
+        """Why no backend can take calls (the primary's reason), or None."""
+        return None if self.available() else self.primary.problem()
+
+    def pick(self):
+        """The backend for the next call: the primary unless it is full (or unusable) and the overflow is not."""
+        primary_usable = self.primary.available()
+        if self.overflow is not None and self.overflow.available():
+            if not primary_usable or (not self.primary.has_free_slot() and self.overflow.has_free_slot()):
+                with self._lock:
+                    self._overflowed += 1
+                return self.overflow
+        return self.primary
+
+    def complete(self, messages, max_tokens=1000, temperature=0.3):
+        return self.pick().complete(messages, max_tokens, temperature)
+
+    def stream(self, messages, max_tokens=1000, temperature=0.3):
+        return self.pick().stream(messages, max_tokens, temperature)
+
+    async def acomplete(self, messages, max_tokens=1000, temperature=0.3):
+        return await self.pick().acomplete(messages, max_tokens, temperature)
+
+    def astream(self, messages, max_tokens=1000, temperature=0.3):
+        return self.pick().astream(messages, max_tokens, temperature)
+
+    def stats(self):
+        with self._lock:
+            overflowed = self._overflowed
+        return {
+            'primary': self.primary.stats(),
+            'overflow': self.overflow.stats() if self.overflow is not None else None,
+            'overflowed_calls': overflowed
+        }
+
+
+_backends = {}
+_router = None
+_backends_lock = threading.Lock()
+
+
+def get_backend(name):
+    """Return the process-wide backend instance for a name in BACKENDS."""
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown LLM backend {name!r}; expected one of {sorted(BACKENDS)}")
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = BACKENDS[name]()
+    return backend
+
+
+def get_llm():
+    """Return the process-wide router over LLM_BACKEND and LLM_OVERFLOW_BACKEND."""
+    global _router
+    if _router is None:
+        overflow = None
+        if LLM_OVERFLOW_BACKEND and LLM_OVERFLOW_BACKEND != LLM_BACKEND:
+            overflow = get_backend(LLM_OVERFLOW_BACKEND)
+        router = LLMRouter(get_backend(LLM_BACKEND), overflow)
+        with _backends_lock:
+            if _router is None:
+                _router = router
+    return _router
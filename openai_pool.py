@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+OpenAI Client Pool
+One OpenAI client per process, built on a single keep-alive HTTP connection
+pool, so requests reuse TLS connections instead of handshaking each time.
+Connect and read timeouts are explicit, and failed calls (429, 408/409, 5xx
+and connection errors) are retried by the SDK with bounded exponential
+backoff that honours Retry-After. get_async_openai_client() is the
+equivalent AsyncOpenAI client for the async server (asgi_app.py).
+"""
+
+import os
+import threading
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+
+PLACEHOLDER_KEYS = ("your_openai_api_key_here",)
+
+_lock = threading.Lock()
+_client = None
+_client_key = None
+_async_client = None
+_async_client_key = None
+_reported_key = None  # last key a validation error was printed for
+
+
+def api_key_problem(api_key):
+    """Return why an API key can't be used, or None if it looks valid."""
+    if not api_key or not api_key.strip():
+        return "OPENAI_API_KEY environment variable not found"
+    if api_key in PLACEHOLDER_KEYS:
+        return "OPENAI_API_KEY is set to placeholder value"
+    # Covers project keys (sk-proj-) too
+    if not api_key.startswith("sk-"):
+        return "OPENAI_API_KEY doesn't appear to be a valid OpenAI API key (keys start with 'sk-')"
+    return None
+
+
+def openai_timeout():
+    return httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def openai_limits():
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    )
+
+
+def _http_client():
+    # DefaultHttpxClient keeps the SDK's own defaults (newer openai releases only)
+    http_client_class = getattr(openai, 'DefaultHttpxClient', None) or httpx.Client
+    return http_client_class(limits=openai_limits(), timeout=openai_timeout())
+
+
+def _async_http_client():
+    http_client_class = getattr(openai, 'DefaultAsyncHttpxClient', None) or httpx.AsyncClient
+    return http_client_class(limits=openai_limits(), timeout=openai_timeout())
+
+
+def _key_usable(api_key):
+    """Validate the key, reporting a problem once per key rather than on every request."""
+    global _reported_key
+    problem = api_key_problem(api_key)
+    if problem:
+        if _reported_key != (api_key or ""):
+            print(f"❌ Error: {problem}")
+            _reported_key = api_key or ""
+        return False
+    return True
+
+
+def get_openai_client():
+    """Return the shared client, or None if OPENAI_API_KEY is missing or invalid.
+
+    The client is rebuilt only if the key in the environment changes.
+    """
+    global _client, _client_key
+    api_key = os.getenv("OPENAI_API_KEY")
+    if _client is not None and api_key == _client_key:
+        return _client
+    with _lock:
+        if _client is not None and api_key == _client_key:
+            return _client
+        if not _key_usable(api_key):
+            return None
+        try:
+            client = OpenAI(
+                api_key=api_key,
+                http_client=_http_client(),
+                timeout=openai_timeout(),
+                max_retries=OPENAI_MAX_RETRIES
+            )
+        except Exception as e:
+            print(f"❌ Error creating OpenAI client: {e}")
+            return None
+        # A replaced client is left to in-flight requests and garbage collection
+        _client, _client_key = client, api_key
+        print(f"✅ OpenAI client created (up to {OPENAI_MAX_CONNECTIONS} pooled connections)")
+        return _client
+
+
+def get_async_openai_client():
+    """Return the shared AsyncOpenAI client, or None if OPENAI_API_KEY is unusable.
+
+    Its connection pool belongs to the event loop that first uses it, so
+    call this from the async server's loop only.
+    """
+    global _async_client, _async_client_key
+    api_key = os.getenv("OPENAI_API_KEY")
+    if _async_client is not None and api_key == _async_client_key:
+        return _async_client
+    with _lock:
+        if _async_client is not None and api_key == _async_client_key:
+            return _async_client
+        if not _key_usable(api_key):
+            return None
+        try:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                http_client=_async_http_client(),
+                timeout=openai_timeout(),
+                max_retries=OPENAI_MAX_RETRIES
+            )
+        except Exception as e:
+            print(f"❌ Error creating async OpenAI client: {e}")
+            return None
+        _async_client, _async_client_key = client, api_key
+        print(f"✅ Async OpenAI client created (up to {OPENAI_MAX_CONNECTIONS} pooled connections)")
+        return _async_client
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+PDF Text Extraction
+Shared page-text extraction engine for the question loader and the textbook
+ingester. pdfplumber layout analysis is CPU-bound, so page ranges are spread
+across a process pool and the page texts are returned in page order.
+
+Extracted pages are kept in an on-disk, content-addressed cache keyed by
+(PDF SHA-256, page number, extractor version), so a page is only ever
+extracted once no matter which script asks for it.
+"""
+
+import hashlib
+import math
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import pdfplumber
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+page_cache_path = os.path.join(project_root, "db", "page_text_cache.sqlite3")
+
+# Bump the suffix whenever extract_page_range changes how text is produced
+EXTRACTOR_VERSION = f"pdfplumber-{getattr(pdfplumber, '__version__', 'unknown')}-1"
+
+# Maximum total size of cached page text before least-recently-used pages go
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Number of worker processes; 0 or 1 extracts in the calling process
+MAX_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+# Upper bound on pages per task so large and small PDFs balance across workers
+PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "16"))
+
+
+class PageTextCache:
+    """SQLite-backed page-text cache with a size cap and LRU eviction."""
+
+    def __init__(self, path=page_cache_path, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection under the cache lock; commit and close afterwards."""
+        with self._lock:
+            if not self._initialized:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS pages ("
+                        " pdf_hash TEXT, page INTEGER, extractor TEXT, text TEXT,"
+                        " size INTEGER, last_used REAL,"
+                        " PRIMARY KEY (pdf_hash, page, extractor))"
+                    )
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS documents ("
+                        " pdf_hash TEXT, extractor TEXT, page_count INTEGER,"
+                        " PRIMARY KEY (pdf_hash, extractor))"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+                    self._initialized = True
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def page_count(self, pdf_hash):
+        """Return the cached page count for a PDF, or None."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT page_count FROM documents WHERE pdf_hash = ? AND extractor = ?",
+                    (pdf_hash, EXTRACTOR_VERSION)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Page text cache unavailable: {e}")
+            return None
+        return row[0] if row else None
+
+    def get_pages(self, pdf_hash):
+        """Return {page_index: text} for every cached page of a PDF."""
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT page, text FROM pages WHERE pdf_hash = ? AND extractor = ?",
+                    (pdf_hash, EXTRACTOR_VERSION)
+                ).fetchall()
+                if rows:
+                    conn.execute(
+                        "UPDATE pages SET last_used = ? WHERE pdf_hash = ? AND extractor = ?",
+                        (time.time(), pdf_hash, EXTRACTOR_VERSION)
+                    )
+        except sqlite3.Error as e:
+            print(f"Page text cache unavailable: {e}")
+            return {}
+        return dict(rows)
+
+    def put_pages(self, pdf_hash, page_count, pages):
+        """Store {page_index: text} for a PDF and evict down to the size cap."""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                    (pdf_hash, EXTRACTOR_VERSION, page_count)
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                    [(pdf_hash, page, EXTRACTOR_VERSION, text, len(text.encode('utf-8')), now)
+                     for page, text in pages.items()]
+                )
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error writing page text cache: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for pdf_hash, page, extractor, size in conn.execute(
+                "SELECT pdf_hash, page, extractor, size FROM pages ORDER BY last_used"):
+            victims.append((pdf_hash, page, extractor))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany(
+            "DELETE FROM pages WHERE pdf_hash = ? AND page = ? AND extractor = ?", victims
+        )
+        print(f"Page text cache: evicted {len(victims)} pages ({freed} bytes)")
+
+
+page_cache = PageTextCache()
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Return the hex SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_pages(pdf_path):
+    """Return the number of pages in a PDF."""
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page_range(pdf_path, start, end):
+    """Extract the text of pages [start, end) of a PDF (0-based).
+
+    Runs inside worker processes. A page that fails to extract yields None
+    so the caller still gets one entry per page but can leave it uncached.
+    """
+    texts = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_index in range(start, end):
+            try:
+                texts.append(pdf.pages[page_index].extract_text() or "")
+            except Exception as e:
+                print(f"Error processing page {page_index + 1} in {pdf_path}: {e}")
+                texts.append(None)
+    return texts
+
+
+def _plan_tasks(missing_pages, workers):
+    """Split each PDF's missing pages into contiguous (path, start, end) ranges."""
+    total_pages = sum(len(pages) for pages in missing_pages.values())
+    per_task = max(1, min(PAGES_PER_TASK, math.ceil(total_pages / max(workers, 1))))
+    tasks = []
+    for pdf_path, pages in missing_pages.items():
+        run_start = None
+        previous = None
+        for page in pages + [None]:
+            if run_start is not None and (page is None or page != previous + 1
+                                          or previous + 1 - run_start >= per_task):
+                tasks.append((pdf_path, run_start, previous + 1))
+                run_start = None
+            if page is not None and run_start is None:
+                run_start = page
+            previous = page
+    return tasks
+
+
+def extract_pdfs(pdf_paths, max_workers=None, hashes=None, failed=None):
+    """Extract page texts for several PDFs at once.
+
+    Returns {pdf_path: [page_text, ...]} with pages in order. Pages already in
+    the page-text cache are not extracted again. hashes may map paths to a
+    precomputed SHA-256. PDFs that cannot be opened are reported and left out
+    of the result. Pages that failed to extract come back as "" like blank
+    ones; pass a set as failed to have the paths of those PDFs added to it.
+    """
+    workers = MAX_WORKERS if max_workers is None else max_workers
+    hashes = dict(hashes or {})
+
+    results = {}
+    missing_pages = {}
+    page_counts = {}
+    for pdf_path in pdf_paths:
+        try:
+            pdf_hash = hashes.get(pdf_path) or file_sha256(pdf_path)
+            hashes[pdf_path] = pdf_hash
+            pages = page_cache.page_count(pdf_hash)
+            if pages is None:
+                pages = count_pages(pdf_path)
+            page_counts[pdf_path] = pages
+        except Exception as e:
+            print(f"Error opening PDF {pdf_path}: {e}")
+            continue
+
+        cached = page_cache.get_pages(pdf_hash) if pages else {}
+        results[pdf_path] = [cached.get(i) for i in range(pages)]
+        missing = [i for i in range(pages) if i not in cached]
+        if missing:
+            missing_pages[pdf_path] = missing
+        elif pages == 0:
+            page_cache.put_pages(pdf_hash, 0, {})
+
+    tasks = _plan_tasks(missing_pages, workers)
+    extracted = {pdf_path: {} for pdf_path in missing_pages}
+
+    if workers <= 1 or len(tasks) <= 1:
+        for pdf_path, start, end in tasks:
+            try:
+                texts = extract_page_range(pdf_path, start, end)
+            except Exception as e:
+                print(f"Error extracting pages {start + 1}-{end} in {pdf_path}: {e}")
+                continue
+            extracted[pdf_path].update(zip(range(start, end), texts))
+    else:
+        # Spawn, not fork: this runs on Flask request threads and the ingest
+        # job thread, and a forked child can inherit locks other threads hold
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(extract_page_range, pdf_path, start, end): (pdf_path, start, end)
+                for pdf_path, start, end in tasks
+            }
+            for future, (pdf_path, start, end) in futures.items():
+                try:
+                    texts = future.result()
+                except Exception as e:
+                    # Leave these pages out of the cache so they are retried next time
+                    print(f"Error extracting pages {start + 1}-{end} in {pdf_path}: {e}")
+                    continue
+                extracted[pdf_path].update(zip(range(start, end), texts))
+
+    for pdf_path, pages in extracted.items():
+        for page, text in pages.items():
+            results[pdf_path][page] = text
+        # Pages that failed (None) stay out of the cache so the next run retries them
+        pages = {page: text for page, text in pages.items() if text is not None}
+        if pages:
+            page_cache.put_pages(hashes[pdf_path], page_counts[pdf_path], pages)
+
+    for pdf_path, texts in results.items():
+        if failed is not None and any(text is None for text in texts):
+            failed.add(pdf_path)
+        results[pdf_path] = [text or "" for text in texts]
+    return results
+
+
+def extract_page_texts(pdf_path, max_workers=None):
+    """Extract the text of every page of one PDF, in page order."""
+    return extract_pdfs([pdf_path], max_workers=max_workers).get(pdf_path, [])
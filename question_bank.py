@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Question Bank
+Parses the exam PDFs once, keeps the parsed questions on disk and serves them
+from an in-process read-only snapshot. Only PDFs whose size, mtime or content
+hash changed since the last run are parsed again.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from pdf_extraction import extract_page_texts, extract_pdfs, file_sha256
+from topics import topic_for_question
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+default_questions_folder = os.path.join(project_root, "data", "questions")
+cache_path = os.path.join(project_root, "db", "question_bank_cache.json")
+
+# Bump this whenever the parsing rules below change so stale caches are ignored
+PARSER_VERSION = 4
+
+# How often (seconds) the snapshot re-checks the questions folder for changes
+REFRESH_INTERVAL = float(os.getenv("QUESTION_BANK_REFRESH_INTERVAL", "30"))
+
+BOUNDARY_PATTERN = re.compile(r'Question [A-Z]-\d+ \(', re.IGNORECASE)
+ANSWER_MARKER_PATTERN = re.compile(r'SUGGESTED ANSWER:', re.IGNORECASE)
+
+# Tail kept between pages so a header or marker split across pages is still found
+BOUNDARY_LOOKBACK = 64
+ANSWER_MARKER_LOOKBACK = len('SUGGESTED ANSWER:')
+
+HEADER_PATTERN = re.compile(r'Question ([A-Z])-(\d+) \(([^)]+)\)', re.IGNORECASE)
+POINTS_PATTERN = re.compile(r'(\d+)\s*points?', re.IGNORECASE)
+SUB_PART_PATTERN = re.compile(r'^[ \t]*([a-z])\.\s', re.MULTILINE)
+YEAR_PATTERN = re.compile(r'((?:19|20)\d{2})')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+DEFAULT_QUESTIONS = [
+    "What is the primary purpose of the Tax Court in the United States?",
+    "What are the filing requirements for a petition to the Tax Court?",
+    "Who bears the burden of proof in Tax Court proceedings?",
+    "What are the Small Case Procedures in Tax Court?",
+    "How does the appeals process work for Tax Court decisions?"
+]
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of a question text."""
+    return WHITESPACE_PATTERN.sub(' ', text).strip().lower()
+
+
+class QuestionBank:
+    """Read-only snapshot of the parsed question bank with secondary indexes."""
+
+    __slots__ = ('questions', 'version', 'loaded_at', 'by_id', 'by_text', 'by_year',
+                 'by_section', 'by_points', 'by_topic', '_point_values', '_selections', 'incomplete')
+
+    def __init__(self, questions, version, incomplete=()):
+        self.questions = tuple(questions)
+        self.version = version
+        # PDFs left out because they could not be read in full; retried on the next refresh
+        self.incomplete = tuple(incomplete)
+        self.loaded_at = time.time()
+        self.by_id = {}
+        self.by_text = {}
+        self.by_year = {}
+        self.by_section = {}
+        self.by_points = {}
+        self.by_topic = {}
+        for i, q in enumerate(self.questions):
+            self.by_id.setdefault(q['id'], i)
+            self.by_text.setdefault(normalize_text(q['text']), i)
+            self.by_year.setdefault(q['year'], []).append(i)
+            self.by_section.setdefault(q['section'], []).append(i)
+            self.by_points.setdefault(q['points'], []).append(i)
+            self.by_topic.setdefault(q.get('topic'), []).append(i)
+        for index in (self.by_year, self.by_section, self.by_points, self.by_topic):
+            for key in index:
+                index[key] = tuple(index[key])
+        self._point_values = sorted(points for points in self.by_points if points is not None)
+        # (year, section, min_points, topic) -> tuple of matching positions; only
+        # values present in the indexes are used as keys, so it stays bounded
+        self._selections = {}
+
+    def __len__(self):
+        return len(self.questions)
+
+    def __iter__(self):
+        return iter(self.questions)
+
+    def get(self, question_id):
+        """Return the question with the given id, or None."""
+        i = self.by_id.get(question_id)
+        return self.questions[i] if i is not None else None
+
+    def find_by_text(self, text):
+        """Return the question whose text matches (ignoring case and spacing), or None."""
+        i = self.by_text.get(normalize_text(text))
+        return self.questions[i] if i is not None else None
+
+    def select(self, year=None, section=None, min_points=None, topic=None):
+        """Return positions of questions matching every given filter.
+
+        Results are memoized per filter combination, so after the first call
+        picking from the same filters is a constant-time lookup. Filters that
+        match nothing are not memoized, and min_points is snapped to the
+        lowest point value that satisfies it.
+        """
+        section = section.upper() if section else None
+        topic = topic.lower() if topic else None
+        if ((year is not None and year not in self.by_year)
+                or (section is not None and section not in self.by_section)
+                or (topic is not None and topic not in self.by_topic)):
+            return ()
+        if min_points is not None:
+            snapped = bisect.bisect_left(self._point_values, min_points)
+            if snapped == len(self._point_values):
+                return ()
+            min_points = self._point_values[snapped]
+        key = (year, section, min_points, topic)
+        selection = self._selections.get(key)
+        if selection is not None:
+            return selection
+
+        candidates = []
+        if year is not None:
+            candidates.append(self.by_year.get(year, ()))
+        if section is not None:
+            candidates.append(self.by_section.get(section, ()))
+        if topic is not None:
+            candidates.append(self.by_topic.get(topic, ()))
+        if min_points is not None:
+            candidates.append(tuple(sorted(
+                i for points, positions in self.by_points.items()
+                if points is not None and points >= min_points
+                for i in positions
+            )))
+
+        if not candidates:
+            selection = tuple(range(len(self.questions)))
+        else:
+            candidates.sort(key=len)
+            selection = set(candidates[0])
+            for positions in candidates[1:]:
+                selection.intersection_update(positions)
+            selection = tuple(sorted(selection))
+
+        self._selections[key] = selection
+        return selection
+
+    def random_question(self, year=None, section=None, min_points=None, topic=None):
+        """Pick a random question matching the filters, or None if none match."""
+        selection = self.select(year, section, min_points, topic)
+        if not selection:
+            return None
+        return self.questions[random.choice(selection)]
+
+
+_lock = threading.Lock()
+_snapshots = {}  # folder_path -> (QuestionBank, folder signature, last check time)
+
+
+def parse_exam_year(filename):
+    """Return the exam year from a name like EXAM-2023.pdf, or None."""
+    match = YEAR_PATTERN.search(filename)
+    return int(match.group(1)) if match else None
+
+
+def parse_sub_parts(text):
+    """Return [label, start, end] for each lettered sub-part (a., b., c., ...)."""
+    parts = []
+    expected = 'a'
+    for match in SUB_PART_PATTERN.finditer(text):
+        label = match.group(1)
+        if label != expected:
+            continue
+        if parts:
+            parts[-1][2] = match.start(1)
+        parts.append([label, match.start(1), len(text)])
+        expected = chr(ord(expected) + 1)
+    return parts
+
+
+def make_question_record(text, source, year=None, start=0):
+    """Build the compact structured record for a single question text."""
+    header = HEADER_PATTERN.match(text)
+    section = number = points = None
+    if header:
+        section = header.group(1).upper()
+        number = int(header.group(2))
+        points_match = POINTS_PATTERN.search(header.group(3))
+        points = int(points_match.group(1)) if points_match else None
+    if section is not None:
+        question_id = f"{year or os.path.splitext(source)[0]}-{section}-{number}"
+    else:
+        question_id = f"{os.path.splitext(source)[0]}-{start}"
+    return {
+        'id': question_id,
+        'text': text,
+        'source': source,
+        'year': year,
+        'section': section,
+        'number': number,
+        'points': points,
+        'topic': topic_for_question(section, text),
+        'parts': parse_sub_parts(text),
+        'start': start,
+        'end': start + len(text)
+    }
+
+
+def question_title(question):
+    """Return the 'Question S-1 (1 point)' header, or the first line of the text."""
+    header = HEADER_PATTERN.match(question['text'])
+    if header:
+        return header.group(0)
+    return question['text'].split('\n', 1)[0][:120]
+
+
+def summarize_question(question):
+    """Project a record down to its id, title and filter fields."""
+    return {
+        'id': question['id'],
+        'title': question_title(question),
+        'source': question['source'],
+        'year': question['year'],
+        'section': question['section'],
+        'number': question['number'],
+        'points': question['points'],
+        'topic': question.get('topic')
+    }
+
+
+def segment_questions(pages):
+    """Yield (start, text) for each question in a stream of page texts.
+
+    Pages are consumed one at a time and each question is yielded as soon as
+    the next 'Question X-N (' header appears, so only the current question is
+    held in memory. Anything after a question's 'SUGGESTED ANSWER:' marker is
+    dropped. start is the question's character offset in the document formed
+    by joining the non-empty pages with newlines.
+    """
+    buffer = ""           # current question, or just a scan tail between questions
+    base = 0              # document offset of buffer[0]
+    in_question = False   # buffer starts at a question header
+    answer_seen = False   # the current question was already closed at its marker
+    closed = None         # (start, text) of the current question once answer_seen
+    scan = 0              # where to resume the header search in buffer
+    marker_scan = 0       # where to resume the marker search in buffer
+
+    def close(raw, marker_from=0):
+        marker = ANSWER_MARKER_PATTERN.search(raw, marker_from)
+        if marker:
+            raw = raw[:marker.start()]
+        text = raw.strip()
+        if len(text) > 20 and HEADER_PATTERN.match(raw):
+            return base + (len(raw) - len(raw.lstrip())), text
+        return None
+
+    for page_text in pages:
+        if not page_text:
+            continue
+        buffer += "\n" + page_text
+
+        boundary = BOUNDARY_PATTERN.search(buffer, scan)
+        while boundary is not None:
+            if in_question:
+                done = closed if answer_seen else close(buffer[:boundary.start()], marker_scan)
+                if done:
+                    yield done
+            buffer = buffer[boundary.start():]
+            base += boundary.start()
+            in_question, answer_seen, closed, marker_scan = True, False, None, 0
+            boundary = BOUNDARY_PATTERN.search(buffer, 1)
+
+        if in_question and not answer_seen:
+            marker = ANSWER_MARKER_PATTERN.search(buffer, marker_scan)
+            if marker:
+                answer_seen = True
+                closed = close(buffer[:marker.start()])
+            else:
+                marker_scan = max(0, len(buffer) - ANSWER_MARKER_LOOKBACK)
+
+        if in_question and not answer_seen:
+            scan = max(1, len(buffer) - BOUNDARY_LOOKBACK)
+        else:
+            # Only a tail long enough to hold a split header is still needed;
+            # always drop the current header itself so it is not found again
+            keep = max(1 if in_question else 0, len(buffer) - BOUNDARY_LOOKBACK)
+            buffer = buffer[keep:]
+            base += keep
+            scan = 0
+
+    if in_question:
+        done = closed if answer_seen else close(buffer, marker_scan)
+        if done:
+            yield done
+
+
+def parse_questions_from_pdf(pdf_path, page_texts=None):
+    """Extract structured question records from a single exam PDF.
+
+    page_texts can be any iterable of page texts, e.g. when the pages were
+    already extracted.
+    """
+    filename = os.path.basename(pdf_path)
+    year = parse_exam_year(filename)
+    if page_texts is None:
+        page_texts = extract_page_texts(pdf_path)
+    questions = []
+    seen_ids = {}
+    for start, text in segment_questions(page_texts):
+        record = make_question_record(text, filename, year, start)
+        # Some exams restate a question header; keep ids unique within the file
+        seen_ids[record['id']] = seen_ids.get(record['id'], 0) + 1
+        if seen_ids[record['id']] > 1:
+            record['id'] = f"{record['id']}.{seen_ids[record['id']]}"
+        questions.append(record)
+    return questions
+
+
+def load_sample_questions():
+    """Fallback questions used when no exam PDFs could be parsed."""
+    questions = []
+    sample_questions_path = os.path.join(project_root, "sample_questions.txt")
+    if os.path.exists(sample_questions_path):
+        try:
+            with open(sample_questions_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            # Split by double newlines to get individual questions
+            offset = 0
+            for block in content.split('\n\n'):
+                if block.strip() and 'Question' in block:
+                    start = offset + (len(block) - len(block.lstrip()))
+                    questions.append(make_question_record(block.strip(), 'Sample Questions', start=start))
+                offset += len(block) + 2
+        except Exception as e:
+            print(f"Error loading sample questions: {e}")
+
+    if not questions:
+        questions = [
+            make_question_record(q, 'Default Questions', start=i)
+            for i, q in enumerate(DEFAULT_QUESTIONS)
+        ]
+    return questions
+
+
+def _read_cache():
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('parser_version') == PARSER_VERSION:
+            return cache.get('files', {})
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable question bank cache: {e}")
+    return {}
+
+
+def _write_cache(files):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'parser_version': PARSER_VERSION, 'files': files}, f)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Error writing question bank cache: {e}")
+
+
+def _list_pdfs(folder_path):
+    if not os.path.exists(folder_path):
+        return []
+    return sorted(f for f in os.listdir(folder_path) if f.lower().endswith('.pdf'))
+
+
+def _folder_signature(folder_path):
+    """Cheap (name, size, mtime) fingerprint of every PDF in the folder."""
+    signature = []
+    for filename in _list_pdfs(folder_path):
+        try:
+            st = os.stat(os.path.join(folder_path, filename))
+        except OSError:
+            continue
+        signature.append((filename, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def build_question_bank(folder_path=default_questions_folder):
+    """Load the bank from the disk cache, re-parsing only PDFs that changed."""
+    cached_files = _read_cache()
+    files = {}
+    pending = {}  # pdf_path -> (stat result, sha256) for PDFs that need parsing
+    dirty = False
+
+    for filename in _list_pdfs(folder_path):
+        pdf_path = os.path.join(folder_path, filename)
+        try:
+            st = os.stat(pdf_path)
+        except OSError as e:
+            print(f"Error reading {filename}: {e}")
+            continue
+
+        entry = cached_files.get(pdf_path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            files[pdf_path] = entry
+            continue
+
+        # Size or mtime moved: only re-parse if the content actually changed
+        sha256 = file_sha256(pdf_path)
+        dirty = True
+        if entry and entry['sha256'] == sha256:
+            files[pdf_path] = dict(entry, size=st.st_size, mtime_ns=st.st_mtime_ns)
+        else:
+            files[pdf_path] = None
+            pending[pdf_path] = (st, sha256)
+
+    incomplete = []
+    if pending:
+        print(f"Parsing questions from {len(pending)} PDF(s)...")
+        failed = set()
+        page_texts = extract_pdfs(
+            list(pending), hashes={path: sha256 for path, (_, sha256) in pending.items()}, failed=failed
+        )
+        for pdf_path, (st, sha256) in pending.items():
+            try:
+                if pdf_path not in page_texts:
+                    raise ValueError("no pages could be extracted")
+                if pdf_path in failed:
+                    # Parsing the rest would cache a partial (often empty) question list
+                    raise ValueError("some pages could not be extracted")
+                parsed = parse_questions_from_pdf(pdf_path, page_texts[pdf_path])
+            except Exception as e:
+                print(f"Error processing {os.path.basename(pdf_path)}: {e}")
+                del files[pdf_path]
+                incomplete.append(pdf_path)
+                continue
+            files[pdf_path] = {
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'sha256': sha256,
+                'questions': parsed
+            }
+
+    questions = [q for entry in files.values() for q in entry['questions']]
+
+    # Keep entries for other folders; drop ones for PDFs removed from this folder
+    folder_prefix = os.path.join(folder_path, '')
+    for path, entry in cached_files.items():
+        if not path.startswith(folder_prefix):
+            files[path] = entry
+        elif path not in files:
+            dirty = True
+    if dirty:
+        _write_cache(files)
+
+    version_source = "|".join(
+        f"{files[path]['sha256']}" for path in sorted(files) if path.startswith(folder_prefix)
+    )
+    version = hashlib.sha256(f"{PARSER_VERSION}:{version_source}".encode()).hexdigest()[:16]
+
+    if not questions:
+        questions = load_sample_questions()
+    return QuestionBank(questions, version, incomplete)
+
+
+def get_question_bank(folder_path=default_questions_folder):
+    """Return the current snapshot, rebuilding it only when the PDFs changed."""
+    now = time.monotonic()
+    current = _snapshots.get(folder_path)
+    if current and now - current[2] < REFRESH_INTERVAL:
+        return current[0]
+
+    with _lock:
+        current = _snapshots.get(folder_path)
+        if current and now - current[2] < REFRESH_INTERVAL:
+            return current[0]
+
+        signature = _folder_signature(folder_path)
+        if current and current[1] == signature:
+            _snapshots[folder_path] = (current[0], signature, now)
+            return current[0]
+
+        bank = build_question_bank(folder_path)
+        # With PDFs left out, force a rebuild on the next refresh so they are retried
+        _snapshots[folder_path] = (bank, signature if not bank.incomplete else None, now)
+        return bank
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Precomputed Question Context
+The exam questions are a closed set, so their textbook context can be worked
+out once after ingestion: every bank question is embedded in one batch, the
+top-k chunks for all of them are fetched with multi-query Chroma calls, and
+the (chunk id, distance) lists are stored on disk next to the question bank.
+Questions with a topic are matched only against chunks of the same topic.
+Answer checks for bank questions then look their context up instead of
+running a live embedding and ANN query.
+"""
+
+import json
+import os
+import threading
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+contexts_path = os.path.join(project_root, "db", "question_contexts.json")
+
+PRECOMPUTE_TOP_K = int(os.getenv("QUESTION_CONTEXT_TOP_K", "5"))
+PRECOMPUTE_BATCH_SIZE = 64
+
+
+class QuestionContextStore:
+    """Stored per-question retrieval results, checked against the collection."""
+
+    def __init__(self, path=contexts_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None           # contents of the contexts file
+        self._loaded = False
+        self._verified_version = None  # registry version the data was last checked at
+        self._chunks = {}           # (question id, n) -> (chunks, stored vectors)
+
+    def _load(self):
+        if self._loaded:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = None
+        except Exception as e:
+            print(f"Ignoring unreadable question contexts: {e}")
+            self._data = None
+        self._loaded = True
+
+    def _is_current(self, bank, registry):
+        """True if the stored contexts match this bank and the collection's contents."""
+        if self._data is None or self._data.get('bank_version') != bank.version:
+            return False
+        version = registry.version()
+        if self._verified_version != version:
+            # Another process may have re-ingested; the chunk count is a cheap check
+            count = registry.run(lambda collection: collection.count())
+            if count != self._data.get('chunk_count'):
+                print("Stored question contexts are stale; falling back to live retrieval")
+                self._data = None
+                return False
+            self._verified_version = version
+            self._chunks.clear()
+        return True
+
+    def lookup(self, question_id, bank, registry, n_results=3):
+        """Return [(chunk id, distance)] for a bank question, or None."""
+        with self._lock:
+            self._load()
+            if not self._is_current(bank, registry):
+                return None
+            if n_results > self._data.get('top_k', 0):
+                return None
+            context = self._data['contexts'].get(question_id)
+        if context is None:
+            return None
+        return [tuple(item) for item in context[:n_results]]
+
+    def chunks_for(self, question_id, bank, registry, n_results=3, chunk_vectors=None):
+        """Return [(document, metadata)] for a bank question, or None if not stored.
+
+        With a context_packer.ChunkVectors, the chunks' stored vectors are
+        recorded in it.
+        """
+        context = self.lookup(question_id, bank, registry, n_results)
+        if context is None:
+            return None
+        cache_key = (question_id, n_results)
+        cached = self._chunks.get(cache_key)
+        if cached is None:
+            if not context:
+                return []
+            ids = [chunk_id for chunk_id, _ in context]
+            results = registry.run(lambda collection: collection.get(
+                ids=ids, include=['documents', 'metadatas', 'embeddings']
+            ))
+            embeddings = results.get('embeddings')
+            if embeddings is None:
+                embeddings = [None] * len(results['ids'])
+            by_id = {
+                chunk_id: ((document, metadata or {}), embedding)
+                for chunk_id, document, metadata, embedding in zip(
+                    results['ids'], results['documents'], results['metadatas'], embeddings
+                )
+            }
+            if len(by_id) != len(ids):
+                return None
+            cached = (tuple(by_id[chunk_id][0] for chunk_id in ids), tuple(by_id[chunk_id][1] for chunk_id in ids))
+            self._chunks[cache_key] = cached
+        chunks, vectors = cached
+        if chunk_vectors is not None:
+            chunk_vectors.put([document for document, _ in chunks], vectors)
+        return list(chunks)
+
+    def save(self, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._data = data
+            self._loaded = True
+            self._verified_version = None
+            self._chunks.clear()
+
+    def clear(self):
+        """Drop stored contexts, e.g. after the collection was emptied."""
+        with self._lock:
+            self._data = None
+            self._loaded = True
+            self._chunks.clear()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _query_ids(registry, embeddings, n_results, where=None):
+    """Return [[chunk id, distance]] per embedding from one multi-query call."""
+    results = registry.run(lambda collection: collection.query(
+        query_embeddings=embeddings,
+        n_results=n_results,
+        where=where,
+        include=['distances']
+    ))
+    return [
+        [[chunk_id, float(distance)] for chunk_id, distance in zip(ids, distances)]
+        for ids, distances in zip(results['ids'], results['distances'])
+    ]
+
+
+def precompute_question_contexts(bank, registry, embedder, store, top_k=PRECOMPUTE_TOP_K):
+    """Embed every bank question and store its top-k chunk ids and distances."""
+    chunk_count = registry.run(lambda collection: collection.count())
+    contexts = {}
+    if chunk_count:
+        questions = list(bank.questions)
+        n_results = min(top_k, chunk_count)
+        print(f"Precomputing context for {len(questions)} questions...")
+        for i in range(0, len(questions), PRECOMPUTE_BATCH_SIZE):
+            batch = questions[i:i + PRECOMPUTE_BATCH_SIZE]
+            embeddings = embedder.encode([q['text'] for q in batch]).tolist()
+            by_topic = {}
+            for j, q in enumerate(batch):
+                by_topic.setdefault(q.get('topic'), []).append(j)
+            unmatched = by_topic.pop(None, [])
+            for topic, positions in by_topic.items():
+                found = _query_ids(registry, [embeddings[j] for j in positions], n_results, {'topic': topic})
+                for j, context in zip(positions, found):
+                    if context:
+                        contexts[batch[j]['id']] = context
+                    else:
+                        unmatched.append(j)
+            if unmatched:
+                found = _query_ids(registry, [embeddings[j] for j in unmatched], n_results)
+                for j, context in zip(unmatched, found):
+                    contexts[batch[j]['id']] = context
+
+    store.save({
+        'bank_version': bank.version,
+        'chunk_count': chunk_count,
+        'top_k': top_k,
+        'contexts': contexts
+    })
+    print(f"Stored context for {len(contexts)} questions")
+    return len(contexts)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Reference Answers
+Offline job that works out a model answer for every question in the bank
+once, so grading a student's attempt becomes a short comparison against it
+instead of solving the question from scratch on every request.
+
+Answers are stored in db/reference_answers.sqlite3, versioned by model and
+prompt version and tied to a hash of the question text. Calls run with
+bounded concurrency through an LLM backend (llm_backends), and a
+deterministic local stand-in model can replace it for tests and dry runs:
+
+    python reference_answers.py [--local | --backend openai|ollama] [--force] [--concurrency N]
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from admission import AdmissionController, call_cost
+from prompts import build_reference_messages
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+reference_answers_path = os.path.join(project_root, "db", "reference_answers.sqlite3")
+
+# Bump when prompts.build_reference_messages changes so answers are regenerated
+REFERENCE_PROMPT_VERSION = 1
+REFERENCE_MODEL = os.getenv("REFERENCE_ANSWER_MODEL", "gpt-3.5-turbo")
+REFERENCE_CONCURRENCY = int(os.getenv("REFERENCE_ANSWER_CONCURRENCY", "4"))
+REFERENCE_MAX_TOKENS = 700
+REFERENCE_CONTEXT_CHUNKS = 3
+
+LOCAL_MODEL = "local-stand-in"
+
+_sentence_end = re.compile(r'(?<=[.!?])\s+')
+
+
+def question_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def llm_completer(backend, admission=None):
+    """complete(messages, max_tokens) backed by an llm_backends backend.
+
+    With an admission.AdmissionController, calls are paced to its rate limits.
+    """
+    def complete(messages, max_tokens):
+        if admission is not None:
+            admission.admit("reference-answers", call_cost(messages, max_tokens))
+        return backend.complete(messages, max_tokens=max_tokens, temperature=0)
+    return complete
+
+
+def local_completer(messages, max_tokens):
+    """Deterministic stand-in model: an extractive answer from the prompt's excerpts."""
+    prompt = messages[-1]['content']
+    excerpts = prompt.split("Textbook Excerpts:", 1)[-1].rsplit("Model answer:", 1)[0].strip()
+    sentences = [s for s in _sentence_end.split(excerpts) if s.strip()]
+    words = []
+    for sentence in sentences:
+        words.extend(sentence.split())
+        if len(words) >= max_tokens // 2:
+            break
+    return " ".join(words[:max_tokens // 2]) or "No reference material available."
+
+
+class ReferenceAnswerStore:
+    """SQLite table of reference answers keyed by (question, model, prompt version)."""
+
+    def __init__(self, path=reference_answers_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection under the store lock; commit and close afterwards."""
+        with self._lock:
+            if not self._initialized:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS reference_answers ("
+                        " question_id TEXT, model TEXT, prompt_version INTEGER,"
+                        " question_hash TEXT, answer TEXT, created REAL,"
+                        " PRIMARY KEY (question_id, model, prompt_version))"
+                    )
+                    self._initialized = True
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def get(self, question, model=REFERENCE_MODEL, prompt_version=REFERENCE_PROMPT_VERSION):
+        """Return the stored answer for a question record, or None if missing or stale."""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT question_hash, answer FROM reference_answers"
+                    " WHERE question_id = ? AND model = ? AND prompt_version = ?",
+                    (question['id'], model, prompt_version)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Reference answers unavailable: {e}")
+            return None
+        if row is None or row[0] != question_hash(question['text']):
+            return None
+        return row[1]
+
+    def missing(self, questions, model=REFERENCE_MODEL, prompt_version=REFERENCE_PROMPT_VERSION):
+        """Questions without a current reference answer for this model and prompt."""
+        with self._connect() as conn:
+            stored = dict(conn.execute(
+                "SELECT question_id, question_hash FROM reference_answers"
+                " WHERE model = ? AND prompt_version = ?",
+                (model, prompt_version)
+            ).fetchall())
+        return [q for q in questions if stored.get(q['id']) != question_hash(q['text'])]
+
+    def put(self, question, answer, model=REFERENCE_MODEL, prompt_version=REFERENCE_PROMPT_VERSION):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reference_answers VALUES (?, ?, ?, ?, ?, ?)",
+                (question['id'], model, prompt_version, question_hash(question['text']), answer, time.time())
+            )
+
+    def count(self, model=REFERENCE_MODEL, prompt_version=REFERENCE_PROMPT_VERSION):
+        try:
+            with self._connect() as conn:
+                return conn.execute(
+                    "SELECT COUNT(*) FROM reference_answers WHERE model = ? AND prompt_version = ?",
+                    (model, prompt_version)
+                ).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+
+def generate_reference_answers(questions, complete, store, model=REFERENCE_MODEL,
+                               context_for=None, concurrency=REFERENCE_CONCURRENCY, force=False):
+    """Generate and store a reference answer for every question that lacks one.
+
+    complete(messages, max_tokens) returns the model's text; context_for(question)
+    returns the textbook context string for a question (or None). At most
+    `concurrency` calls are in flight at once. Returns (generated, failed).
+    """
+    pending = list(questions) if force else store.missing(questions, model)
+    if not pending:
+        print("All reference answers are up to date")
+        return 0, 0
+
+    def work(question):
+        context = context_for(question) if context_for else None
+        answer = complete(build_reference_messages(question['text'], context), REFERENCE_MAX_TOKENS)
+        store.put(question, answer, model)
+
+    print(f"Generating {len(pending)} reference answers with {model} ({concurrency} at a time)...")
+    started = time.perf_counter()
+    generated = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(work, q): q for q in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                generated += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error generating reference answer for {futures[future]['id']}: {e}")
+    elapsed = time.perf_counter() - started
+    print(f"Generated {generated} reference answers ({failed} failed) in {elapsed:.1f}s")
+    return generated, failed
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from chroma_pool import get_registry
+    from context_packer import format_context
+    from question_bank import get_question_bank
+    from question_context import QuestionContextStore
+
+    load_dotenv()
+    args = sys.argv[1:]
+    local = "--local" in args
+    force = "--force" in args
+    concurrency = REFERENCE_CONCURRENCY
+    if "--concurrency" in args:
+        concurrency = int(args[args.index("--concurrency") + 1])
+
+    bank = get_question_bank()
+    registry = get_registry(os.path.join(project_root, "db", "chroma_db_test"))
+    contexts = QuestionContextStore()
+
+    def context_for(question):
+        try:
+            chunks = contexts.chunks_for(question['id'], bank, registry, REFERENCE_CONTEXT_CHUNKS)
+        except Exception as e:
+            print(f"No stored context for {question['id']}: {e}")
+            return None
+        return format_context(chunks) if chunks else None
+
+    if local:
+        complete, model = local_completer, LOCAL_MODEL
+    else:
+        from llm_backends import BACKENDS, OpenAIBackend
+        name = args[args.index("--backend") + 1] if "--backend" in args else "openai"
+        if name == "openai":
+            backend = OpenAIBackend(model=REFERENCE_MODEL, max_concurrency=concurrency)
+        else:
+            backend = BACKENDS[name](max_concurrency=concurrency)
+        if not backend.available():
+            sys.exit(f"{backend.problem()}; use --local for the stand-in model")
+        # A batch job waits as long as it takes rather than being turned away.
+        # The rate limits are OpenAI's, so other backends aren't paced by them.
+        admission = AdmissionController(max_wait=float("inf")) if name == "openai" else None
+        complete, model = llm_completer(backend, admission), backend.model
+
+    generate_reference_answers(
+        bank.questions, complete, ReferenceAnswerStore(), model,
+        context_for=context_for, concurrency=concurrency, force=force
+    )
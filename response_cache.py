@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Response Cache
+Persistent cache of LLM responses for answer grading and custom questions.
+Entries are scoped by (kind, model, prompt template version, context chunk
+fingerprint, and for grading the question itself); inside a scope a request
+is matched first on its normalized text and then by embedding similarity, so
+a paraphrased question reuses an earlier response instead of making another
+LLM round-trip.
+
+Grading uses exact matching only by default: answers that differ by an
+amount, a year or a "not" can embed almost identically, and must not share
+feedback. RESPONSE_CACHE_GRADING_THRESHOLD turns on a (strict) semantic
+match for grading.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+response_cache_path = os.path.join(project_root, "db", "response_cache.sqlite3")
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Minimum cosine similarity for a semantic hit
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+# The same for graded answers; 0 means exact matches only
+RESPONSE_CACHE_GRADING_THRESHOLD = float(os.getenv("RESPONSE_CACHE_GRADING_THRESHOLD", "0"))
+# Set to 0 to disable the cache entirely
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of a request text."""
+    return _whitespace.sub(' ', text or '').strip().lower()
+
+
+def _sha1(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def context_fingerprint(context_chunks):
+    """Stable id for the ordered list of chunks a prompt was built from."""
+    return _sha1("\0".join(_sha1(document) for document, _ in context_chunks or []))
+
+
+def make_scope(kind, model, prompt_version, context_chunks, question=None):
+    """Cache scope: responses are only ever shared within one scope."""
+    parts = [kind, model, str(prompt_version), context_fingerprint(context_chunks)]
+    if question is not None:
+        parts.append(normalize_text(question))
+    return _sha1("\0".join(parts))
+
+
+class ResponseCache:
+    """SQLite-backed exact + semantic response cache with LRU eviction."""
+
+    def __init__(self, path=response_cache_path, embedder=None, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 threshold=RESPONSE_CACHE_THRESHOLD, enabled=RESPONSE_CACHE_ENABLED):
+        self.path = path
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._counters = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0}
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection under the cache lock; commit and close afterwards."""
+        with self._lock:
+            if not self._initialized:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS responses ("
+                        " scope TEXT, text_key TEXT, embedding BLOB, response TEXT,"
+                        " created REAL, last_used REAL, hits INTEGER DEFAULT 0,"
+                        " PRIMARY KEY (scope, text_key))"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+                    self._initialized = True
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _embed(self, text):
+        if self.embedder is None:
+            return None
+        try:
+            vector = np.asarray(self.embedder.encode(normalize_text(text)), dtype=np.float32)
+        except Exception as e:
+            print(f"Response cache: could not embed request, exact matching only: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, scope, text, bypass=False, threshold=None):
+        """Return (response, 'exact' or 'semantic'), or None on a miss.
+
+        bypass=True skips the lookup (the fresh response is still stored).
+        threshold overrides the cache's similarity threshold; 0 matches
+        exact text only.
+        """
+        if not self.enabled:
+            return None
+        if bypass:
+            self._count('bypassed')
+            return None
+        text_key = _sha1(normalize_text(text))
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response FROM responses WHERE scope = ? AND text_key = ?", (scope, text_key)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE scope = ? AND text_key = ?",
+                        (time.time(), scope, text_key)
+                    )
+                    match = (row[0], 'exact')
+                else:
+                    match = None
+            threshold = self.threshold if threshold is None else threshold
+            if match is None and threshold > 0:
+                match = self._semantic_lookup(scope, text, threshold)
+        except sqlite3.Error as e:
+            print(f"Response cache unavailable: {e}")
+            return None
+        self._count('misses' if match is None else f"{match[1]}_hits")
+        return match
+
+    def _semantic_lookup(self, scope, text, threshold):
+        query = self._embed(text)
+        if query is None:
+            return None
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT text_key, embedding FROM responses WHERE scope = ? AND embedding IS NOT NULL", (scope,)
+            ).fetchall()
+            if not rows:
+                return None
+            vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+            if vectors.shape[1] != len(query):
+                return None
+            similarities = vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                return None
+            text_key = rows[best][0]
+            response = conn.execute(
+                "SELECT response FROM responses WHERE scope = ? AND text_key = ?", (scope, text_key)
+            ).fetchone()[0]
+            conn.execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE scope = ? AND text_key = ?",
+                (time.time(), scope, text_key)
+            )
+        return response, 'semantic'
+
+    def store(self, scope, text, response, semantic=True):
+        """Remember a response and evict the least recently used entries over the cap.
+
+        semantic=False skips embedding the text, for scopes only ever matched exactly.
+        """
+        if not self.enabled or not response:
+            return
+        vector = self._embed(text) if semantic else None
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (scope, text_key, embedding, response, created, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, _sha1(normalize_text(text)),
+                     vector.tobytes() if vector is not None else None, response, now, now)
+                )
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error writing response cache: {e}")
+            return
+        self._count('stores')
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if total <= self.max_entries:
+            return
+        conn.execute(
+            "DELETE FROM responses WHERE rowid IN"
+            " (SELECT rowid FROM responses ORDER BY last_used LIMIT ?)",
+            (total - self.max_entries,)
+        )
+
+    def clear(self):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            print(f"Error clearing response cache: {e}")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        try:
+            with self._connect() as conn:
+                entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        lookups = counters['exact_hits'] + counters['semantic_hits'] + counters['misses']
+        counters.update({
+            'enabled': self.enabled,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'threshold': self.threshold,
+            'hit_rate': (counters['exact_hits'] + counters['semantic_hits']) / lookups if lookups else 0.0
+        })
+        return counters
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Retrieval Result Cache
+Bounded LRU + TTL cache for vector-query results. Keys include the collection
+version, so anything cached before an ingest or a database clear can no
+longer be hit once the version moves on.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query used in cache keys."""
+    return _whitespace.sub(' ', query).strip().lower()
+
+
+class RetrievalCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query, top_k, version, topic=None):
+        return (normalize_query(query), top_k, version, topic)
+
+    def get(self, key):
+        """Return the cached value, or None if absent or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for LLM admission control - fair queuing across sessions and rejection.
+
+Limits are set high (600 requests per minute, a burst of one call) so the
+queue drains in tenths of a second.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(max_queue=10, max_wait=5):
+    # 10 calls a second, one at a time
+    return AdmissionController(rpm=600, tpm=0, max_queue=max_queue, max_wait=max_wait, burst_seconds=0.1)
+
+
+def test_fair_queue():
+    """A session with a backlog doesn't make a later session wait behind all of it."""
+    print("Testing fair queuing across sessions...")
+    controller = make_controller()
+    order = []
+
+    def call(session):
+        controller.admit(session, 10)
+        order.append(session)
+
+    controller.admit("a", 10)  # takes the burst, so everything below queues
+    threads = []
+    for session in ["a", "a", "a", "a", "b"]:
+        thread = threading.Thread(target=call, args=(session,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)  # queue in this order
+    for thread in threads:
+        thread.join()
+    # b gets the second turn rather than the fifth
+    assert order == ["a", "b", "a", "a", "a"], order
+    stats = controller.stats()
+    assert stats['admitted'] == 6 and stats['queued'] == 5 and stats['rejected'] == 0, stats
+    print("✓ Fair queue - OK")
+    return True
+
+
+def test_fair_queue_async():
+    """admit_async takes turns the same way without blocking the event loop."""
+    print("Testing fair queuing for async callers...")
+    controller = make_controller()
+    order = []
+
+    async def call(session, delay):
+        await asyncio.sleep(delay)
+        await controller.admit_async(session, 10)
+        order.append(session)
+
+    async def main():
+        await controller.admit_async("a", 10)
+        calls = [call("a", i * 0.01) for i in range(4)] + [call("b", 0.05)]
+        await asyncio.gather(*calls)
+
+    asyncio.run(main())
+    assert order == ["a", "b", "a", "a", "a"], order
+    print("✓ Async fair queue - OK")
+    return True
+
+
+def test_rejection():
+    """A full queue or a wait longer than max_wait is rejected with a Retry-After."""
+    print("Testing admission rejection...")
+    controller = make_controller(max_queue=1)
+    controller.admit("a", 10)
+    waiter = threading.Thread(target=controller.admit, args=("a", 10))
+    waiter.start()
+    time.sleep(0.02)
+    try:
+        controller.admit("b", 10)
+        raise AssertionError("a call past a full queue was admitted")
+    except AdmissionRejected as e:
+        assert e.reason == "Too many requests are waiting", e.reason
+        assert e.retry_after >= 1
+    waiter.join()
+
+    slow = AdmissionController(rpm=6, tpm=0, max_queue=10, max_wait=2, burst_seconds=0.1)
+    slow.admit("a", 10)
+    try:
+        slow.admit("b", 10)  # the next call is 10 s away
+        raise AssertionError("a call over max_wait was admitted")
+    except AdmissionRejected as e:
+        assert e.reason == "Request rate limit reached", e.reason
+        assert 9 <= e.retry_after <= 11, e.retry_after
+    assert slow.stats()['rejected'] == 1 and slow.stats()['waiting'] == 0
+
+    # Disabled limits admit everything at once
+    assert AdmissionController(rpm=0, tpm=0).admit("a", 10 ** 6) == 0.0
+    print("✓ Rejection - OK")
+    return True
+
+
+def test_token_limit():
+    """A call's token cost is paced by the TPM bucket as well as the RPM one."""
+    print("Testing the tokens-per-minute limit...")
+    controller = AdmissionController(rpm=0, tpm=600, max_queue=10, max_wait=0.5, burst_seconds=10)
+    controller.admit("a", 100)  # the bucket holds 100 tokens
+    try:
+        controller.admit("a", 100)  # refills at 10 tokens a second
+        raise AssertionError("a call over the token limit was admitted")
+    except AdmissionRejected as e:
+        assert e.reason == "Request rate limit reached", e.reason
+    print("✓ Token limit - OK")
+    return True
+
+
+def run_all_tests():
+    tests = [test_fair_queue, test_fair_queue_async, test_rejection, test_token_limit]
+    passed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e!r}")
+    print(f"\n{passed}/{len(tests)} admission tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
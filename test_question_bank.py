@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tests for the question bank - streaming segmentation and /api/questions paging.
+
+segment_questions() replaced a regex over the whole exam text; its output,
+offsets included, must match what that regex produced.
+"""
+
+import glob
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from question_bank import QuestionBank, make_question_record, segment_questions
+
+# The parser segment_questions replaced
+OLD_QUESTION_PATTERN = re.compile(
+    r'(Question [A-Z]-\d+ \([^)]+\)[\s\S]*?)(?=Question [A-Z]-\d+ \(|\Z)',
+    re.IGNORECASE
+)
+
+
+def regex_segments(pages):
+    """(start, text) pairs as the old regex parser found them."""
+    full_text = ""
+    for page_text in pages:
+        if page_text:
+            full_text += "\n" + page_text
+    segments = []
+    for match in OLD_QUESTION_PATTERN.finditer(full_text):
+        q = match.group(1)
+        idx = q.upper().find('SUGGESTED ANSWER:')
+        if idx != -1:
+            q = q[:idx]
+        text = q.strip()
+        if len(text) > 20:
+            segments.append((match.start(1) + (len(q) - len(q.lstrip())), text))
+    return segments
+
+
+SAMPLE_PAGES = [
+    "EVIDENCE EXAM\nInstructions: answer every question.\n",
+    "Question A-1 (10 points)\nIs the statement hearsay?\nSUGGESTED ANSWER: Yes, it is",
+    " offered for its truth.\nQuestion A-2 (5 points) Short.\n",
+    "",
+    "Question A-3 (15 points)\nDiscuss the rule against perpetuities in detail.\nQues",
+    "tion B-1 (20 points)\nA gift of land is made to A for life.\nsuggested ans",
+    "wer: the remainder is vested.\nQuestion B-2 (8 points)\nExplain adverse possession.",
+]
+
+
+def test_segments_match_old_regex():
+    """Headers and answer markers split across pages still segment as before."""
+    print("Testing segment_questions against the old regex...")
+    expected = regex_segments(SAMPLE_PAGES)
+    assert len(expected) == 4, expected
+    assert list(segment_questions(SAMPLE_PAGES)) == expected
+    # One page at a time or all at once, the output is the same
+    assert list(segment_questions(iter(SAMPLE_PAGES))) == expected
+    assert list(segment_questions(["\n".join(p for p in SAMPLE_PAGES if p)])) == regex_segments(
+        ["\n".join(p for p in SAMPLE_PAGES if p)])
+    assert list(segment_questions([])) == regex_segments([]) == []
+    assert list(segment_questions(["No questions on this page."])) == []
+    print("✓ Segments match - OK")
+    return True
+
+
+def test_segments_match_old_regex_on_exams():
+    """Every exam in data/questions segments exactly as the old regex did."""
+    print("Testing segment_questions on the exam PDFs...")
+    from pdf_extraction import extract_pdfs
+
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "questions")
+    pdf_paths = sorted(glob.glob(os.path.join(folder, "*.pdf")))
+    if not pdf_paths:
+        print("✓ No exam PDFs to check - skipped")
+        return True
+    for pdf_path, pages in extract_pdfs(pdf_paths).items():
+        assert list(segment_questions(pages)) == regex_segments(pages), pdf_path
+        print(f"  {os.path.basename(pdf_path)}: {len(regex_segments(pages))} questions")
+    print("✓ Exam segments match - OK")
+    return True
+
+
+def make_bank(version, count=5):
+    texts = [f"Question A-{n} ({n} points) What is rule number {n} of evidence?" for n in range(1, count + 1)]
+    return QuestionBank([make_question_record(text, "EXAM-2023.pdf", 2023, i * 100) for i, text in enumerate(texts)],
+                        version)
+
+
+def test_questions_cursor_and_etag():
+    """Cursors walk the bank page by page; ETags answer repeat requests with 304."""
+    print("Testing /api/questions cursors and ETags...")
+    import app as web
+
+    banks = {'current': make_bank("v1")}
+    original = web.get_question_bank
+    web.get_question_bank = lambda folder: banks['current']
+    try:
+        client = web.app.test_client()
+        ids = []
+        url = '/api/questions?limit=2&fields=summary'
+        first = None
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200, response.data
+            payload = response.get_json()
+            first = first or (url, response.headers['ETag'], payload['next_cursor'])
+            ids.extend(q['id'] for q in payload['questions'])
+            cursor = payload['next_cursor']
+            url = f'/api/questions?limit=2&fields=summary&cursor={cursor}' if cursor else None
+        assert ids == [q['id'] for q in banks['current'].questions]
+
+        first_url, etag, cursor = first
+        response = client.get(first_url, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and not response.data
+        # A different page, field set or bank version has a different ETag
+        assert client.get('/api/questions?limit=2&fields=full').headers['ETag'] != etag
+
+        # A cursor from the old bank is rejected once the bank changes
+        banks['current'] = make_bank("v2")
+        assert client.get(first_url, headers={'If-None-Match': etag}).status_code == 200
+        assert client.get(f'/api/questions?limit=2&cursor={cursor}').status_code == 400
+        assert client.get('/api/questions?cursor=not-a-cursor').status_code == 400
+    finally:
+        web.get_question_bank = original
+    print("✓ Cursors and ETags - OK")
+    return True
+
+
+def run_all_tests():
+    tests = [test_segments_match_old_regex, test_segments_match_old_regex_on_exams, test_questions_cursor_and_etag]
+    passed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e!r}")
+    print(f"\n{passed}/{len(tests)} question bank tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for reference answers - generation with the local stand-in model,
+staleness, and grading against a stored answer.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from question_bank import QuestionBank, make_question_record
+from reference_answers import (REFERENCE_MODEL, ReferenceAnswerStore, generate_reference_answers,
+                               local_completer)
+
+CONTEXT = ("Gross income means all income from whatever source derived. "
+           "Gifts are excluded from gross income under section 102. "
+           "Compensation for services is included.")
+
+
+def make_questions():
+    texts = [
+        "Question A-1 (10 points) Is a gift of cash from a parent taxable income?",
+        "Question A-2 (5 points) Is a salary paid for services included in gross income?",
+        "Question B-1 (20 points) Explain when a prize is excluded from gross income.",
+    ]
+    return [make_question_record(text, "EXAM-2023.pdf", 2023, i * 100) for i, text in enumerate(texts)]
+
+
+def make_store():
+    return ReferenceAnswerStore(os.path.join(tempfile.mkdtemp(), "reference_answers.sqlite3"))
+
+
+def test_local_completer():
+    """The stand-in answers deterministically from the prompt's excerpts."""
+    print("Testing the local stand-in model...")
+    from prompts import build_reference_messages
+    messages = build_reference_messages(make_questions()[0]['text'], CONTEXT)
+    answer = local_completer(messages, 700)
+    assert answer == local_completer(messages, 700)
+    assert answer.startswith("Gross income means all income") and "section 102" in answer, answer
+    assert "Model answer" not in answer and "Exam Question" not in answer
+    assert len(local_completer(messages, 10).split()) == 5
+    assert local_completer(build_reference_messages("Q?", None), 700) == "None available."
+    print("✓ Local stand-in - OK")
+    return True
+
+
+def test_generate_and_refresh():
+    """Only missing or stale answers are generated; force regenerates them all."""
+    print("Testing reference answer generation...")
+    store = make_store()
+    questions = make_questions()
+    calls = []
+    lock = threading.Lock()
+
+    def complete(messages, max_tokens):
+        with lock:
+            calls.append(messages)
+        return local_completer(messages, max_tokens)
+
+    assert generate_reference_answers(questions, complete, store, "local", lambda q: CONTEXT, 2) == (3, 0)
+    assert store.count("local") == 3 and store.missing(questions, "local") == []
+    assert store.get(questions[0], "local").startswith("Gross income means")
+    # Answers are per model
+    assert store.get(questions[0], REFERENCE_MODEL) is None
+
+    # Nothing to do on a second run
+    assert generate_reference_answers(questions, complete, store, "local", lambda q: CONTEXT) == (0, 0)
+    assert len(calls) == 3
+
+    # A question whose text changed is stale until regenerated
+    edited = dict(questions[1], text=questions[1]['text'] + " Explain.")
+    assert store.get(edited, "local") is None
+    assert store.missing([questions[0], edited], "local") == [edited]
+    assert generate_reference_answers([questions[0], edited], complete, store, "local") == (1, 0)
+    assert store.get(edited, "local") == "None available."  # no context_for this time
+
+    # Failures are counted and leave the answer missing
+    def failing(messages, max_tokens):
+        raise RuntimeError("model unavailable")
+
+    assert generate_reference_answers(questions, failing, store, "other", concurrency=2) == (0, 3)
+    assert store.missing(questions, "other") == questions
+
+    assert generate_reference_answers(questions, complete, store, "local", force=True) == (3, 0)
+    print("✓ Generation - OK")
+    return True
+
+
+def test_grading_uses_reference_answer():
+    """Bank questions with a stored answer get the short comparison prompt."""
+    print("Testing grading against a reference answer...")
+    import app as web
+
+    questions = make_questions()
+    store = make_store()
+    generate_reference_answers(questions[:1], local_completer, store, REFERENCE_MODEL, lambda q: CONTEXT)
+
+    originals = (web.get_question_bank, web.reference_answers)
+    web.get_question_bank = lambda folder: QuestionBank(questions, "v1")
+    web.reference_answers = store
+    try:
+        chunks = [(CONTEXT, {'filename': 'tax.pdf', 'page': 3})]
+        messages, max_tokens, kind = web.grading_request(questions[0]['text'], "It is not taxable.", chunks)
+        assert kind.startswith("grade-reference:") and max_tokens == web.GRADING_MAX_TOKENS
+        assert store.get(questions[0]) in messages[-1]['content']
+
+        # Without a stored answer the question is solved from the context
+        messages, max_tokens, kind = web.grading_request(questions[1]['text'], "Yes.", chunks)
+        assert kind == 'grade' and max_tokens == 1000
+        assert CONTEXT in messages[-1]['content']
+    finally:
+        web.get_question_bank, web.reference_answers = originals
+    print("✓ Grading with a reference answer - OK")
+    return True
+
+
+def run_all_tests():
+    tests = [test_local_completer, test_generate_and_refresh, test_grading_uses_reference_answer]
+    passed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e!r}")
+    print(f"\n{passed}/{len(tests)} reference answer tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
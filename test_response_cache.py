@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the response cache - exact vs semantic matching.
+
+The embedder is a stand-in that ignores "not", as MiniLM nearly does: a
+pair of answers that differ only by a negation embed identically.
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from response_cache import ResponseCache, make_scope
+
+VOCABULARY = ["income", "taxable", "gross", "gift", "excluded", "is", "the", "a", "what", "counts", "as"]
+
+
+class NegationBlindEmbedder:
+    """Bag-of-words vectors over VOCABULARY; every other word (including 'not') is ignored."""
+
+    def encode(self, text):
+        vector = np.zeros(len(VOCABULARY), dtype=np.float32)
+        for word in text.lower().replace("?", " ").replace(".", " ").split():
+            if word in VOCABULARY:
+                vector[VOCABULARY.index(word)] += 1
+        return vector
+
+
+def make_cache():
+    path = os.path.join(tempfile.mkdtemp(), "responses.sqlite3")
+    return ResponseCache(path=path, embedder=NegationBlindEmbedder(), threshold=0.95)
+
+
+def grading_scope():
+    return make_scope("grade", "test-model", 1, [("Gifts are excluded from gross income.", {})],
+                      "Is a gift taxable income?")
+
+
+def test_exact_lookup():
+    """Identical answers (ignoring case and spacing) share a response."""
+    print("Testing exact lookup...")
+    cache = make_cache()
+    scope = grading_scope()
+    cache.store(scope, "The gift is excluded.", "Correct.", semantic=False)
+    assert cache.lookup(scope, "  the GIFT is   excluded. ", threshold=0) == ("Correct.", "exact")
+    assert cache.lookup(scope, "The gift is excluded.", bypass=True) is None
+    print("✓ Exact lookup - OK")
+    return True
+
+
+def test_grading_negation_not_shared():
+    """Answers that differ only by 'not' must not share grading feedback."""
+    print("Testing grading answers that differ by a negation...")
+    cache = make_cache()
+    scope = grading_scope()
+    right = "The gift is excluded from gross income."
+    wrong = "The gift is not excluded from gross income."
+    embedder = NegationBlindEmbedder()
+    a, b = embedder.encode(right), embedder.encode(wrong)
+    similarity = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+    assert similarity >= 0.95, similarity
+
+    cache.store(scope, right, "Correct - gifts are excluded under section 102.", semantic=False)
+    # Grading matches exactly (RESPONSE_CACHE_GRADING_THRESHOLD defaults to 0)
+    assert cache.lookup(scope, wrong, threshold=0) is None
+    # Even with embeddings stored, an exact-only lookup never matches the negated answer
+    cache.store(scope, right, "Correct - gifts are excluded under section 102.")
+    assert cache.lookup(scope, wrong, threshold=0) is None
+    # ...where the semantic threshold used for questions would have served it
+    assert cache.lookup(scope, wrong, threshold=0.95)[1] == "semantic"
+    print("✓ Negated answer is a cache miss - OK")
+    return True
+
+
+def test_semantic_lookup_for_questions():
+    """Custom questions still match by embedding similarity."""
+    print("Testing semantic lookup for questions...")
+    cache = make_cache()
+    scope = make_scope("ask", "test-model", 1, [])
+    cache.store(scope, "What counts as gross income?", "Income from whatever source derived.")
+    assert cache.lookup(scope, "What is gross income?") is None
+    match = cache.lookup(scope, "what counts as  GROSS income?")
+    assert match == ("Income from whatever source derived.", "exact")
+    match = cache.lookup(scope, "So what counts as gross income?")
+    assert match == ("Income from whatever source derived.", "semantic")
+    # Other scopes never share responses
+    assert cache.lookup(make_scope("ask", "other-model", 1, []), "What counts as gross income?") is None
+    print("✓ Semantic lookup - OK")
+    return True
+
+
+def run_all_tests():
+    tests = [test_exact_lookup, test_grading_negation_not_shared, test_semantic_lookup_for_questions]
+    passed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e!r}")
+    print(f"\n{passed}/{len(tests)} response cache tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for retrieval - result cache invalidation and reciprocal rank fusion.
+
+The vector and keyword searches are replaced with counting stand-ins, so no
+embedding model or ChromaDB collection is needed.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from bm25_index import reciprocal_rank_fusion
+from retrieval_cache import RetrievalCache
+
+
+def chunk(document):
+    return (document, {'filename': 'x.pdf', 'page': len(document)})
+
+
+def test_cache_entries():
+    """Keys ignore case and spacing; entries expire, are evicted LRU, and clear."""
+    print("Testing retrieval cache entries...")
+    cache = RetrievalCache(max_entries=2, ttl=60)
+    key = RetrievalCache.make_key("What is  Hearsay?", 3, 1)
+    cache.put(key, "chunks")
+    assert cache.get(RetrievalCache.make_key("what is hearsay?", 3, 1)) == "chunks"
+    # top_k, collection version and topic are all part of the key
+    assert cache.get(RetrievalCache.make_key("what is hearsay?", 5, 1)) is None
+    assert cache.get(RetrievalCache.make_key("what is hearsay?", 3, 2)) is None
+    assert cache.get(RetrievalCache.make_key("what is hearsay?", 3, 1, "evidence")) is None
+
+    cache.put(("b",), 2)
+    cache.get(key)          # key is now the most recently used
+    cache.put(("c",), 3)    # so ("b",) is evicted
+    assert cache.get(("b",)) is None and cache.get(key) == "chunks"
+    cache.clear()
+    assert cache.get(key) is None
+
+    expiring = RetrievalCache(ttl=0.05)
+    expiring.put(key, "chunks")
+    time.sleep(0.1)
+    assert expiring.get(key) is None
+    print("✓ Cache entries - OK")
+    return True
+
+
+def test_retrieve_many_invalidation():
+    """A new collection version (ingest or clear) stops cached results being served."""
+    print("Testing retrieval cache invalidation...")
+    import app as web
+
+    calls = []
+
+    def fake_vector_search_many(queries, n_results=3, topic=None):
+        calls.append(list(queries))
+        return [[chunk(f"{query} v{web.chroma_registry.version()}")] for query in queries]
+
+    originals = (web.vector_search_many, web.keyword_search, web.retrieval_cache, web.LEXICAL_FUSION)
+    web.vector_search_many = fake_vector_search_many
+    web.keyword_search = lambda query, n_results=3, topic=None: []
+    web.retrieval_cache = RetrievalCache()
+    web.LEXICAL_FUSION = False
+    try:
+        first = web.retrieve_many(["What is hearsay?", "what is  HEARSAY?", "Define a gift."])
+        # Equivalent queries share one search, and the batch is one call
+        assert calls == [["What is hearsay?", "Define a gift."]], calls
+        assert first[0] == first[1]
+        assert web.retrieve_many(["What is hearsay?"]) == [first[0]]
+        assert len(calls) == 1
+
+        web.chroma_registry.bump_version("textbook_chunks")
+        second = web.retrieve_many(["What is hearsay?"])
+        assert len(calls) == 2 and second != [first[0]], second
+        assert web.retrieve_many(["What is hearsay?"]) == second and len(calls) == 2
+    finally:
+        web.vector_search_many, web.keyword_search, web.retrieval_cache, web.LEXICAL_FUSION = originals
+    print("✓ Cache invalidation - OK")
+    return True
+
+
+def test_reciprocal_rank_fusion():
+    """Chunks ranked well in both lists come first; ties keep first-seen order."""
+    print("Testing reciprocal rank fusion...")
+    vector = [chunk("a"), chunk("b"), chunk("c")]
+    keyword = [chunk("c"), chunk("d"), chunk("a")]
+    fused = reciprocal_rank_fusion([vector, keyword], top_k=4)
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 -> tied, a seen first; then b (1/62), d (1/62)
+    assert [document for document, _ in fused] == ["a", "c", "b", "d"], fused
+    assert fused[0] == vector[0]
+    assert reciprocal_rank_fusion([vector, keyword], top_k=1) == [chunk("a")]
+    assert reciprocal_rank_fusion([vector, []], top_k=3) == vector
+    assert reciprocal_rank_fusion([[], []]) == []
+    # With the default k agreement wins; a small k favours a single top rank
+    lists = [[chunk("t"), chunk("m"), chunk("n"), chunk("u")], [chunk("v"), chunk("w"), chunk("x"), chunk("u")]]
+    assert reciprocal_rank_fusion(lists, top_k=1) == [chunk("u")]
+    assert reciprocal_rank_fusion(lists, top_k=1, k=1) == [chunk("t")]
+    print("✓ Reciprocal rank fusion - OK")
+    return True
+
+
+def run_all_tests():
+    tests = [test_cache_entries, test_retrieve_many_invalidation, test_reciprocal_rank_fusion]
+    passed = 0
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ {test.__name__} failed: {e!r}")
+    print(f"\n{passed}/{len(tests)} retrieval tests passed")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Subject Topics
+Tags textbook chunks and exam questions with one of the exam's subjects
+(tax, procedure, evidence, ethics) so retrieval can search only the matching
+slice of the collection.
+
+Chunks take their topic from the source PDF's name (tax_textbook.pdf,
+evidence_ppt.pdf, ...); chunks from mixed documents such as the handbook are
+classified by keyword. Exam questions take it from their section letter
+(S-, P-, E-), with the same keyword fallback.
+"""
+
+import os
+import re
+from collections import Counter
+
+from bm25_index import tokenize
+
+TOPICS = ('tax', 'procedure', 'evidence', 'ethics')
+GENERAL_TOPIC = 'general'
+
+# Exam sections: S = substantive tax law, P = Tax Court practice and procedure, E = evidence
+SECTION_TOPICS = {'S': 'tax', 'P': 'procedure', 'E': 'evidence'}
+
+FILENAME_PATTERN = re.compile(r'^(tax|procedure|evidence|ethics)[_\-. ]', re.IGNORECASE)
+
+# Keywords behind the subject areas listed in exam_topics.pdf (a scanned PDF
+# with no extractable text, so the vocabulary is kept here). They go through
+# the same tokenizer as the text, which splits hyphenated words.
+TOPIC_KEYWORDS = {
+    'tax': frozenset(tokenize("""
+        income deduction deductions deductible basis gain gains loss losses
+        depreciation corporation corporations shareholder shareholders
+        partnership partner partners dividend dividends capital gift gifts
+        taxable exclusion excludable credit credits gross adjusted wages
+        inventory annuity alimony charitable medical trust trusts beneficiary
+        grantor subchapter amortization installment recapture
+    """)),
+    'procedure': frozenset(tokenize("""
+        petition petitioner deficiency notice jurisdiction stipulation
+        stipulations docket trial pleading pleadings motion motions discovery
+        branerton joinder appeal appeals filing filed commissioner limitations
+        respondent calendar small lien levy collection overpayment refund
+        innocent spouse rule rules decision continuance subpoena
+    """)),
+    'evidence': frozenset(tokenize("""
+        witness witnesses testimony testify testifies hearsay objection
+        objections cross examination impeach impeachment
+        extrinsic exhibit exhibits privilege admissible inadmissible
+        relevance relevant authentication declarant expert opinion character
+        leading recollection refresh best original duplicate
+    """)),
+    'ethics': frozenset(tokenize("""
+        ethics ethical conduct professional misconduct conflict conflicts
+        client clients confidential confidentiality fee fees candor
+        competence diligence disciplinary discipline disbarment suspension
+        practitioner practitioners admission solicitation withdraw withdrawal
+        prospective representation integrity
+    """)),
+}
+
+# A keyword classification needs at least this many hits and a clear winner
+MIN_KEYWORD_HITS = 3
+
+
+def topic_from_filename(filename):
+    """Return the topic named by a file like tax_textbook.pdf, or None."""
+    match = FILENAME_PATTERN.match(os.path.basename(filename))
+    return match.group(1).lower() if match else None
+
+
+def classify_text(text, min_hits=MIN_KEYWORD_HITS):
+    """Best keyword-matched topic for a text, or None if none stands out."""
+    scores = Counter()
+    for token in tokenize(text or ""):
+        for topic, keywords in TOPIC_KEYWORDS.items():
+            if token in keywords:
+                scores[topic] += 1
+    ranked = scores.most_common(2)
+    if not ranked or ranked[0][1] < min_hits:
+        return None
+    if len(ranked) > 1 and ranked[1][1] * 2 > ranked[0][1]:
+        return None
+    return ranked[0][0]
+
+
+def topic_for_chunk(filename, text):
+    """Topic stored in a chunk's metadata; GENERAL_TOPIC if it can't be told."""
+    return topic_from_filename(filename) or classify_text(text) or GENERAL_TOPIC
+
+
+def topic_for_question(section, text):
+    """Topic of an exam question, from its section letter or its wording."""
+    return SECTION_TOPICS.get((section or '').upper()) or classify_text(text)
+
+
+def normalize_topic(topic):
+    """Return a known topic name, or None for anything else (including 'all')."""
+    topic = (topic or '').strip().lower()
+    return topic if topic in TOPICS else None
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+NumPy Vector Index
+Exact brute-force retrieval backend. The textbook_chunks collection is
+exported once into a pre-normalized float32 matrix stored as a .npy file,
+plus a parallel table of chunk ids, documents and metadata. The matrix is
+opened memory-mapped, so every worker process shares the same pages through
+the OS page cache, and a query is a single matrix-vector product followed by
+argpartition. Rows are grouped by chunk topic, so a topic-filtered query
+only multiplies against that topic's contiguous slice of the matrix.
+
+For small containers the scan can run over a compact copy instead
+(VECTOR_INDEX_STORAGE=float16 or int8 with a per-row scale, optionally after
+a PCA projection, VECTOR_INDEX_PCA_DIM). The compact scan only picks
+candidates; the final top-k is re-scored exactly against the float32 rows,
+of which only the candidates are ever paged in. `python vector_index.py
+--report` measures memory saved against recall@k on extracted_questions.txt.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+default_index_dir = os.path.join(project_root, "db", "vector_index")
+
+EXPORT_BATCH_SIZE = 1000
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+MANIFEST_FILE = "manifest.json"
+COMPACT_FILE = "compact.npy"
+SCALES_FILE = "scales.npy"
+PCA_FILE = "pca.npz"
+
+# Scan storage: float32 (exact scan), float16, or int8 with a per-row scale
+VECTOR_STORAGE = os.getenv("VECTOR_INDEX_STORAGE", "float32").lower()
+# Project onto this many principal components before quantizing; 0 keeps every dimension
+VECTOR_PCA_DIM = int(os.getenv("VECTOR_INDEX_PCA_DIM", "0"))
+# A compact scan keeps top_k * RESCORE_FACTOR candidates for float32 re-scoring
+RESCORE_FACTOR = int(os.getenv("VECTOR_INDEX_RESCORE_FACTOR", "4"))
+STORAGE_TYPES = ('float32', 'float16', 'int8')
+SCAN_BLOCK_ROWS = 8192
+PCA_SAMPLE_ROWS = 20000
+
+
+def normalize_rows(vectors):
+    """Scale each row to unit length (zero rows are left as zeros)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class CompactVectors:
+    """Reduced-precision (and optionally PCA-projected) copy of the matrix for scanning.
+
+    Scores approximate the cosine up to a per-query constant, which is all
+    candidate selection needs.
+    """
+
+    def __init__(self, codes, scales=None, mean=None, components=None):
+        self.codes = codes            # (n, dim) float16 or int8
+        self.scales = scales          # (n,) float32 per-row scale for int8 codes
+        self.mean = mean              # PCA centering vector, or None
+        self.components = components  # (pca_dim, full dim) projection, or None
+
+    @classmethod
+    def from_vectors(cls, vectors, storage, pca_dim=0):
+        """Build from normalized float32 rows (an array or a memmap), block by block."""
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage '{storage}'")
+        mean = components = None
+        n, dim = vectors.shape
+        if pca_dim and 0 < pca_dim < dim and n > 1:
+            step = max(1, n // PCA_SAMPLE_ROWS)
+            sample = np.asarray(vectors[::step], dtype=np.float32)
+            mean = sample.mean(axis=0)
+            _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            components = np.ascontiguousarray(vt[:pca_dim], dtype=np.float32)
+            dim = components.shape[0]
+
+        code_type = np.int8 if storage == 'int8' else np.dtype(storage)
+        codes = np.empty((n, dim), dtype=code_type)
+        scales = np.empty(n, dtype=np.float32) if storage == 'int8' else None
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            if components is not None:
+                block = (block - mean) @ components.T
+            if scales is not None:
+                block_scales = np.abs(block).max(axis=1) / 127.0
+                block_scales[block_scales == 0] = 1.0
+                codes[start:start + len(block)] = np.rint(block / block_scales[:, None])
+                scales[start:start + len(block)] = block_scales
+            else:
+                codes[start:start + len(block)] = block
+        return cls(codes, scales, mean, components)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.codes, self.scales, self.mean, self.components) if a is not None)
+
+    def scores(self, queries, start=0, end=None):
+        """Approximate (batch, rows) scores for normalized queries against rows [start, end)."""
+        end = len(self.codes) if end is None else end
+        if self.components is not None:
+            queries = queries @ self.components.T
+        scores = np.empty((len(queries), end - start), dtype=np.float32)
+        for block_start in range(start, end, SCAN_BLOCK_ROWS):
+            block_end = min(block_start + SCAN_BLOCK_ROWS, end)
+            block = self.codes[block_start:block_end].astype(np.float32)
+            block_scores = queries @ block.T
+            if self.scales is not None:
+                block_scores *= self.scales[block_start:block_end]
+            scores[:, block_start - start:block_end - start] = block_scores
+        return scores
+
+    def save(self, index_dir):
+        np.save(os.path.join(index_dir, COMPACT_FILE), self.codes)
+        if self.scales is not None:
+            np.save(os.path.join(index_dir, SCALES_FILE), self.scales)
+        if self.components is not None:
+            np.savez(os.path.join(index_dir, PCA_FILE), mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, index_dir):
+        codes = np.load(os.path.join(index_dir, COMPACT_FILE), mmap_mode='r')
+        scales = mean = components = None
+        scales_path = os.path.join(index_dir, SCALES_FILE)
+        if os.path.exists(scales_path):
+            scales = np.load(scales_path)
+        pca_path = os.path.join(index_dir, PCA_FILE)
+        if os.path.exists(pca_path):
+            with np.load(pca_path) as pca:
+                mean = pca['mean']
+                components = pca['components']
+        return cls(codes, scales, mean, components)
+
+
+def _remove_compact_files(index_dir):
+    for filename in (COMPACT_FILE, SCALES_FILE, PCA_FILE):
+        try:
+            os.remove(os.path.join(index_dir, filename))
+        except FileNotFoundError:
+            pass
+
+
+def export_collection(registry, index_dir=default_index_dir, name="textbook_chunks",
+                      storage=VECTOR_STORAGE, pca_dim=VECTOR_PCA_DIM):
+    """Write the collection's embeddings, ids, documents and metadata to index_dir.
+
+    With a non-float32 storage or a PCA dimension, a compact scan copy is
+    written next to the float32 matrix. Returns the manifest, or None (and
+    writes nothing) if the collection is empty.
+    """
+    count = registry.run(lambda collection: collection.count(), name)
+    if count == 0:
+        print("Collection is empty; nothing to export")
+        return None
+    os.makedirs(index_dir, exist_ok=True)
+
+    ids, documents, metadatas = [], [], []
+    vectors = None
+    vectors_tmp = os.path.join(index_dir, VECTORS_FILE + ".tmp")
+    row = 0
+    for offset in range(0, count, EXPORT_BATCH_SIZE):
+        batch = registry.run(lambda collection: collection.get(
+            limit=EXPORT_BATCH_SIZE,
+            offset=offset,
+            include=['embeddings', 'documents', 'metadatas']
+        ), name)
+        embeddings = normalize_rows(batch['embeddings'])
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                vectors_tmp, mode='w+', dtype=np.float32, shape=(count, embeddings.shape[1])
+            )
+        vectors[row:row + len(embeddings)] = embeddings
+        row += len(embeddings)
+        ids.extend(batch['ids'])
+        documents.extend(batch['documents'])
+        metadatas.extend(m or {} for m in batch['metadatas'])
+
+    if vectors is None:
+        vectors = np.lib.format.open_memmap(vectors_tmp, mode='w+', dtype=np.float32, shape=(0, 0))
+    vectors.flush()
+    dim = vectors.shape[1]
+    del vectors
+
+    # Group rows by topic so each topic is one contiguous slice
+    order = sorted(range(len(ids)), key=lambda i: metadatas[i].get('topic') or '')
+    if order != list(range(len(ids))):
+        _reorder_rows(vectors_tmp, order)
+        ids = [ids[i] for i in order]
+        documents = [documents[i] for i in order]
+        metadatas = [metadatas[i] for i in order]
+
+    chunks_tmp = os.path.join(index_dir, CHUNKS_FILE + ".tmp")
+    with open(chunks_tmp, 'w', encoding='utf-8') as f:
+        json.dump({'ids': ids, 'documents': documents, 'metadatas': metadatas}, f)
+    os.replace(vectors_tmp, os.path.join(index_dir, VECTORS_FILE))
+    os.replace(chunks_tmp, os.path.join(index_dir, CHUNKS_FILE))
+
+    _remove_compact_files(index_dir)
+    compact = None
+    if storage != 'float32' or pca_dim:
+        full = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+        compact = CompactVectors.from_vectors(full, storage, pca_dim)
+        del full
+        compact.save(index_dir)
+
+    manifest = {
+        'count': len(ids),
+        'chunk_count': count,
+        'dim': dim,
+        'collection': name,
+        'exported_at': time.time(),
+        'storage': storage if compact is not None else 'float32',
+        'pca_dim': compact.codes.shape[1] if compact is not None and compact.components is not None else 0
+    }
+    with open(os.path.join(index_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    if compact is not None:
+        print(f"Exported {len(ids)} vectors ({dim} dims) to {index_dir}; scanning "
+              f"{manifest['storage']} x {compact.codes.shape[1]} dims ({compact.nbytes} bytes)")
+    else:
+        print(f"Exported {len(ids)} vectors ({dim} dims) to {index_dir}")
+    return manifest
+
+
+def read_manifest(index_dir=default_index_dir):
+    """The export's manifest, or None if there is no readable export."""
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable vector index manifest: {e}")
+        return None
+
+
+def _reorder_rows(vectors_path, order):
+    """Rewrite the .npy matrix at vectors_path with its rows in the given order."""
+    source = np.load(vectors_path, mmap_mode='r')
+    sorted_tmp = vectors_path + ".sorted"
+    target = np.lib.format.open_memmap(sorted_tmp, mode='w+', dtype=np.float32, shape=source.shape)
+    for start in range(0, len(order), EXPORT_BATCH_SIZE):
+        target[start:start + EXPORT_BATCH_SIZE] = source[order[start:start + EXPORT_BATCH_SIZE]]
+    target.flush()
+    del source, target
+    os.replace(sorted_tmp, vectors_path)
+
+
+def topic_ranges(metadatas):
+    """Return {topic: (start, end)} for topics whose rows are contiguous."""
+    ranges = {}
+    counts = {}
+    for row, metadata in enumerate(metadatas):
+        topic = metadata.get('topic')
+        if not topic:
+            continue
+        start, _ = ranges.get(topic, (row, row))
+        ranges[topic] = (start, row + 1)
+        counts[topic] = counts.get(topic, 0) + 1
+    return {topic: span for topic, span in ranges.items() if span[1] - span[0] == counts[topic]}
+
+
+class NumpyVectorIndex:
+    """Memory-mapped, pre-normalized embedding matrix with exact top-k search."""
+
+    def __init__(self, vectors, ids, documents, metadatas, compact=None, rescore_factor=RESCORE_FACTOR):
+        self.vectors = vectors
+        self.compact = compact
+        self.rescore_factor = rescore_factor
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.topic_ranges = topic_ranges(metadatas)
+
+    @classmethod
+    def load(cls, index_dir=default_index_dir):
+        vectors = np.load(os.path.join(index_dir, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(index_dir, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            table = json.load(f)
+        # Rows past the id table (if the collection shrank mid-export) are unused
+        vectors = vectors[:len(table['ids'])]
+        compact = None
+        if os.path.exists(os.path.join(index_dir, COMPACT_FILE)):
+            compact = CompactVectors.load(index_dir)
+        return cls(vectors, table['ids'], table['documents'], table['metadatas'], compact)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_vectors, top_k=3, topic=None):
+        """Return, for each query, [(row, cosine similarity)] best first.
+
+        query_vectors may be a single vector or a 2-D batch. With a topic,
+        only that topic's rows are scored (none if the topic has no rows).
+        """
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        offset, end = self.topic_ranges.get(topic, (0, 0)) if topic else (0, len(self.ids))
+        n = end - offset
+        if n == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(top_k, n)
+        if self.compact is not None:
+            return self._search_compact(queries, k, offset, end)
+        scores = queries @ self.vectors[offset:end].T  # (batch, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (len(queries), 1))
+        results = []
+        for query_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-query_scores[rows])]
+            results.append([(offset + int(row), float(query_scores[row])) for row in rows])
+        return results
+
+    def _search_compact(self, queries, k, offset, end):
+        """Pick candidates from the compact scan, then rank them by exact cosine."""
+        n = end - offset
+        n_candidates = min(n, k * max(1, self.rescore_factor))
+        approximate = self.compact.scores(queries, offset, end)
+        if n_candidates < n:
+            candidates = np.argpartition(-approximate, n_candidates - 1, axis=1)[:, :n_candidates]
+        else:
+            candidates = np.tile(np.arange(n), (len(queries), 1))
+        results = []
+        for query, rows in zip(queries, candidates):
+            rows = np.sort(rows) + offset
+            # Only the candidate rows of the float32 matrix are read
+            exact = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            best = np.argsort(-exact)[:k]
+            results.append([(int(rows[i]), float(exact[i])) for i in best])
+        return results
+
+    def query(self, query_vectors, top_k=3, topic=None, chunk_vectors=None):
+        """Return, for each query, [(document, metadata)] best first.
+
+        With a context_packer.ChunkVectors, the stored vectors of the returned
+        rows are recorded in it.
+        """
+        results = []
+        for hits in self.search(query_vectors, top_k, topic):
+            rows = [row for row, _ in hits]
+            if chunk_vectors is not None and rows:
+                chunk_vectors.put([self.documents[row] for row in rows], self.vectors[rows])
+            results.append([(self.documents[row], self.metadatas[row]) for row in rows])
+        return results
+
+
+class VectorIndexHandle:
+    """Lazily loads the on-disk index and reloads it when the collection changes.
+
+    If no export exists yet, or its chunk count no longer matches the
+    collection's (another process may have re-ingested), the collection is
+    exported on first use.
+    """
+
+    _unset = object()
+
+    def __init__(self, registry, index_dir=default_index_dir):
+        self.registry = registry
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = self._unset
+
+    def get(self):
+        """Return the loaded index, or None if it could not be loaded or built."""
+        version = self.registry.version()
+        if self._version == version:
+            return self._index
+        with self._lock:
+            if self._version != version:
+                self._index = None
+                try:
+                    count = self.registry.run(lambda collection: collection.count())
+                    manifest = read_manifest(self.index_dir)
+                    if manifest is None or manifest.get('chunk_count') != count:
+                        if manifest is not None:
+                            print("Vector index export is stale; exporting again")
+                        manifest = export_collection(self.registry, self.index_dir)
+                    if manifest is not None:
+                        self._index = NumpyVectorIndex.load(self.index_dir)
+                except Exception as e:
+                    print(f"Error loading vector index: {e}")
+                self._version = version
+            return self._index
+
+    def rebuild(self):
+        """Re-export the collection and load the new matrix."""
+        export_collection(self.registry, self.index_dir)
+        with self._lock:
+            self._index = None
+            self._version = self._unset
+        return self.get()
+
+    def clear(self):
+        """Delete the export; the next get() exports the collection again."""
+        with self._lock:
+            self._index = None
+            self._version = self._unset
+            for filename in (MANIFEST_FILE, VECTORS_FILE, CHUNKS_FILE):
+                try:
+                    os.remove(os.path.join(self.index_dir, filename))
+                except FileNotFoundError:
+                    pass
+            _remove_compact_files(self.index_dir)
+
+
+def load_report_queries(path=os.path.join(project_root, "extracted_questions.txt")):
+    """The extracted exam questions, one per blank-line separated block."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [block.strip() for block in f.read().split('\n\n') if block.strip()]
+
+
+def compression_report(query_vectors, vectors, k=5, configs=None, rescore_factor=RESCORE_FACTOR):
+    """Memory against recall@k for each (storage, pca_dim) config.
+
+    Recall is measured against the exact float32 top-k, with and without
+    float32 re-scoring of the compact scan's candidates.
+    """
+    queries = normalize_rows(query_vectors)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    k = min(k, n)
+    n_candidates = min(n, k * max(1, rescore_factor))
+    if configs is None:
+        configs = [('float16', 0), ('int8', 0), ('float16', dim // 2), ('int8', dim // 2), ('int8', dim // 4)]
+
+    exact = queries @ vectors.T
+    truth = [set(row) for row in np.argsort(-exact, axis=1)[:, :k]]
+    report = [{
+        'storage': 'float32', 'pca_dim': 0, 'bytes': vectors.nbytes, 'memory_saved': 0.0,
+        'recall': 1.0, 'recall_rescored': 1.0
+    }]
+    for storage, pca_dim in configs:
+        compact = CompactVectors.from_vectors(vectors, storage, pca_dim)
+        approximate = compact.scores(queries)
+        order = np.argsort(-approximate, axis=1)
+        hits = hits_rescored = 0
+        for i, rows in enumerate(order):
+            hits += len(truth[i].intersection(rows[:k]))
+            candidates = rows[:n_candidates]
+            rescored = candidates[np.argsort(-exact[i, candidates])[:k]]
+            hits_rescored += len(truth[i].intersection(rescored))
+        total = len(queries) * k
+        report.append({
+            'storage': storage,
+            'pca_dim': pca_dim,
+            'bytes': compact.nbytes,
+            'memory_saved': 1 - compact.nbytes / vectors.nbytes,
+            'recall': hits / total if total else 0.0,
+            'recall_rescored': hits_rescored / total if total else 0.0
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # python vector_index.py [--report] [k]: export the collection, or report on the export
+    if "--report" in sys.argv:
+        from embeddings import get_embedder
+        args = [a for a in sys.argv[1:] if a != "--report"]
+        k = int(args[0]) if args else 5
+        questions = load_report_queries()
+        full = np.load(os.path.join(default_index_dir, VECTORS_FILE), mmap_mode='r')
+        rows = compression_report(get_embedder().encode(questions), full, k)
+        print(f"{len(questions)} questions, {len(full)} vectors, recall@{k}, "
+              f"re-scoring {k * RESCORE_FACTOR} candidates")
+        print(f"{'storage':<9}{'pca':>5}{'bytes':>12}{'saved':>8}{'recall':>8}{'rescored':>10}")
+        for row in rows:
+            print(f"{row['storage']:<9}{row['pca_dim'] or '-':>5}{row['bytes']:>12}"
+                  f"{row['memory_saved']:>8.1%}{row['recall']:>8.3f}{row['recall_rescored']:>10.3f}")
+    else:
+        from chroma_pool import get_registry
+        export_collection(get_registry(os.path.join(project_root, "db", "chroma_db_test")))